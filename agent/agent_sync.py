@@ -0,0 +1,80 @@
+import json
+import uuid
+import asyncio
+from typing import Optional
+
+import redis.asyncio as redis
+
+from conf import config
+from utils import logger
+
+CHANNEL = "agents:admin"
+
+class AgentSync:
+    """Applies the admin agent changes of one web worker to every other worker through Redis pub/sub, so an agent
+    added or removed behind a load balancer is added or removed everywhere. With the gateway the worker that took the
+    request already changed the shared servers, the others only update their own agent set"""
+    def __init__(self, manager, redis_client: redis.Redis):
+        self.manager = manager
+        self.redis_client = redis_client
+        self.origin = uuid.uuid4().hex
+        self._listener: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_config(cls, manager, redis_client: redis.Redis) -> Optional["AgentSync"]:
+        if not config.getboolean("admin", "sync", fallback=True):
+            return None
+        return cls(manager, redis_client)
+
+    async def publish(self, op: str, name: str, mcp_config: Optional[dict] = None):
+        try:
+            await self.redis_client.publish(CHANNEL, json.dumps({"origin": self.origin, "op": op, "name": name, "config": mcp_config}))
+        except Exception as e:
+            logger.error(f"Error publishing the {op} of agent {name} to the other workers: {e}")
+
+    async def apply(self, change: dict):
+        name = change["name"]
+        logger.info(f"Applying {change['op']} of agent {name} from another worker")
+        if change["op"] == "add":
+            await self.manager.add_agent(name, change["config"])
+        elif change["op"] == "remove":
+            await self.manager.remove_agent(name, gateway=False)
+        elif change["op"] == "restart":
+            try:
+                await self.manager.restart_agent(name, gateway=False)
+            except KeyError:
+                pass
+
+    async def _listen(self):
+        while True:
+            pubsub = self.redis_client.pubsub()
+            try:
+                await pubsub.subscribe(CHANNEL)
+                while True:
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                    if message is None:
+                        continue
+                    change = json.loads(message["data"])
+                    if change["origin"] == self.origin:
+                        continue
+                    try:
+                        await self.apply(change)
+                    except Exception as e:
+                        logger.error(f"Error applying {change['op']} of agent {change['name']}: {e}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Agent sync listener error: {e}")
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
+
+    def start(self):
+        if self._listener is None:
+            self._listener = asyncio.create_task(self._listen())
+
+    async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+            self._listener = None
@@ -1,12 +1,25 @@
 import os
+import time
 from typing import Optional, Dict, Any
 import dspy.primitives
 from pydantic import BaseModel, Field
 import asyncio
 from agent.tool_agent import ToolAgent
+from agent.gateway import shared_connection
+from agent.description_cache import DescriptionCache
+from agent.scheduler import PlanScheduler
+from agent.answer_cache import SemanticAnswerCache
+from agent.tool_cache import ToolResultCache
+from agent.compaction import ObservationCompactor
+from agent.context_packer import ContextPacker
+from agent.programs import ProgramRegistry
+from agent.coalescing import QueryCoalescer
+from agent.router import QuestionRouter
+from agent.lm_router import ModelRouter
 import dspy
 from conf import config
 from utils import logger
+from utils.telemetry import span, MCP_EVICTIONS
 
 class PlanModel(BaseModel):
     plan_id: int = Field(description="The sequence number indicating the order of execution for this agent in the plan")
@@ -14,6 +27,7 @@ class PlanModel(BaseModel):
     agent_input: str = Field(description="The input to the agent that leads agent to return the result as target")
     agent_context: str = Field(description="The context of the agent that leads agent to return the result as target")
     agent_target: str = Field(description="The specific target of the agent to execute the task")
+    depends_on: list[int] = Field(default_factory=list, description="plan_id of the earlier steps whose results this step needs as input, empty when the step can run independently")
 
 class AgentToolManagerSignature(dspy.Signature):
     question: str = dspy.InputField(description="High level question or input from user")
@@ -32,6 +46,8 @@ class AgentOutputAdvisor(dspy.Signature):
     format_output: str = dspy.OutputField(description="""The output format of the answer to user, what is the layout, sessions, should it contained table, markdown, or text, tree, ...
 Purpose of this output is to help the agent to generate the output in the best format""")
 
+DEFAULT_DISPLAY_FORMAT = "markdown"
+
 class AgentToolManager(dspy.Module):
     def __init__(self, mcp_config:Optional[Dict[str, Any]] = None):
         self.lm = dspy.LM(
@@ -49,19 +65,54 @@ class AgentToolManager(dspy.Module):
         self._lock = asyncio.Lock()
         self._current_config: Optional[Dict[str, Any]] = mcp_config
         self.description = ""
+        self._description_cache = DescriptionCache()
+        self._connect_timeout = config.getfloat("mcp", "connect_timeout", fallback=5)
+        self._describe_timeout = config.getfloat("mcp", "describe_timeout", fallback=120)
+        self._probe_interval = config.getfloat("mcp", "probe_interval", fallback=30)
+        self._probe_timeout = config.getfloat("mcp", "probe_timeout", fallback=10)
+        self._restart_backoff = config.getfloat("mcp", "restart_backoff", fallback=5)
+        self._restart_backoff_max = config.getfloat("mcp", "restart_backoff_max", fallback=300)
+        self._drain_timeout = config.getfloat("mcp", "drain_timeout", fallback=60)
+        self._status: Dict[str, dict] = {}
+        self._agent_locks: Dict[str, asyncio.Lock] = {}
+        self._retiring: set[asyncio.Task] = set()
+        self._probe: Optional[asyncio.Task] = None
+        self._lazy = config.getboolean("mcp", "lazy", fallback=False)
+        self._idle_ttl = config.getfloat("mcp", "idle_ttl", fallback=600)
+        self._always_warm = {name.strip() for name in config.get("mcp", "always_warm", fallback="").split(",") if name.strip()}
+        self._cold: Dict[str, str] = {}
+        self._scheduler = PlanScheduler.from_config()
+        self.answer_cache = SemanticAnswerCache.from_config()
+        self.tool_cache = ToolResultCache.from_config()
+        self.compactor = ObservationCompactor.from_config()
+        self.packer = ContextPacker.from_config()
+        self.coalescer = QueryCoalescer.from_config()
+        self.router = QuestionRouter.from_config(lm=self.lm)
         self._coodinator = dspy.ChainOfThought(AgentToolManagerSignature)
         self._conclusion = dspy.ChainOfThought(AgentToolManagerConclusion)
         self._output_advisor = dspy.ChainOfThought(AgentOutputAdvisor)
+        self.programs = ProgramRegistry.from_config()
+        if self.programs is not None:
+            for stage, module in self.stage_modules().items():
+                self.programs.load(module, "stages", stage)
+        self._conclusion_stream = dspy.streamify(
+            self._conclusion,
+            stream_listeners=[dspy.streaming.StreamListener(signature_field_name="final_answer")]
+        )
+        self.models = ModelRouter.from_config(tool_lm=self.lm, conclusion_lm=self.conclusion_lm)
         self.change_mode(mode="free")
 
+    def stage_modules(self) -> Dict[str, dspy.Module]:
+        return {"coordinator": self._coodinator, "advisor": self._output_advisor, "conclusion": self._conclusion}
+
     def change_mode(self, mode: str = "free"):
-        """Change the mode of the agent tool manager"""
-        if mode == "free":
-            self._coodinator.set_lm(self.lm)
-            self._conclusion.set_lm(self.conclusion_lm)
-            self._output_advisor.set_lm(self.lm)
-        else:
-            raise ValueError("Unsupported mode, only 'free' is supported for now")
+        """Change the mode of the agent tool manager, 'free' or any [mode.<name>] section of the config"""
+        self.models.set_mode(mode)
+        self._coodinator.set_lm(self.models.default_lm("coordinator"))
+        self._conclusion.set_lm(self.models.default_lm("conclusion"))
+        self._output_advisor.set_lm(self.models.default_lm("advisor"))
+        if self.router is not None:
+            self.router.set_lm(self.models.default_lm("advisor"))
         
     async def load_agent(self):
         """Create agent for each MCP tool collection"""
@@ -73,28 +124,236 @@ class AgentToolManager(dspy.Module):
         logger.info("Loading new agent")
         
         async with self._lock:
-            for k,v in self._current_config.items():
-                try:
-                    self._agents[k] = ToolAgent(mcp_config=v, agent_name=k, lm=self.lm)
-                    await asyncio.wait_for(self._agents[k].connect(), timeout=5)
-                    self.description += f"""
+            names = []
+            for k in self._current_config:
+                # lazy agents whose description is cached start on first use instead of now
+                description = self._description_cache.latest_for(k, self._current_config[k]) if self._lazy and k not in self._always_warm else None
+                if description is None:
+                    names.append(k)
+                    continue
+                self._cold[k] = description
+                self._state(k)["status"] = "cold"
+            # every MCP client enters its stdio transport in a runner task of its own, so close_agent can exit it
+            # from another task even though these connects run in gather's child tasks
+            agents = await asyncio.gather(*[self._connect_agent(k, self._current_config[k]) for k in names])
+            for k, agent in zip(names, agents):
+                if agent is None:
+                    continue
+                self._agents[k] = agent
+            self._rebuild_description()
+
+    def _rebuild_description(self):
+        descriptions = {**self._cold, **{k: agent.agent_description for k, agent in self._agents.items()}}
+        self.description = "".join(f"""
 <agent>
 <name>{k}</name>
-<capabilities>{self._agents[k].agent_description}</capabilities>
-</agent>"""
-                except asyncio.TimeoutError:
-                    logger.error(f"Timeout during setup MCP: {k}")
-                    if k in self._agents:
-                        await self._agents[k].__aexit__(None, None, None)
-                        del self._agents[k]
-                    continue
+<capabilities>{description}</capabilities>
+</agent>""" for k, description in descriptions.items())
+
+    def agent_names(self) -> list[str]:
+        """Every agent the coordinator may plan with, running or cold"""
+        return list(self._agents) + [name for name in self._cold if name not in self._agents]
+
+    def _state(self, name:str) -> dict:
+        return self._status.setdefault(name, {"status": "starting", "restarts": 0, "failures": 0, "last_error": "", "last_probe": None, "retry_at": 0.0,
+                                              "cold_starts": 0, "evictions": 0})
+
+    def _mark_failed(self, name:str, error:str):
+        state = self._state(name)
+        state["failures"] += 1
+        state["status"] = "failed"
+        state["last_error"] = error
+        state["retry_at"] = time.monotonic() + min(self._restart_backoff_max, self._restart_backoff * 2 ** (state["failures"] - 1))
+
+    async def _connect_agent(self, name:str, mcp_config:Dict[str, Any]) -> Optional[ToolAgent]:
+        """Connect a single MCP server, returns None when the server fails to start"""
+        agent = ToolAgent(mcp_config=mcp_config, agent_name=name, lm=self.lm, description_cache=self._description_cache, tool_cache=self.tool_cache, compactor=self.compactor, programs=self.programs)
+        previous_status = self._state(name)["status"]
+        self._state(name)["status"] = "starting"
+        try:
+            await agent.connect(connect_timeout=self._connect_timeout, describe_timeout=self._describe_timeout)
+            self._state(name).update(status="ready", failures=0, last_error="")
+            return agent
+        except asyncio.TimeoutError:
+            logger.error(f"Timeout during setup MCP: {name}")
+            self._mark_failed(name, f"connect timed out after {self._connect_timeout}s")
+        except Exception as e:
+            logger.error(f"Error during setup MCP: {name} {e}")
+            self._mark_failed(name, str(e) or type(e).__name__)
+        except BaseException:
+            # a cancelled start, e.g. the request behind a cold start went away, must not leave the server running
+            self._state(name)["status"] = previous_status
+            await agent.__aexit__(None, None, None)
+            raise
+        await agent.__aexit__(None, None, None)
+        return None
+
+    async def add_agent(self, name:str, mcp_config:Dict[str, Any]) -> bool:
+        """Start (or replace) one MCP server without touching the others. The new agent is fully connected
+        before it is swapped in, the old one keeps serving the calls already running on it and closes after"""
+        async with self._agent_locks.setdefault(name, asyncio.Lock()):
+            return await self._swap_in(name, mcp_config)
+
+    async def _swap_in(self, name:str, mcp_config:Dict[str, Any]) -> bool:
+        agent = await self._connect_agent(name, mcp_config)
+        if agent is None:
+            return False
+        async with self._lock:
+            previous = self._agents.get(name)
+            self._agents[name] = agent
+            self._cold.pop(name, None)
+            self._current_config = {**(self._current_config or {}), name: mcp_config}
+            self._rebuild_description()
+        if previous is not None:
+            self._retire(name, previous)
+        logger.info(f"Agent {name} is ready")
+        return True
+
+    async def get_agent(self, name:str) -> ToolAgent:
+        """The running agent, a cold one is started first and concurrent first uses share that start"""
+        agent = self._agents.get(name)
+        if agent is not None:
+            return agent
+        if name not in (self._current_config or {}):
+            raise KeyError(f"Unknown agent {name}")
+        async with self._agent_locks.setdefault(name, asyncio.Lock()):
+            if name not in self._agents:
+                started = time.perf_counter()
+                with span("mcp_cold_start", agent=name):
+                    if not await self._swap_in(name, self._current_config[name]):
+                        raise RuntimeError(f"Agent {name} failed to start: {self._state(name)['last_error']}")
+                self._state(name)["cold_starts"] += 1
+                logger.info(f"Cold start of agent {name} took {time.perf_counter() - started:.2f}s")
+            return self._agents[name]
+
+    async def evict_idle(self):
+        """Stop lazy agents unused for idle_ttl, their description stays so the coordinator still plans with them"""
+        if not self._lazy:
+            return
+        now = time.monotonic()
+        for name, agent in list(self._agents.items()):
+            if name in self._always_warm or agent.inflight > 0 or now - agent.last_used < self._idle_ttl:
+                continue
+            lock = self._agent_locks.setdefault(name, asyncio.Lock())
+            if lock.locked():
+                continue
+            async with lock:
+                async with self._lock:
+                    if self._agents.get(name) is not agent or agent.inflight > 0:
+                        continue
+                    del self._agents[name]
+                    self._cold[name] = agent.agent_description
+                    self._rebuild_description()
+                state = self._state(name)
+                state["status"] = "cold"
+                state["evictions"] += 1
+                MCP_EVICTIONS.inc(agent=name)
+                logger.info(f"Evicting agent {name}, idle for {now - agent.last_used:.0f}s")
+                self._retire(name, agent)
+
+    async def remove_agent(self, name:str, gateway:bool = True) -> bool:
+        """gateway=False only drops the agent from this worker, for a removal another worker already sent to the gateway"""
+        async with self._agent_locks.setdefault(name, asyncio.Lock()):
+            # with the gateway the servers live in the gateway process, stop them there
+            connection = shared_connection() if gateway else None
+            if connection is not None:
+                try:
+                    await connection.request("remove", agent=name)
                 except Exception as e:
-                    logger.error(f"Error during setup MCP: {k} {e}")
-                    if k in self._agents:
-                        await self._agents[k].__aexit__(None, None, None)
-                        del self._agents[k]
-                    continue
-    
+                    logger.error(f"Error removing agent {name} from the MCP gateway: {e}")
+            async with self._lock:
+                agent = self._agents.pop(name, None)
+                self._cold.pop(name, None)
+                known = name in (self._current_config or {})
+                self._current_config = {k: v for k, v in (self._current_config or {}).items() if k != name}
+                self._status.pop(name, None)
+                self._rebuild_description()
+            if agent is not None:
+                self._retire(name, agent)
+            return agent is not None or known
+
+    async def restart_agent(self, name:str, gateway:bool = True) -> bool:
+        if name not in (self._current_config or {}):
+            raise KeyError(name)
+        self._state(name)["restarts"] += 1
+        connection = shared_connection() if gateway else None
+        if connection is not None:
+            # a new agent would only reattach to the gateway's running servers, have the gateway replace them first
+            try:
+                await connection.request("connect", agent=name, config=self._current_config[name], restart=True)
+            except Exception as e:
+                logger.error(f"Error restarting agent {name} in the MCP gateway: {e}")
+                self._mark_failed(name, str(e) or type(e).__name__)
+                return False
+        return await self.add_agent(name, self._current_config[name])
+
+    def _retire(self, name:str, agent:ToolAgent):
+        """Close a replaced or removed agent once the calls running on it finish, or after drain_timeout"""
+        async def retire():
+            deadline = time.monotonic() + self._drain_timeout
+            while agent.inflight > 0 and time.monotonic() < deadline:
+                await asyncio.sleep(0.1)
+            logger.info(f"Closing retired agent {name}")
+            await agent.__aexit__(None, None, None)
+        task = asyncio.create_task(retire())
+        self._retiring.add(task)
+        task.add_done_callback(self._retiring.discard)
+
+    def start_probe(self):
+        if self._probe is None:
+            self._probe = asyncio.create_task(self._probe_loop())
+
+    async def stop_probe(self):
+        if self._probe is not None:
+            self._probe.cancel()
+            try:
+                await self._probe
+            except asyncio.CancelledError:
+                pass
+            self._probe = None
+
+    async def _probe_loop(self):
+        while True:
+            await asyncio.sleep(self._probe_interval)
+            await self.evict_idle()
+            await asyncio.gather(*[self.probe_agent(name) for name in list(self._current_config or {}) if name not in self._cold])
+
+    async def probe_agent(self, name:str):
+        """list_tools health check, failed or never started servers are restarted with exponential backoff"""
+        state = self._state(name)
+        agent = self._agents.get(name)
+        if agent is not None:
+            try:
+                await asyncio.wait_for(agent.client.list_tools(), timeout=self._probe_timeout)
+                state.update(status="ready", failures=0, last_probe=time.time())
+                return
+            except Exception as e:
+                logger.error(f"Health probe of agent {name} failed: {e}")
+                state.update(status="failed", last_error=str(e) or type(e).__name__, last_probe=time.time())
+        if time.monotonic() < state["retry_at"] or self._agent_locks.setdefault(name, asyncio.Lock()).locked():
+            return
+        logger.info(f"Restarting agent {name}, attempt {state['failures'] + 1}")
+        try:
+            await self.restart_agent(name)
+        except KeyError:
+            pass
+
+    def agent_status(self) -> Dict[str, dict]:
+        """Status, restarts, consecutive failures and last error of every configured agent"""
+        return {
+            name: {
+                "status": self._state(name)["status"],
+                "restarts": self._state(name)["restarts"],
+                "failures": self._state(name)["failures"],
+                "last_error": self._state(name)["last_error"],
+                "last_probe": self._state(name)["last_probe"],
+                "cold_starts": self._state(name)["cold_starts"],
+                "evictions": self._state(name)["evictions"],
+                "inflight": self._agents[name].inflight if name in self._agents else 0
+            }
+            for name in (self._current_config or {})
+        }
+
     async def close_agent(self):
         """Close the current agent and cleanup resources"""
         async with self._lock:
@@ -102,43 +361,138 @@ class AgentToolManager(dspy.Module):
                 logger.info(f"Closing agent {key}")
                 await agent.__aexit__(None, None, None)
             self._agents = {}
+            self._cold = {}
             self.description = ""
+        if self._retiring:
+            await asyncio.gather(*self._retiring, return_exceptions=True)
     
     def is_agent_ready(self) -> list[str]:
         """Check if agent is ready"""
         return list(self._agents.keys())
+
+    def pool_stats(self) -> Dict[str, dict]:
+        """Size, utilization and checkout wait of the MCP session pool of each agent"""
+        return {name: agent.client.stats() for name, agent in self._agents.items()}
     
-    async def acall(self, question:str, context:str = ""):
-        output_format, plan = await self.generate_output_format(question=question, context=context)
-        data_collection = await self.execute_plans_parallel(plan)
-        conclusion = await self._conclusion.acall(original_question=question, data_collection=data_collection, display_format=output_format)
-        #conclusion = await self._conclusion.acall(original_question=question, data_collection=data_collection)
-        return conclusion.final_answer
-
-    async def generate_output_format(self, question:str, context:str = ""):
+    async def acall(self, question:str, context:str = "", bypass_cache:bool = False, mode:Optional[str] = None, coalesce:bool = True):
+        """Answer the question, identical requests already running share their answer unless coalesce is False"""
+        if self.coalescer is None or not coalesce:
+            return await self._acall(question=question, context=context, bypass_cache=bypass_cache, mode=mode)
+        key = self.coalescer.key(question, context, bypass_cache=bypass_cache, mode=mode)
+        return await self.coalescer.call(key, lambda: self._acall(question=question, context=context, bypass_cache=bypass_cache, mode=mode))
+
+    async def _acall(self, question:str, context:str = "", bypass_cache:bool = False, mode:Optional[str] = None):
+        use_cache = self.answer_cache is not None and not bypass_cache
+        if use_cache:
+            cached = await self.answer_cache.lookup(question=question, context=context)
+            if cached is not None:
+                return cached
+        answer, output_format, plan = await self.plan(question=question, context=context, mode=mode)
+        if answer is None:
+            started = time.perf_counter()
+            data_collection = self.pack(question, await self.execute_plans_parallel(plan))
+            self._record_stage("agents", started)
+            started = time.perf_counter()
+            conclusion = await self.models.acall("conclusion", self._conclusion, mode=mode, original_question=question, data_collection=data_collection, display_format=output_format)
+            #conclusion = await self._conclusion.acall(original_question=question, data_collection=data_collection)
+            self._record_stage("conclusion", started)
+            answer = conclusion.final_answer
+        if use_cache:
+            await self.answer_cache.store(question=question, context=context, answer=answer)
+        return answer
+
+    def astream(self, question:str, context:str = "", bypass_cache:bool = False, mode:Optional[str] = None, coalesce:bool = True):
+        """Same pipeline as acall, but yields an event as soon as each stage produces something. Identical streams
+        already running are joined and replayed from their first event unless coalesce is False"""
+        if self.coalescer is None or not coalesce:
+            return self._astream(question=question, context=context, bypass_cache=bypass_cache, mode=mode)
+        key = self.coalescer.key(question, context, bypass_cache=bypass_cache, mode=mode)
+        return self.coalescer.stream(key, lambda: self._astream(question=question, context=context, bypass_cache=bypass_cache, mode=mode))
+
+    async def _astream(self, question:str, context:str = "", bypass_cache:bool = False, mode:Optional[str] = None):
+        use_cache = self.answer_cache is not None and not bypass_cache
+        if use_cache:
+            cached = await self.answer_cache.lookup(question=question, context=context)
+            if cached is not None:
+                yield {"type": "final", "result": cached, "cached": True}
+                return
+        answer, output_format, plan = await self.plan(question=question, context=context, mode=mode)
+        if answer is not None:
+            if use_cache:
+                await self.answer_cache.store(question=question, context=context, answer=answer)
+            yield {"type": "final", "result": answer}
+            return
+        yield {"type": "plan", "output_format": output_format, "execution_plan": [step.model_dump() for step in plan]}
+
+        data_collection = [None] * len(plan)
+        async for index, data, stats in self.iter_plan_results(plan):
+            data_collection[index] = {**data, "status": stats["status"]}
+            yield {"type": "agent_result", "plan_id": plan[index].plan_id, **data, "stats": stats}
+        data_collection = self.pack(question, data_collection)
+
+        final_answer = ""
+        # tokens already sent can't be taken back, so a streamed conclusion uses the healthiest model without fallback
+        model_name, lm = self.models.pick("conclusion", mode)
+        started = time.perf_counter()
+        try:
+            with span("conclusion", model=model_name, streaming=True) as conclusion_span:
+                async for chunk in self._conclusion_stream(original_question=question, data_collection=data_collection, display_format=output_format, lm=lm):
+                    if isinstance(chunk, dspy.streaming.StreamResponse):
+                        yield {"type": "token", "content": chunk.chunk}
+                    elif isinstance(chunk, dspy.Prediction):
+                        final_answer = chunk.final_answer
+                        conclusion_span.record_usage(chunk)
+        except Exception as e:
+            self.models.observe(model_name, time.perf_counter() - started, e)
+            raise
+        self.models.observe(model_name, time.perf_counter() - started)
+        if use_cache:
+            await self.answer_cache.store(question=question, context=context, answer=final_answer)
+        yield {"type": "final", "result": final_answer}
+
+    async def plan(self, question:str, context:str = "", mode:Optional[str] = None):
+        """Route the question, returns (answer, None, None) for a direct answer, otherwise (None, output_format, plan)"""
+        if self.router is not None:
+            decision = await self.router.route(question=question, context=context, agent_description=self.description, agent_names=self.agent_names())
+            if decision.route == "direct":
+                return decision.answer, None, None
+            if decision.route == "single_agent":
+                return None, DEFAULT_DISPLAY_FORMAT, [PlanModel(plan_id=1, agent_name=decision.agent_name, agent_input=question, agent_context=context, agent_target=question)]
+        started = time.perf_counter()
+        output_format, plan = await self.generate_output_format(question=question, context=context, mode=mode)
+        self._record_stage("planning", started)
+        return None, output_format, plan
+
+    def _record_stage(self, stage:str, started:float):
+        if self.router is not None:
+            self.router.record(stage, time.perf_counter() - started)
+
+    async def generate_output_format(self, question:str, context:str = "", mode:Optional[str] = None):
         tasks = [
-            self._output_advisor.acall(question=question, context=context),
-            self._coodinator.acall(question=question, context=context, agent_description=self.description)
+            self.models.acall("advisor", self._output_advisor, mode=mode, question=question, context=context),
+            self.models.acall("coordinator", self._coodinator, mode=mode, question=question, context=context, agent_description=self.description)
         ]
         output_format, plan = await asyncio.gather(*tasks)
         return output_format.format_output, plan.execution_plan
     
     async def execute_plans_parallel(self, execution_plan:list[PlanModel]):
-        # Create all tasks
-        tasks = []
-        for plan in execution_plan:
-            agent = self._agents[plan.agent_name]
-            task = agent.acall(plan.agent_input, plan.agent_target, plan.agent_context)
-            tasks.append(task)
-        
-        # Execute all tasks concurrently and get results in order
-        data_collection = await asyncio.gather(*tasks, return_exceptions=True)
+        # Independent steps run concurrently, results are returned in plan order
+        data_collection = [None] * len(execution_plan)
+        async for index, data, stats in self.iter_plan_results(execution_plan):
+            data_collection[index] = {**data, "status": stats["status"]}
+        return data_collection
 
-        data_collection = [
-            {
-                "agent_name": plan.agent_name,
-                "result": response.result if isinstance(response, dspy.primitives.prediction.Prediction) else str(response)
-            }
-            for plan, response in zip(execution_plan, data_collection)
-        ]
-        return data_collection
\ No newline at end of file
+    def pack(self, question:str, data_collection:list[dict]) -> list[dict]:
+        """Fit the agent results into the conclusion's token budget, or just drop the step status when packing is off"""
+        if self.packer is None:
+            return [{"agent_name": data["agent_name"], "result": data["result"]} for data in data_collection]
+        return self.packer.pack(question, data_collection)
+
+    def iter_plan_results(self, execution_plan:list[PlanModel]):
+        """Yield (index, data, stats) for each step of the plan as soon as its agent finishes"""
+        return self._scheduler.run(execution_plan, self._run_step)
+
+    async def _run_step(self, plan:PlanModel, context:str) -> str:
+        agent = await self.get_agent(plan.agent_name)
+        response = await agent.acall(plan.agent_input, plan.agent_target, context)
+        return response.result if isinstance(response, dspy.primitives.prediction.Prediction) else str(response)
@@ -0,0 +1,99 @@
+import time
+import asyncio
+import hashlib
+from typing import Optional
+
+import dspy
+import numpy as np
+
+from conf import config
+from utils import logger
+from utils.cache import TTLCache
+
+def context_key(context: str) -> str:
+    return hashlib.sha256(" ".join(context.split()).encode()).hexdigest()
+
+class SemanticAnswerCache:
+    """Local vector index of answered questions, a new question close enough to a stored one asked with exactly the
+    same context reuses its answer. Only the question is embedded, a long context would drown it in the vector"""
+    def __init__(self, embedder: dspy.Embedder, threshold: float = 0.92, ttl: float = 3600, max_entries: int = 1000):
+        self.embedder = embedder
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: list[dict] = []
+        self._matrix: Optional[np.ndarray] = None
+        self._embeddings = TTLCache(maxsize=256, ttl=60)
+
+    @classmethod
+    def from_config(cls) -> Optional["SemanticAnswerCache"]:
+        if not config.getboolean("answer_cache", "enabled", fallback=False):
+            return None
+        return cls(
+            embedder=dspy.Embedder(config.get("answer_cache", "embedding_model", fallback="openai/text-embedding-3-small")),
+            threshold=config.getfloat("answer_cache", "threshold", fallback=0.92),
+            ttl=config.getfloat("answer_cache", "ttl", fallback=3600),
+            max_entries=config.getint("answer_cache", "max_entries", fallback=1000)
+        )
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def _embed(self, question: str) -> np.ndarray:
+        vector = self._embeddings.get(question)
+        if vector is None:
+            vector = np.asarray((await asyncio.to_thread(self.embedder, [question]))[0], dtype=np.float32)
+            vector /= np.linalg.norm(vector) or 1.0
+            self._embeddings.set(question, vector)
+        return vector
+
+    def _remove(self, indexes: list[int]):
+        if not indexes:
+            return
+        drop = set(indexes)
+        self._entries = [entry for i, entry in enumerate(self._entries) if i not in drop]
+        self._matrix = None
+
+    def _evict_expired(self):
+        now = time.monotonic()
+        self._remove([i for i, entry in enumerate(self._entries) if entry["expires_at"] < now])
+
+    async def lookup(self, question: str, context: str = "") -> Optional[str]:
+        """Stored answer of the most similar question when its similarity passes the threshold"""
+        self._evict_expired()
+        key = context_key(context)
+        if not any(entry["context_key"] == key for entry in self._entries):
+            return None
+        try:
+            vector = await self._embed(question)
+        except Exception as e:
+            logger.error(f"Error embedding question for answer cache: {e}")
+            return None
+        if self._matrix is None:
+            self._matrix = np.stack([entry["vector"] for entry in self._entries])
+        scores = np.where([entry["context_key"] == key for entry in self._entries], self._matrix @ vector, -np.inf)
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            return None
+        self._entries[best]["last_used"] = time.monotonic()
+        logger.debug(f"Answer cache hit, similarity {scores[best]:.3f}")
+        return self._entries[best]["answer"]
+
+    async def store(self, question: str, context: str, answer: str, ttl: Optional[float] = None):
+        try:
+            vector = await self._embed(question)
+        except Exception as e:
+            logger.error(f"Error embedding question for answer cache: {e}")
+            return
+        now = time.monotonic()
+        self._entries.append({
+            "vector": vector,
+            "context_key": context_key(context),
+            "answer": answer,
+            "expires_at": now + (self.ttl if ttl is None else ttl),
+            "last_used": now
+        })
+        self._matrix = None
+        if len(self._entries) > self.max_entries:
+            by_last_used = sorted(range(len(self._entries)), key=lambda i: self._entries[i]["last_used"])
+            self._remove(by_last_used[:len(self._entries) - self.max_entries])
@@ -0,0 +1,101 @@
+import json
+import asyncio
+import hashlib
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional
+
+from conf import config
+from utils.telemetry import QUERIES_COALESCED
+
+class _StreamFlight:
+    """Events of one running stream, kept until it ends so late joiners can replay them from the start"""
+    def __init__(self):
+        self.events: list[dict] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.wake = asyncio.Event()
+
+    def publish(self, event: dict):
+        self.events.append(event)
+        self.wake.set()
+        self.wake = asyncio.Event()
+
+class QueryCoalescer:
+    """Single-flight for the query pipeline: identical questions asked at the same moment with the same context run
+    the pipeline once and every request gets its answer, or all of its stream events. The pipeline runs to the end
+    even if the request that started it goes away, the others are still waiting on it"""
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Future] = {}
+        self._streams: Dict[str, _StreamFlight] = {}
+        self._producers: set[asyncio.Task] = set()
+        self.leaders = 0
+        self.coalesced = 0
+
+    @classmethod
+    def from_config(cls) -> Optional["QueryCoalescer"]:
+        if not config.getboolean("coalescing", "enabled", fallback=True):
+            return None
+        return cls()
+
+    @staticmethod
+    def key(question: str, context: str = "", **options) -> str:
+        """Case and whitespace of the question do not matter, the context and every option do"""
+        normalized = " ".join(question.lower().split())
+        return hashlib.sha256(json.dumps([normalized, context, options], sort_keys=True, default=str).encode()).hexdigest()
+
+    def stats(self) -> dict:
+        return {
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "inflight": len(self._calls) + len(self._streams)
+        }
+
+    async def call(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            self.leaders += 1
+            task = asyncio.ensure_future(factory())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._calls.pop(key, None) if self._calls.get(key) is done else None)
+        else:
+            self.coalesced += 1
+            QUERIES_COALESCED.inc(kind="call")
+        # shield so a cancelled request does not cancel the pipeline the others are waiting on
+        return await asyncio.shield(task)
+
+    async def _produce(self, key: str, flight: _StreamFlight, events: AsyncIterator[dict]):
+        try:
+            async for event in events:
+                flight.publish(event)
+        except asyncio.CancelledError:
+            flight.error = RuntimeError("Query was cancelled")
+            raise
+        except Exception as e:
+            flight.error = e
+        finally:
+            flight.done = True
+            flight.wake.set()
+            if self._streams.get(key) is flight:
+                del self._streams[key]
+
+    async def stream(self, key: str, factory: Callable[[], AsyncIterator[dict]]) -> AsyncIterator[dict]:
+        flight = self._streams.get(key)
+        if flight is None:
+            self.leaders += 1
+            flight = self._streams[key] = _StreamFlight()
+            producer = asyncio.ensure_future(self._produce(key, flight, factory()))
+            self._producers.add(producer)
+            producer.add_done_callback(self._producers.discard)
+        else:
+            self.coalesced += 1
+            QUERIES_COALESCED.inc(kind="stream")
+        index = 0
+        while True:
+            while index < len(flight.events):
+                # every request gets its own copy, callers add their own thread id to the events
+                yield dict(flight.events[index])
+                index += 1
+            if flight.done:
+                if flight.error is not None:
+                    raise flight.error
+                return
+            await flight.wake.wait()
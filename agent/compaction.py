@@ -0,0 +1,149 @@
+import re
+import math
+from contextvars import ContextVar
+from contextlib import contextmanager
+from fnmatch import fnmatch
+from typing import Dict, Iterator, Optional
+
+import dspy
+
+from conf import config
+
+WORD = re.compile(r"\w+")
+WINDOW_CHARS = 400 # block size when the output has no line breaks, e.g. minified JSON
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4
+
+def tokenize(text: str) -> list[str]:
+    return [word for word in WORD.findall(text.lower()) if len(word) > 2]
+
+class ObservationLog:
+    """Raw tool outputs and token accounting of a single ToolAgent call"""
+    def __init__(self, query: str):
+        self.query_terms = set(tokenize(query))
+        self.raw: list[str] = []
+        self.tokens_in = 0
+        self.tokens_out = 0
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.tokens_in - self.tokens_out
+
+_current_log: ContextVar[Optional[ObservationLog]] = ContextVar("observation_log", default=None)
+
+def split_blocks(text: str) -> list[str]:
+    blocks = [block for block in re.split(r"\n\s*\n|\n", text) if block.strip()]
+    if len(blocks) <= 1:
+        blocks = [text[i:i + WINDOW_CHARS] for i in range(0, len(text), WINDOW_CHARS)]
+    return blocks
+
+def extract(text: str, query_terms: set[str], max_chars: int) -> str:
+    """The blocks sharing the most terms with the task, in their original order within max_chars.
+    The first block is always kept since it usually carries the title or the result header"""
+    blocks = split_blocks(text)
+    scores = [len(query_terms.intersection(tokenize(block))) / math.sqrt(len(block) + 1) for block in blocks]
+    if not any(scores[1:]):
+        # nothing matches the task, keep the head and the tail
+        head = max_chars * 2 // 3
+        return f"{text[:head]}\n...\n{text[-(max_chars - head):]}"
+    chosen, used = {0}, min(len(blocks[0]), max_chars)
+    for index in sorted(range(1, len(blocks)), key=lambda i: scores[i], reverse=True):
+        if scores[index] == 0 or used + len(blocks[index]) > max_chars:
+            continue
+        chosen.add(index)
+        used += len(blocks[index])
+    parts, previous = [], -1
+    for index in sorted(chosen):
+        if index != previous + 1:
+            parts.append("...")
+        parts.append(blocks[index][:max_chars])
+        previous = index
+    if previous != len(blocks) - 1:
+        parts.append("...")
+    return "\n".join(parts)
+
+class ObservationCompactor:
+    """Keeps ReAct trajectories small, every later iteration re-sends all observations so a tool output over the
+    agent's token budget is cut down to its most relevant passages. The raw output stays readable page by page
+    through the read_observation tool"""
+    def __init__(self, default_budget: int = 2000, budgets: Dict[str, int] = None):
+        self.default_budget = default_budget
+        self.budgets = budgets or {}
+        self.compacted = 0
+        self.tokens_saved = 0
+
+    @classmethod
+    def from_config(cls) -> Optional["ObservationCompactor"]:
+        """[compaction] enabled, max_tokens and max_tokens.<agent> overrides"""
+        if not config.getboolean("compaction", "enabled", fallback=True):
+            return None
+        budgets = {}
+        if config.has_section("compaction"):
+            for key, value in config.items("compaction"):
+                if key.startswith("max_tokens."):
+                    budgets[key.split(".", 1)[1]] = int(value)
+        return cls(default_budget=config.getint("compaction", "max_tokens", fallback=2000), budgets=budgets)
+
+    def budget_for(self, agent_name: str) -> int:
+        for pattern, budget in self.budgets.items():
+            if fnmatch(agent_name, pattern):
+                return budget
+        return self.default_budget
+
+    def stats(self) -> dict:
+        return {"compacted": self.compacted, "tokens_saved": self.tokens_saved}
+
+    @contextmanager
+    def track(self, query: str) -> Iterator[ObservationLog]:
+        """Collect the observations of one agent call, query is what the passages are ranked against"""
+        log = ObservationLog(query)
+        token = _current_log.set(log)
+        try:
+            yield log
+        finally:
+            _current_log.reset(token)
+            self.tokens_saved += log.tokens_saved
+
+    def compact(self, text: str, budget: int) -> str:
+        log = _current_log.get()
+        if log is None:
+            return text
+        tokens = estimate_tokens(text)
+        log.tokens_in += tokens
+        if tokens <= budget:
+            log.tokens_out += tokens
+            return text
+        ref = len(log.raw)
+        log.raw.append(text)
+        compacted = (extract(text, log.query_terms, budget * 4)
+                     + f"\n[compacted from ~{tokens} tokens, call read_observation with ref={ref} to read the full output page by page]")
+        log.tokens_out += estimate_tokens(compacted)
+        self.compacted += 1
+        return compacted
+
+    def wrap(self, agent_name: str, tool: dspy.Tool) -> dspy.Tool:
+        budget = self.budget_for(agent_name)
+        func = tool.func
+
+        async def compacted_func(**kwargs):
+            result = await func(**kwargs)
+            return self.compact(result, budget) if isinstance(result, str) else result
+
+        tool.func = compacted_func
+        return tool
+
+    def reader_tool(self, agent_name: str) -> dspy.Tool:
+        page_chars = self.budget_for(agent_name) * 4
+
+        async def read_observation(ref: int, page: int = 1) -> str:
+            log = _current_log.get()
+            if log is None or not 0 <= ref < len(log.raw):
+                return f"No compacted observation with ref={ref}"
+            text = log.raw[ref]
+            pages = max(1, math.ceil(len(text) / page_chars))
+            page = min(max(1, page), pages)
+            return f"{text[(page - 1) * page_chars:page * page_chars]}\n[page {page} of {pages}]"
+
+        return dspy.Tool(read_observation, name="read_observation",
+                         desc="Read the full output of a compacted observation, ref is the number given in the compaction note, pages start at 1")
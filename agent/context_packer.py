@@ -0,0 +1,101 @@
+import re
+import math
+from collections import Counter
+from typing import Optional
+
+from agent.compaction import estimate_tokens, tokenize
+from conf import config
+from utils.telemetry import span
+
+class ContextPacker:
+    """Bounds the data_collection sent to the conclusion: agent results are chunked, near-duplicate chunks across
+    agents are dropped and the rest ranked with BM25 against the question, the best chunks fill max_tokens"""
+    def __init__(self, max_tokens: int = 4000, chunk_tokens: int = 200, dedup_threshold: float = 0.8, k1: float = 1.5, b: float = 0.75):
+        self.max_tokens = max_tokens
+        self.chunk_tokens = chunk_tokens
+        self.dedup_threshold = dedup_threshold
+        self.k1 = k1
+        self.b = b
+
+    @classmethod
+    def from_config(cls) -> Optional["ContextPacker"]:
+        if not config.getboolean("context_packer", "enabled", fallback=True):
+            return None
+        return cls(
+            max_tokens=config.getint("context_packer", "max_tokens", fallback=4000),
+            chunk_tokens=config.getint("context_packer", "chunk_tokens", fallback=200),
+            dedup_threshold=config.getfloat("context_packer", "dedup_threshold", fallback=0.8)
+        )
+
+    def chunk(self, text: str) -> list[str]:
+        """Paragraphs merged up to chunk_tokens, longer paragraphs are cut into windows"""
+        size = self.chunk_tokens * 4
+        chunks, current = [], ""
+        for paragraph in re.split(r"\n\s*\n", text):
+            paragraph = paragraph.strip()
+            if not paragraph:
+                continue
+            pieces = [paragraph[i:i + size] for i in range(0, len(paragraph), size)]
+            for piece in pieces:
+                if current and len(current) + len(piece) > size:
+                    chunks.append(current)
+                    current = ""
+                current = f"{current}\n\n{piece}" if current else piece
+        if current:
+            chunks.append(current)
+        return chunks
+
+    def _shingles(self, tokens: list[str]) -> set:
+        return {hash(tuple(tokens[i:i + 3])) for i in range(max(1, len(tokens) - 2))}
+
+    def _bm25(self, query: list[str], documents: list[list[str]]) -> list[float]:
+        average = sum(len(document) for document in documents) / len(documents) or 1
+        frequency = Counter(term for document in documents for term in set(document))
+        scores = []
+        for document in documents:
+            counts = Counter(document)
+            score = 0.0
+            for term in set(query):
+                if term not in counts:
+                    continue
+                idf = math.log(1 + (len(documents) - frequency[term] + 0.5) / (frequency[term] + 0.5))
+                tf = counts[term]
+                score += idf * tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * len(document) / average))
+            scores.append(score)
+        return scores
+
+    def pack(self, question: str, data_collection: list[dict]) -> list[dict]:
+        """Same shape as data_collection, failed steps shrink to a one-line error"""
+        with span("context_packing") as packing_span:
+            errors = [{"agent_name": data["agent_name"], "error": str(data["result"])[:200]} for data in data_collection if data.get("status", "ok") != "ok"]
+            results = [data for data in data_collection if data.get("status", "ok") == "ok"]
+            tokens_in = sum(estimate_tokens(str(data["result"])) for data in data_collection)
+            packing_span.set("tokens_in", tokens_in)
+            if sum(estimate_tokens(str(data["result"])) for data in results) <= self.max_tokens:
+                packing_span.set("tokens_out", sum(estimate_tokens(str(data["result"])) for data in results))
+                return [{"agent_name": data["agent_name"], "result": data["result"]} for data in results] + errors
+
+            chunks = [(position, data["agent_name"], text) for position, data in enumerate(results) for text in self.chunk(str(data["result"]))]
+            tokens = [tokenize(text) for _, _, text in chunks]
+            scores = self._bm25(tokenize(question), tokens)
+            kept, kept_shingles, used, duplicates = [], [], 0, 0
+            # best first, so the copy that survives deduplication is the most relevant one
+            for index in sorted(range(len(chunks)), key=lambda i: (-scores[i], i)):
+                shingles = self._shingles(tokens[index])
+                if any(len(shingles & other) / (len(shingles | other) or 1) >= self.dedup_threshold for other in kept_shingles):
+                    duplicates += 1
+                    continue
+                size = estimate_tokens(chunks[index][2])
+                if used + size > self.max_tokens:
+                    continue
+                kept.append(index)
+                kept_shingles.append(shingles)
+                used += size
+
+            packed: dict[int, list[str]] = {}
+            for index in sorted(kept):
+                packed.setdefault(chunks[index][0], []).append(chunks[index][2])
+            packing_span.set("tokens_out", used)
+            packing_span.set("duplicates", duplicates)
+            packing_span.set("chunks", f"{len(kept)}/{len(chunks)}")
+            return [{"agent_name": results[position]["agent_name"], "result": "\n...\n".join(texts)} for position, texts in sorted(packed.items())] + errors
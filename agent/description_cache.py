@@ -0,0 +1,74 @@
+import os
+import json
+import asyncio
+import hashlib
+from typing import Optional, Dict
+
+from conf import config
+from utils import logger
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_CACHE_PATH = os.path.join(ROOT, ".cache", "agent_descriptions.json")
+
+def config_key(mcp_config: dict) -> str:
+    """Hash of the server's command, args and env, a changed config must not reuse the description of the old one"""
+    return hashlib.sha256(json.dumps(mcp_config, sort_keys=True, default=str).encode()).hexdigest()
+
+class DescriptionCache:
+    """Persistent cache of agent capability descriptions keyed by the hash of the server's list_tools schema"""
+    def __init__(self, path: Optional[str] = None):
+        # relative paths are taken from the repo root, not from wherever the server was started
+        self.path = os.path.join(ROOT, path or config.get("agent_cache", "path", fallback=DEFAULT_CACHE_PATH))
+        self._lock = asyncio.Lock()
+        self._entries: Dict[str, dict] = self._read()
+
+    def _read(self) -> Dict[str, dict]:
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except Exception as e:
+            logger.error(f"Error reading description cache {self.path}: {e}")
+            return {}
+
+    def _write(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._entries, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def get(self, tools_hash: str) -> Optional[str]:
+        entry = self._entries.get(tools_hash)
+        return entry["description"] if entry else None
+
+    def _latest(self, agent_name: str, mcp_config: dict) -> Optional[str]:
+        key = config_key(mcp_config)
+        for tools_hash, entry in reversed(list(self._entries.items())):
+            if entry["agent_name"] == agent_name and entry.get("config") == key:
+                return tools_hash
+        return None
+
+    def latest_for(self, agent_name: str, mcp_config: dict) -> Optional[str]:
+        """Most recently stored description of the agent started with this config, lets a server stay stopped while
+        the coordinator still knows it"""
+        tools_hash = self._latest(agent_name, mcp_config)
+        return self._entries[tools_hash]["description"] if tools_hash is not None else None
+
+    async def set(self, tools_hash: str, agent_name: str, description: str, mcp_config: dict):
+        entry = {
+            "agent_name": agent_name,
+            "description": description,
+            "config": config_key(mcp_config)
+        }
+        async with self._lock:
+            if self._entries.get(tools_hash) == entry and self._latest(agent_name, mcp_config) == tools_hash:
+                return
+            # re-inserted so the newest entry of an agent is always the last one
+            self._entries.pop(tools_hash, None)
+            self._entries[tools_hash] = entry
+            try:
+                await asyncio.to_thread(self._write)
+            except Exception as e:
+                logger.error(f"Error writing description cache {self.path}: {e}")
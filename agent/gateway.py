@@ -0,0 +1,159 @@
+"""Client side of the optional MCP gateway: with [gateway] enabled every web worker reaches the MCP servers through
+one gateway process (python -m agent.gateway_server) instead of spawning its own copy of each server"""
+import json
+import asyncio
+import itertools
+from typing import Any, Dict, Optional
+
+import dspy
+from mcp.types import Tool, CallToolResult, ListToolsResult
+
+from conf import config
+from utils import logger
+
+MAX_FRAME = 64 * 1024 * 1024 # one newline-delimited JSON message, tool results can be large
+
+class GatewayError(RuntimeError):
+    def __init__(self, message: str, code: str = ""):
+        super().__init__(message)
+        self.code = code
+
+async def send_message(writer: asyncio.StreamWriter, message: dict):
+    writer.write(json.dumps(message).encode() + b"\n")
+    await writer.drain()
+
+class GatewayConnection:
+    """A single Unix socket connection to the gateway, multiplexed between every agent of this worker"""
+    def __init__(self, path: str, timeout: float = 120):
+        self.path = path
+        self.timeout = timeout
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._ids = itertools.count(1)
+        self._lock = asyncio.Lock()
+
+    async def _ensure(self):
+        if self._reader_task is not None and not self._reader_task.done():
+            return
+        reader, self._writer = await asyncio.open_unix_connection(self.path, limit=MAX_FRAME)
+        self._reader_task = asyncio.create_task(self._read_loop(reader))
+
+    async def _read_loop(self, reader: asyncio.StreamReader):
+        try:
+            while line := await reader.readline():
+                message = json.loads(line)
+                future = self._pending.pop(message.get("id"), None)
+                if future is not None and not future.done():
+                    future.set_result(message)
+        except Exception as e:
+            logger.error(f"MCP gateway connection error: {e}")
+        finally:
+            # fail whatever is still waiting, the next request reconnects
+            pending, self._pending = self._pending, {}
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("MCP gateway connection closed"))
+            if self._writer is not None:
+                self._writer.close()
+
+    async def request(self, op: str, **params) -> Any:
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        try:
+            async with self._lock:
+                await self._ensure()
+                await send_message(self._writer, {"id": request_id, "op": op, **params})
+            response = await asyncio.wait_for(future, timeout=self.timeout)
+        finally:
+            self._pending.pop(request_id, None)
+        if "error" in response:
+            raise GatewayError(response["error"], response.get("code", ""))
+        return response["result"]
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        if self._reader_task is not None:
+            await asyncio.gather(self._reader_task, return_exceptions=True)
+            self._reader_task = None
+
+_connection: Optional[GatewayConnection] = None
+
+def shared_connection() -> Optional[GatewayConnection]:
+    """The gateway connection of this process, None when [gateway] is disabled"""
+    global _connection
+    if _connection is None and config.getboolean("gateway", "enabled", fallback=False):
+        _connection = GatewayConnection(
+            path=config.get("gateway", "socket", fallback="/tmp/jean-mcp.sock"),
+            timeout=config.getfloat("gateway", "request_timeout", fallback=120)
+        )
+    return _connection
+
+class GatewayClientPool:
+    """Stands in for MCPClientPool when the gateway is enabled, the sessions live in the gateway process"""
+    def __init__(self, agent_name: str, connection: GatewayConnection):
+        self.agent_name = agent_name
+        self.connection = connection
+        self.tools: list[Tool] = []
+        self.tools_hash = ""
+        self._mcp_config: Optional[dict] = None
+        self.calls = 0
+        self.inflight = 0
+        self.errors = 0
+
+    @classmethod
+    def from_config(cls, agent_name: str) -> Optional["GatewayClientPool"]:
+        connection = shared_connection()
+        return cls(agent_name, connection) if connection is not None else None
+
+    async def connect(self, mcp_config: dict) -> str:
+        self._mcp_config = mcp_config
+        result = await self.connection.request("connect", agent=self.agent_name, config=mcp_config)
+        self.tools = [Tool.model_validate(tool) for tool in result["tools"]]
+        self.tools_hash = result["tools_hash"]
+        return result["tool_information"]
+
+    async def _request(self, op: str, **params) -> Any:
+        try:
+            return await self.connection.request(op, agent=self.agent_name, **params)
+        except GatewayError as e:
+            # the gateway restarted and lost the agent, register it again once
+            if e.code != "unknown_agent" or self._mcp_config is None:
+                raise
+            await self.connect(self._mcp_config)
+            return await self.connection.request(op, agent=self.agent_name, **params)
+
+    async def call_tool(self, name: str, arguments: Optional[dict] = None, **kwargs):
+        """Same interface as ClientSession.call_tool, so dspy tools can be bound to the gateway"""
+        self.calls += 1
+        self.inflight += 1
+        try:
+            return CallToolResult.model_validate(await self._request("call_tool", name=name, arguments=arguments or {}))
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self.inflight -= 1
+
+    async def list_tools(self):
+        return ListToolsResult.model_validate(await self._request("list_tools"))
+
+    async def convert_to_dspy(self):
+        if not self.tools:
+            raise ValueError("Session is not connected")
+        return [dspy.Tool.from_mcp_tool(self, tool) for tool in self.tools]
+
+    def stats(self) -> dict:
+        return {"gateway": True, "calls": self.calls, "inflight": self.inflight, "errors": self.errors}
+
+    async def disconnect(self):
+        """The servers are shared with the other workers, the gateway decides when they stop"""
+        self.tools = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.disconnect()
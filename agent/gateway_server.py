@@ -0,0 +1,203 @@
+"""MCP gateway process: owns one MCPClientPool per agent and serves every web worker over a Unix socket.
+
+python -m agent.gateway_server
+"""
+import os
+import json
+import time
+import signal
+import asyncio
+from typing import Dict
+
+from agent.gateway import MAX_FRAME, GatewayError, send_message
+from agent.tool_agent import MCPClientPool
+from conf import config
+from utils import logger
+
+class MCPGateway:
+    """Workers register an agent with its server config on connect, the first registration starts the pool and
+    later ones reuse it while it still answers list_tools. With [mcp] lazy idle pools stop and restart on demand"""
+    def __init__(self, path: str, connect_timeout: float = 30, probe_timeout: float = 10, lazy: bool = False, idle_ttl: float = 600, always_warm: set = None,
+                 drain_timeout: float = 60):
+        self.path = path
+        self.connect_timeout = connect_timeout
+        self.probe_timeout = probe_timeout
+        self.lazy = lazy
+        self.idle_ttl = idle_ttl
+        self.always_warm = always_warm or set()
+        self.drain_timeout = drain_timeout
+        self.configs: Dict[str, dict] = {}
+        self.pools: Dict[str, dict] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._retiring: Dict[asyncio.Task, MCPClientPool] = {}
+
+    @classmethod
+    def from_config(cls) -> "MCPGateway":
+        return cls(
+            path=config.get("gateway", "socket", fallback="/tmp/jean-mcp.sock"),
+            connect_timeout=config.getfloat("gateway", "connect_timeout", fallback=30),
+            probe_timeout=config.getfloat("mcp", "probe_timeout", fallback=10),
+            lazy=config.getboolean("mcp", "lazy", fallback=False),
+            idle_ttl=config.getfloat("mcp", "idle_ttl", fallback=600),
+            always_warm={name.strip() for name in config.get("mcp", "always_warm", fallback="").split(",") if name.strip()},
+            drain_timeout=config.getfloat("mcp", "drain_timeout", fallback=60)
+        )
+
+    async def _connect(self, agent: str, mcp_config: dict, restart: bool = False) -> dict:
+        """Start the agent's pool, or reuse the running one unless restart is asked for. A new pool replaces the
+        previous one only once it is connected"""
+        async with self._locks.setdefault(agent, asyncio.Lock()):
+            entry = self.pools.get(agent)
+            if entry is not None and self.configs.get(agent) == mcp_config and not restart:
+                try:
+                    await asyncio.wait_for(entry["pool"].list_tools(), timeout=self.probe_timeout)
+                    entry["last_used"] = time.monotonic()
+                    return entry
+                except Exception as e:
+                    logger.error(f"Gateway agent {agent} failed its health check, restarting: {e}")
+            pool = MCPClientPool.from_config(agent)
+            try:
+                tool_information = await asyncio.wait_for(pool.connect(mcp_config), timeout=self.connect_timeout)
+            except BaseException:
+                await pool.disconnect()
+                raise
+            previous = self.pools.get(agent)
+            self.configs[agent] = mcp_config
+            self.pools[agent] = entry = {
+                "pool": pool,
+                "tool_information": tool_information,
+                "tools": [tool.model_dump(mode="json", by_alias=True, exclude_none=True) for tool in pool.clients[0].tools],
+                "last_used": time.monotonic()
+            }
+            if previous is not None:
+                self._retire(agent, previous["pool"])
+            logger.info(f"Gateway started agent {agent}")
+            return entry
+
+    async def _remove(self, agent: str) -> bool:
+        async with self._locks.setdefault(agent, asyncio.Lock()):
+            known = self.configs.pop(agent, None) is not None
+            entry = self.pools.pop(agent, None)
+        if entry is not None:
+            self._retire(agent, entry["pool"])
+            logger.info(f"Gateway removed agent {agent}")
+        return known
+
+    def _retire(self, agent: str, pool: MCPClientPool):
+        """Close a replaced or removed pool once the calls the workers are running on it finish, or after drain_timeout"""
+        async def retire():
+            deadline = time.monotonic() + self.drain_timeout
+            while pool.stats()["inflight"] > 0 and time.monotonic() < deadline:
+                await asyncio.sleep(0.1)
+            logger.info(f"Gateway closing retired pool of agent {agent}")
+            await pool.disconnect()
+        task = asyncio.create_task(retire())
+        self._retiring[task] = pool
+        task.add_done_callback(lambda done: self._retiring.pop(done, None))
+
+    async def _entry(self, agent: str) -> dict:
+        entry = self.pools.get(agent)
+        if entry is None:
+            if agent not in self.configs:
+                raise GatewayError(f"Unknown agent {agent}", code="unknown_agent")
+            logger.info(f"Gateway cold start of agent {agent}")
+            entry = await self._connect(agent, self.configs[agent])
+        entry["last_used"] = time.monotonic()
+        return entry
+
+    async def handle(self, message: dict):
+        op = message.get("op")
+        if op == "connect":
+            entry = await self._connect(message["agent"], message["config"], restart=message.get("restart", False))
+            return {"tool_information": entry["tool_information"], "tools_hash": entry["pool"].tools_hash, "tools": entry["tools"]}
+        if op == "remove":
+            return {"removed": await self._remove(message["agent"])}
+        if op == "stats":
+            return {agent: entry["pool"].stats() for agent, entry in self.pools.items()}
+        entry = await self._entry(message["agent"])
+        if op == "call_tool":
+            result = await entry["pool"].call_tool(message["name"], arguments=message.get("arguments"))
+            return result.model_dump(mode="json", by_alias=True, exclude_none=True)
+        if op == "list_tools":
+            return (await entry["pool"].list_tools()).model_dump(mode="json", by_alias=True, exclude_none=True)
+        raise GatewayError(f"Unknown operation {op}", code="unknown_op")
+
+    async def serve_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        write_lock = asyncio.Lock()
+        tasks: set[asyncio.Task] = set()
+
+        async def answer(message: dict):
+            try:
+                response = {"id": message.get("id"), "result": await self.handle(message)}
+            except GatewayError as e:
+                response = {"id": message.get("id"), "error": str(e), "code": e.code}
+            except Exception as e:
+                response = {"id": message.get("id"), "error": str(e) or type(e).__name__}
+            try:
+                async with write_lock:
+                    await send_message(writer, response)
+            except Exception as e:
+                logger.error(f"Gateway could not answer a worker: {e}")
+
+        try:
+            while line := await reader.readline():
+                task = asyncio.create_task(answer(json.loads(line)))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except Exception as e:
+            logger.error(f"Gateway worker connection error: {e}")
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+    async def evict_idle(self):
+        if not self.lazy:
+            return
+        now = time.monotonic()
+        for agent, entry in list(self.pools.items()):
+            if agent in self.always_warm or now - entry["last_used"] < self.idle_ttl:
+                continue
+            async with self._locks.setdefault(agent, asyncio.Lock()):
+                # a call may have started while waiting for the lock
+                if self.pools.get(agent) is not entry or entry["pool"].stats()["inflight"] > 0:
+                    continue
+                del self.pools[agent]
+                logger.info(f"Gateway evicting agent {agent}, idle for {now - entry['last_used']:.0f}s")
+            await entry["pool"].disconnect()
+
+    async def serve(self, stop: asyncio.Event):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        # whoever can reach the socket can start commands, so it is created 0600 instead of chmod-ed after the bind
+        umask = os.umask(0o177)
+        try:
+            server = await asyncio.start_unix_server(self.serve_client, path=self.path, limit=MAX_FRAME)
+        finally:
+            os.umask(umask)
+        logger.info(f"MCP gateway listening on {self.path}")
+        try:
+            while not stop.is_set():
+                try:
+                    await asyncio.wait_for(stop.wait(), timeout=30)
+                except asyncio.TimeoutError:
+                    await self.evict_idle()
+        finally:
+            server.close()
+            await server.wait_closed()
+            for task in list(self._retiring):
+                task.cancel()
+            pools = [entry["pool"] for entry in self.pools.values()] + list(self._retiring.values())
+            await asyncio.gather(*[pool.disconnect() for pool in pools], return_exceptions=True)
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+async def main():
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await MCPGateway.from_config().serve(stop)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -32,6 +32,13 @@ def generate_agent_description(information: str) -> str:
         logger.error(f"Error generating agent description: {e}")
         return information
 
+async def agenerate_agent_description(information: str) -> str:
+    try:
+        return (await internal_generator.acall(information=information)).output
+    except Exception as e:
+        logger.error(f"Error generating agent description: {e}")
+        return information
+
 def extract_memory_info(question: str, answer: str, memory: str) -> str:
     try:
         return memory_info_extract(memory=memory, question=question, answer=answer).information
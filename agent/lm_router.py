@@ -0,0 +1,168 @@
+import time
+import asyncio
+from collections import deque
+from typing import Dict, Optional
+
+import dspy
+
+from conf import config
+from utils import logger
+from utils.telemetry import span
+
+STAGES = ("coordinator", "advisor", "conclusion")
+
+def is_overloaded_error(error: Exception) -> bool:
+    """Timeouts and rate limits put the model in cooldown instead of only counting as an error"""
+    return isinstance(error, (asyncio.TimeoutError, TimeoutError)) or getattr(error, "status_code", None) in (408, 429)
+
+class ModelHealth:
+    """Rolling latency percentiles and error rate of one model"""
+    def __init__(self, window: int = 100):
+        self.samples: deque[tuple[float, bool]] = deque(maxlen=window)
+        self.cooldown_until = 0.0
+
+    def observe(self, latency: float, ok: bool):
+        self.samples.append((latency, ok))
+
+    def percentile(self, q: float) -> Optional[float]:
+        latencies = sorted(latency for latency, ok in self.samples if ok)
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+    @property
+    def error_rate(self) -> float:
+        if not self.samples:
+            return 0.0
+        return sum(1 for _, ok in self.samples if not ok) / len(self.samples)
+
+    @property
+    def cooling_down(self) -> bool:
+        return self.cooldown_until > time.monotonic()
+
+    def stats(self) -> dict:
+        return {
+            "samples": len(self.samples),
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+            "error_rate": round(self.error_rate, 3),
+            "cooling_down": self.cooling_down
+        }
+
+class ModelRouter:
+    """Latency-aware model selection for the coordinator, advisor and conclusion calls.
+    A mode lists candidate models per stage in preference order, a candidate is demoted while it cools
+    down after a timeout or 429, while its error rate is too high or while its p95 exceeds the latency
+    budget. Failed calls fall back to the next candidate"""
+    def __init__(self, models: Dict[str, dspy.LM], modes: Dict[str, Dict[str, list[str]]], timeout: float = 60,
+                 latency_budget: float = 20, max_error_rate: float = 0.2, cooldown: float = 30, min_samples: int = 5):
+        self.models = models
+        self.modes = modes
+        self.timeout = timeout
+        self.latency_budget = latency_budget
+        self.max_error_rate = max_error_rate
+        self.cooldown = cooldown
+        self.min_samples = min_samples
+        self.health = {name: ModelHealth() for name in models}
+        self.mode = "free"
+
+    @classmethod
+    def from_config(cls, tool_lm: dspy.LM, conclusion_lm: dspy.LM) -> "ModelRouter":
+        """Models come from [lm.<name>] sections and modes from [mode.<name>] sections, a mode maps each
+        stage to a comma separated list of model names. tool_llm and conclusion_llm are always available"""
+        models = {"tool_llm": tool_lm, "conclusion_llm": conclusion_lm}
+        modes = {"free": {"coordinator": ["tool_llm"], "advisor": ["tool_llm"], "conclusion": ["conclusion_llm"]}}
+        for section in config.sections():
+            if section.startswith("lm."):
+                models[section[3:]] = dspy.LM(
+                    model=config.get(section, "model"),
+                    api_key=config.get(section, "api_key", fallback=None),
+                    max_tokens=config.getint(section, "max_tokens", fallback=6000),
+                    num_retries=config.getint(section, "num_retries", fallback=1)
+                )
+        for section in config.sections():
+            if section.startswith("mode."):
+                mode = {stage: [name.strip() for name in config.get(section, stage, fallback="").split(",") if name.strip()] for stage in STAGES}
+                for stage, names in mode.items():
+                    unknown = [name for name in names if name not in models]
+                    if unknown:
+                        raise ValueError(f"[{section}] {stage} refers to unknown models {', '.join(unknown)}, define them in [lm.<name>] sections")
+                    if not names:
+                        raise ValueError(f"[{section}] has no model configured for {stage}")
+                modes[section[5:]] = mode
+        return cls(
+            models=models,
+            modes=modes,
+            timeout=config.getfloat("model_router", "timeout", fallback=60),
+            latency_budget=config.getfloat("model_router", "latency_budget", fallback=20),
+            max_error_rate=config.getfloat("model_router", "max_error_rate", fallback=0.2),
+            cooldown=config.getfloat("model_router", "cooldown", fallback=30),
+            min_samples=config.getint("model_router", "min_samples", fallback=5)
+        )
+
+    def validate_mode(self, mode: str):
+        if mode not in self.modes:
+            raise ValueError(f"Unsupported mode '{mode}', supported modes: {', '.join(self.modes)}")
+        for stage in STAGES:
+            if not self.modes[mode].get(stage):
+                raise ValueError(f"Mode '{mode}' has no model configured for {stage}")
+
+    def set_mode(self, mode: str):
+        self.validate_mode(mode)
+        self.mode = mode
+
+    def candidates(self, stage: str, mode: Optional[str] = None) -> list[str]:
+        """Models of the stage for the given or current mode, healthiest first"""
+        if mode is not None:
+            self.validate_mode(mode)
+        names = self.modes[mode or self.mode].get(stage)
+        if not names:
+            raise ValueError(f"Mode '{mode or self.mode}' has no model configured for {stage}")
+        def rank(item):
+            order, name = item
+            health = self.health[name]
+            observed = len(health.samples) >= self.min_samples
+            p95 = health.percentile(0.95) if observed else None
+            slow = p95 is not None and p95 > self.latency_budget
+            unhealthy = observed and health.error_rate > self.max_error_rate
+            return (health.cooling_down, unhealthy, slow, p95 if slow else 0, order)
+        return [name for _, name in sorted(enumerate(names), key=rank)]
+
+    def pick(self, stage: str, mode: Optional[str] = None) -> tuple[str, dspy.LM]:
+        name = self.candidates(stage, mode)[0]
+        return name, self.models[name]
+
+    def default_lm(self, stage: str) -> dspy.LM:
+        return self.models[self.modes[self.mode][stage][0]]
+
+    def observe(self, name: str, latency: float, error: Optional[Exception] = None):
+        health = self.health[name]
+        health.observe(latency, error is None)
+        if error is not None and is_overloaded_error(error):
+            health.cooldown_until = time.monotonic() + self.cooldown
+
+    async def acall(self, stage: str, module: dspy.Module, mode: Optional[str] = None, **kwargs):
+        """Call the module with the healthiest model of the stage, falling back to the next one on failure"""
+        error = None
+        for name in self.candidates(stage, mode):
+            started = time.perf_counter()
+            try:
+                with span(stage, model=name) as stage_span:
+                    result = await asyncio.wait_for(module.acall(lm=self.models[name], **kwargs), timeout=self.timeout)
+                    stage_span.record_usage(result)
+            except Exception as e:
+                error = e
+                self.observe(name, time.perf_counter() - started, e)
+                logger.warning(f"{stage} call on {name} failed, trying the next model: {type(e).__name__} {e}")
+                continue
+            self.observe(name, time.perf_counter() - started)
+            return result
+        if error is None:
+            raise ValueError(f"No model to call for {stage}")
+        raise error
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "models": {name: health.stats() for name, health in self.health.items()}
+        }
@@ -0,0 +1,123 @@
+"""Offline optimization of the ReAct program of one agent, or of a pipeline stage, into the program registry.
+
+python -m agent.optimize --servers servers.json --agent brave-search --trainset brave.jsonl --devset brave_dev.jsonl --save
+python -m agent.optimize --stage conclusion --trainset conclusion.jsonl --save
+
+servers.json has the same shape as mcp_config in main.py. Examples are JSON lines with the input fields of the
+module and its expected output: input, goal, context and result for an agent, the signature fields for a stage.
+The report compares average ReAct steps, tokens and score on the devset before and after.
+"""
+import json
+import asyncio
+import argparse
+import statistics
+from collections import Counter
+
+import dspy
+
+from agent.agent_tool_manager import AgentToolManager, AgentToolManagerSignature, AgentOutputAdvisor, AgentToolManagerConclusion
+from agent.compaction import tokenize
+from utils import logger
+from utils.telemetry import setup_tracing
+
+STAGE_SIGNATURES = {"coordinator": AgentToolManagerSignature, "advisor": AgentOutputAdvisor, "conclusion": AgentToolManagerConclusion}
+
+def token_f1(expected, predicted) -> float:
+    expected, predicted = Counter(tokenize(str(expected))), Counter(tokenize(str(predicted)))
+    overlap = sum((expected & predicted).values())
+    if not overlap:
+        return 0.0
+    precision, recall = overlap / sum(predicted.values()), overlap / sum(expected.values())
+    return 2 * precision * recall / (precision + recall)
+
+def load_examples(path: str, input_keys: list[str]) -> list[dspy.Example]:
+    with open(path, "r") as f:
+        return [dspy.Example(**json.loads(line)).with_inputs(*input_keys) for line in f if line.strip()]
+
+async def evaluate(program: dspy.Module, examples: list[dspy.Example], output_field: str) -> dict:
+    steps, tokens, scores, errors = [], [], [], 0
+    for example in examples:
+        try:
+            prediction = await program.acall(**example.inputs())
+        except Exception as e:
+            logger.error(f"Evaluation example failed: {e}")
+            errors += 1
+            continue
+        trajectory = getattr(prediction, "trajectory", None) or {}
+        steps.append(sum(1 for key in trajectory if key.startswith("tool_name_")))
+        usage = prediction.get_lm_usage() or {}
+        tokens.append(sum(counts.get("prompt_tokens", 0) + counts.get("completion_tokens", 0) for counts in usage.values()))
+        scores.append(token_f1(example[output_field], prediction[output_field]))
+    mean = lambda values: round(statistics.mean(values), 3) if values else 0.0
+    return {"examples": len(examples), "errors": errors, "avg_steps": mean(steps), "avg_tokens": mean(tokens), "score": mean(scores)}
+
+class LoopBridge(dspy.Module):
+    """Sync face of an async program for the optimizer, which runs in a worker thread while the event loop
+    owning the MCP sessions keeps serving the tool calls"""
+    def __init__(self, program: dspy.Module, loop: asyncio.AbstractEventLoop):
+        super().__init__()
+        self.program = program
+        self.loop = loop
+
+    def forward(self, **kwargs):
+        return asyncio.run_coroutine_threadsafe(self.program.acall(**kwargs), self.loop).result()
+
+async def run(args: argparse.Namespace) -> dict:
+    setup_tracing()
+    servers = {}
+    if args.agent:
+        with open(args.servers, "r") as f:
+            servers = {args.agent: json.load(f)[args.agent]}
+    manager = AgentToolManager(servers)
+    try:
+        if args.agent:
+            await manager.load_agent()
+            agent = await manager.get_agent(args.agent)
+            program, kind, name, signature = agent.reAct, "react", args.agent, agent.reAct.signature
+            keys = {"tools_hash": agent.client.tools_hash, "tools": sorted(agent.reAct.tools)}
+        else:
+            program, kind, name, signature = manager.stage_modules()[args.stage], "stages", args.stage, STAGE_SIGNATURES[args.stage]
+            keys = {}
+        output_field = list(signature.output_fields)[-1]
+        trainset = load_examples(args.trainset, list(signature.input_fields))
+        devset = load_examples(args.devset, list(signature.input_fields)) if args.devset else trainset
+
+        before = await evaluate(program, devset, output_field)
+        optimizer = dspy.BootstrapFewShot(
+            metric=lambda example, prediction, trace=None: token_f1(example[output_field], prediction[output_field]) >= args.threshold,
+            max_bootstrapped_demos=args.demos,
+            max_labeled_demos=args.demos
+        )
+        compiled = await asyncio.to_thread(optimizer.compile, LoopBridge(program, asyncio.get_running_loop()), trainset=trainset)
+        after = await evaluate(compiled.program, devset, output_field)
+
+        report = {"target": f"{kind}/{name}", "before": before, "after": after}
+        if args.save:
+            if after["score"] < before["score"] and not args.force:
+                report["saved"] = None
+                logger.warning("Compiled program scores lower than the current one, not saved (use --force)")
+            else:
+                report["saved"] = manager.programs.save(compiled.program, kind, name, report={"before": before, "after": after}, **keys)
+        return report
+    finally:
+        await manager.close_agent()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--agent", help="optimize the ReAct program of this agent")
+    target.add_argument("--stage", choices=sorted(STAGE_SIGNATURES), help="optimize a pipeline stage")
+    parser.add_argument("--servers", help="MCP server config JSON, required with --agent")
+    parser.add_argument("--trainset", required=True)
+    parser.add_argument("--devset", help="defaults to the trainset")
+    parser.add_argument("--demos", type=int, default=4, help="max few-shot demos per predictor")
+    parser.add_argument("--threshold", type=float, default=0.5, help="token F1 a bootstrapped trace needs to become a demo")
+    parser.add_argument("--save", action="store_true", help="write the compiled program to the registry")
+    parser.add_argument("--force", action="store_true", help="save even when the devset score drops")
+    args = parser.parse_args()
+    if args.agent and not args.servers:
+        parser.error("--servers is required with --agent")
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import os
+import json
+from typing import Optional
+
+import dspy
+
+from conf import config
+from utils import logger
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_PROGRAMS_PATH = os.path.join(ROOT, "programs")
+
+def _prefixes(signature) -> list[str]:
+    return [field.json_schema_extra["prefix"] for field in signature.fields.values()]
+
+class ProgramRegistry:
+    """Compiled DSPy programs saved by `python -m agent.optimize`. ReAct programs are keyed by agent name and the
+    hash of the server's tool schema, stage programs (coordinator, advisor, conclusion) by stage name. A program
+    only loads when it matches the module it is loaded into, otherwise the module keeps its default prompts"""
+    def __init__(self, path: str = DEFAULT_PROGRAMS_PATH):
+        # relative paths are taken from the repo root, so the optimizer and the server share them from any directory
+        self.path = os.path.join(ROOT, path)
+        self.loaded: dict[str, str] = {}
+
+    @classmethod
+    def from_config(cls) -> Optional["ProgramRegistry"]:
+        if not config.getboolean("programs", "enabled", fallback=True):
+            return None
+        return cls(path=config.get("programs", "path", fallback=DEFAULT_PROGRAMS_PATH))
+
+    def path_for(self, kind: str, name: str, tools_hash: Optional[str] = None) -> str:
+        filename = f"{name}-{tools_hash[:16]}.json" if tools_hash else f"{name}.json"
+        return os.path.join(self.path, kind, filename)
+
+    def _mismatch(self, module: dspy.Module, state: dict, tools_hash: Optional[str], tools: Optional[list[str]]) -> Optional[str]:
+        """Why the saved state does not fit the module, None when it does"""
+        registry = state.get("registry", {})
+        if tools_hash is not None and registry.get("tools_hash") != tools_hash:
+            return "tool schema changed"
+        if tools is not None and registry.get("tools") != tools:
+            return "tool set changed"
+        for name, predictor in module.named_predictors():
+            if name not in state:
+                return f"no state for predictor {name}"
+            if [field.get("prefix") for field in state[name]["signature"]["fields"]] != _prefixes(predictor.signature):
+                return f"signature of {name} changed"
+        return None
+
+    def load(self, module: dspy.Module, kind: str, name: str, tools_hash: Optional[str] = None, tools: Optional[list[str]] = None) -> bool:
+        """Load the compiled program into the module, the module's LM has to be set again afterwards"""
+        path = self.path_for(kind, name, tools_hash)
+        if not os.path.exists(path):
+            return False
+        try:
+            with open(path, "r") as f:
+                state = json.load(f)
+            reason = self._mismatch(module, state, tools_hash, tools)
+            if reason is not None:
+                logger.warning(f"Not loading compiled program {path}: {reason}")
+                return False
+            module.load_state({name: state[name] for name, _ in module.named_predictors()})
+        except Exception as e:
+            logger.error(f"Error loading compiled program {path}: {e}")
+            return False
+        self.loaded[f"{kind}/{name}"] = path
+        logger.info(f"Loaded compiled program {path}")
+        return True
+
+    def save(self, module: dspy.Module, kind: str, name: str, tools_hash: Optional[str] = None, tools: Optional[list[str]] = None, report: Optional[dict] = None) -> str:
+        state = module.dump_state()
+        for predictor_state in state.values():
+            # the LM comes from the config at load time, never from the artifact
+            predictor_state["lm"] = None
+        state["registry"] = {"kind": kind, "name": name, "tools_hash": tools_hash, "tools": tools, "report": report}
+        path = self.path_for(kind, name, tools_hash)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp_path, path)
+        return path
+
+    def stats(self) -> dict:
+        return dict(self.loaded)
@@ -0,0 +1,74 @@
+import time
+from typing import Literal, Optional
+
+import dspy
+
+from conf import config
+from utils import logger
+from utils.telemetry import span
+
+STAGES_SKIPPED = {
+    "direct": ["planning", "agents", "conclusion"],
+    "single_agent": ["planning"],
+    "full_plan": []
+}
+
+class RouteSignature(dspy.Signature):
+    """Decide how much of the agent pipeline the question needs.
+direct: answerable from general knowledge or the conversation context alone (greetings, small talk, arithmetic, rewording a previous answer).
+single_agent: one call to one agent is enough.
+full_plan: several agents or dependent steps are needed."""
+    question: str = dspy.InputField(description="The question from user")
+    context: str = dspy.InputField(description="The context of the conversation")
+    agent_description: str = dspy.InputField(description="Description of the agents")
+    route: Literal["direct", "single_agent", "full_plan"] = dspy.OutputField(description="How the question should be handled")
+    confidence: float = dspy.OutputField(description="Confidence of the route between 0 and 1")
+    agent_name: str = dspy.OutputField(description="Name of the agent for the single_agent route, empty otherwise")
+    answer: str = dspy.OutputField(description="The final answer for the direct route, empty otherwise")
+
+class QuestionRouter:
+    """Cheap routing stage ahead of the coordinator, trivial questions skip the stages they don't need"""
+    def __init__(self, lm: dspy.LM, min_confidence: float = 0.7, smoothing: float = 0.2):
+        self.predict = dspy.Predict(RouteSignature)
+        self.predict.set_lm(lm)
+        self.min_confidence = min_confidence
+        self.smoothing = smoothing
+        self.stage_latency: dict[str, float] = {}
+
+    @classmethod
+    def from_config(cls, lm: dspy.LM) -> Optional["QuestionRouter"]:
+        if not config.getboolean("router", "enabled", fallback=False):
+            return None
+        return cls(lm=lm, min_confidence=config.getfloat("router", "min_confidence", fallback=0.7))
+
+    def set_lm(self, lm: dspy.LM):
+        self.predict.set_lm(lm)
+
+    def record(self, stage: str, seconds: float):
+        """Rolling average latency of a full pipeline stage, used to estimate what a fast path saves"""
+        previous = self.stage_latency.get(stage)
+        self.stage_latency[stage] = seconds if previous is None else previous + self.smoothing * (seconds - previous)
+
+    async def route(self, question: str, context: str, agent_description: str, agent_names: list[str]) -> dspy.Prediction:
+        started = time.perf_counter()
+        try:
+            with span("router") as router_span:
+                decision = await self.predict.acall(question=question, context=context, agent_description=agent_description)
+                router_span.record_usage(decision)
+            route, confidence = decision.route, float(decision.confidence)
+            agent_name, answer = decision.agent_name.strip(), decision.answer
+        except Exception as e:
+            logger.error(f"Error routing question, falling back to full plan: {e}")
+            route, confidence, agent_name, answer = "full_plan", 0.0, "", ""
+
+        if route != "full_plan" and confidence < self.min_confidence:
+            route = "full_plan"
+        if route == "single_agent" and agent_name not in agent_names:
+            route = "full_plan"
+        if route == "direct" and not answer:
+            route = "full_plan"
+
+        elapsed = time.perf_counter() - started
+        saved = sum(self.stage_latency.get(stage, 0) for stage in STAGES_SKIPPED[route])
+        logger.info(f"Route {route} (confidence {confidence:.2f}, agent '{agent_name}') in {elapsed:.2f}s, estimated saving {saved - elapsed:.2f}s")
+        return dspy.Prediction(route=route, confidence=confidence, agent_name=agent_name, answer=answer, latency=elapsed, saved=saved - elapsed)
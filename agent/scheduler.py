@@ -0,0 +1,107 @@
+import json
+import time
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from conf import config
+from utils import logger
+
+class PlanScheduler:
+    """Run an execution plan as a DAG, a step starts as soon as the steps it depends on are done.
+    Concurrency is capped per agent within each plan, the MCP pools bound it across plans. The step timeout
+    covers the time a step waits for its agent's slot as well as its run"""
+    def __init__(self, default_concurrency: int = 2, concurrency: Optional[Dict[str, int]] = None, step_timeout: float = 120):
+        self.default_concurrency = default_concurrency
+        self.concurrency = concurrency or {}
+        self.step_timeout = step_timeout
+
+    @classmethod
+    def from_config(cls) -> "PlanScheduler":
+        """[scheduler] max_concurrency and step_timeout, max_concurrency.<agent_name> overrides the cap for one agent.
+        An agent with its own [mcp_pool] max_size.<agent_name> and no override gets that as its cap"""
+        concurrency = {}
+        if config.has_section("mcp_pool"):
+            for key, value in config.items("mcp_pool"):
+                if key.startswith("max_size."):
+                    concurrency[key.split(".", 1)[1]] = int(value)
+        if config.has_section("scheduler"):
+            for key, value in config.items("scheduler"):
+                if key.startswith("max_concurrency."):
+                    concurrency[key.split(".", 1)[1]] = int(value)
+        return cls(
+            default_concurrency=config.getint("scheduler", "max_concurrency", fallback=2),
+            concurrency=concurrency,
+            step_timeout=config.getfloat("scheduler", "step_timeout", fallback=120)
+        )
+
+    def _semaphore(self, semaphores: Dict[str, asyncio.Semaphore], agent_name: str) -> asyncio.Semaphore:
+        if agent_name not in semaphores:
+            semaphores[agent_name] = asyncio.Semaphore(self.concurrency.get(agent_name, self.default_concurrency))
+        return semaphores[agent_name]
+
+    def _dependencies(self, step: Any, index_by_id: Dict[int, int]) -> list[int]:
+        """Indexes of the steps this step waits for, only earlier plan_ids are accepted so the graph has no cycle"""
+        dependencies = []
+        for plan_id in getattr(step, "depends_on", []):
+            if plan_id not in index_by_id or plan_id >= step.plan_id:
+                logger.warning(f"Ignoring dependency {plan_id} of step {step.plan_id}, it must refer to an earlier step")
+                continue
+            dependencies.append(index_by_id[plan_id])
+        return dependencies
+
+    async def run(self, execution_plan: list, run_step: Callable[[Any, str], Awaitable[str]]):
+        """Yield (index, data, stats) for each step as soon as it finishes.
+        run_step receives the step and its context extended with the results of its dependencies"""
+        index_by_id: Dict[int, int] = {}
+        for index, step in enumerate(execution_plan):
+            index_by_id.setdefault(step.plan_id, index)
+        done = [asyncio.Event() for _ in execution_plan]
+        results: list[Optional[dict]] = [None] * len(execution_plan)
+        semaphores: Dict[str, asyncio.Semaphore] = {}
+        scheduled = time.perf_counter()
+
+        async def run(index: int, step: Any):
+            dependencies = self._dependencies(step, index_by_id)
+            for dependency in dependencies:
+                await done[dependency].wait()
+            ready = time.perf_counter()
+
+            context = step.agent_context
+            if dependencies:
+                context += "\n\nResults of the previous steps this step depends on:\n" + json.dumps([results[dependency] for dependency in dependencies])
+
+            started = None
+            async def guarded():
+                nonlocal started
+                async with self._semaphore(semaphores, step.agent_name):
+                    started = time.perf_counter()
+                    return await run_step(step, context)
+
+            status = "ok"
+            try:
+                result = await asyncio.wait_for(guarded(), timeout=self.step_timeout)
+            except asyncio.TimeoutError:
+                status, result = "timeout", f"Step timed out after {self.step_timeout}s"
+            except Exception as e:
+                status, result = "error", str(e)
+            finished = time.perf_counter()
+            started = started or finished
+
+            results[index] = {"agent_name": step.agent_name, "result": result}
+            done[index].set()
+            stats = {
+                "status": status,
+                "dependency_wait": round(ready - scheduled, 3),
+                "queue_time": round(started - ready, 3),
+                "run_time": round(finished - started, 3)
+            }
+            logger.debug(f"Step {step.plan_id} ({step.agent_name}) {status}: {stats}")
+            return index, results[index], stats
+
+        tasks = [asyncio.create_task(run(index, step)) for index, step in enumerate(execution_plan)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
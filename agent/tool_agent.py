@@ -1,23 +1,43 @@
 import dspy
-from typing import Optional, List
+import json
+import time
+import asyncio
+import hashlib
+import anyio
+from typing import Optional, List, Dict
 
 #MCP
 from mcp import ClientSession, StdioServerParameters
 from mcp.client.stdio import stdio_client
-from mcp.types import Tool
-from contextlib import AsyncExitStack
+from mcp.shared.exceptions import McpError
+from mcp.types import Tool, CONNECTION_CLOSED
+from contextlib import AsyncExitStack, asynccontextmanager
 
-from agent.internal_gen import generate_agent_description
+from agent.internal_gen import agenerate_agent_description
+from agent.description_cache import DescriptionCache
+from agent.tool_cache import ToolResultCache
+from agent.compaction import ObservationCompactor
+from agent.gateway import GatewayClientPool
+from agent.programs import ProgramRegistry
+from conf import config
 from utils import logger
+from utils.telemetry import span, OBSERVATION_TOKENS_SAVED
 
 class ToolAgent(dspy.Module):
-    def __init__(self, mcp_config:dict, agent_name:str, lm:dspy.LM):
+    def __init__(self, mcp_config:dict, agent_name:str, lm:dspy.LM, description_cache:Optional[DescriptionCache] = None, tool_cache:Optional[ToolResultCache] = None, compactor:Optional[ObservationCompactor] = None, programs:Optional[ProgramRegistry] = None):
         self.lm = lm
         self.agent_name = agent_name
         self.agent_description = ""
-        self.client = MCPClient()
+        # with the gateway enabled the servers are shared by every worker instead of spawned here
+        self.client = GatewayClientPool.from_config(agent_name) or MCPClientPool.from_config(agent_name)
         self.reAct: Optional[dspy.ReAct] = None
         self.mcp_config = mcp_config
+        self.description_cache = description_cache
+        self.tool_cache = tool_cache
+        self.compactor = compactor
+        self.programs = programs
+        self.inflight = 0
+        self.last_used = time.monotonic()
     
     async def acall(self, *args):
         if self.reAct is None:
@@ -32,20 +52,72 @@ Tool agent {self.agent_name}
 input: {input}
 goal: {goal}
 context: {context}""")
-        return await self.reAct.acall(input=input, goal=goal,context=context)
-    
-    async def connect(self):
+        self.inflight += 1
+        try:
+            with span("tool_agent", agent=self.agent_name, model=getattr(self.lm, "model", "")) as agent_span:
+                if self.compactor is None:
+                    result = await self.reAct.acall(input=input, goal=goal,context=context)
+                else:
+                    with self.compactor.track(f"{input} {goal}") as observations:
+                        result = await self.reAct.acall(input=input, goal=goal,context=context)
+                    agent_span.set("observation_tokens_saved", observations.tokens_saved)
+                    OBSERVATION_TOKENS_SAVED.inc(observations.tokens_saved, agent=self.agent_name)
+                agent_span.record_usage(result)
+                return result
+        finally:
+            self.inflight -= 1
+            self.last_used = time.monotonic()
+
+    async def connect(self, connect_timeout:Optional[float] = None, describe_timeout:Optional[float] = None):
+        """Only the MCP handshake counts against connect_timeout, the description LLM call on a cache miss has its own
+        timeout and falls back to the raw tool information, uncached, so a slow first boot still gets the agent up"""
         try:
-            tool_information = await self.client.connect(self.mcp_config)
-            self.agent_description = generate_agent_description(information=tool_information)
+            tool_information = await asyncio.wait_for(self.client.connect(self.mcp_config), timeout=connect_timeout)
+            try:
+                self.agent_description = await asyncio.wait_for(self.describe(tool_information), timeout=describe_timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Describing {self.agent_name} took over {describe_timeout}s, using its tool list until the next start")
+                self.agent_description = tool_information
 
-            dspy_tools = await self.client.convert_to_dspy()
+            dspy_tools = [self.trace(tool) for tool in await self.client.convert_to_dspy()]
+            if self.tool_cache is not None:
+                dspy_tools = [self.tool_cache.wrap(self.agent_name, tool) for tool in dspy_tools]
+            if self.compactor is not None:
+                dspy_tools = [self.compactor.wrap(self.agent_name, tool) for tool in dspy_tools] + [self.compactor.reader_tool(self.agent_name)]
             self.reAct = dspy.ReAct("input, goal, context -> result", tools=dspy_tools)
+            if self.programs is not None:
+                self.programs.load(self.reAct, "react", self.agent_name, tools_hash=self.client.tools_hash, tools=sorted(self.reAct.tools))
             self.reAct.set_lm(self.lm)
         except Exception as e:
             logger.error(f"Error during setup MCP: {self.agent_name}")
             raise e
 
+    def trace(self, tool:dspy.Tool) -> dspy.Tool:
+        """Span per MCP call, innermost so cache hits and compaction are not counted as calls"""
+        func = tool.func
+
+        async def traced_func(**kwargs):
+            with span("mcp_tool", agent=self.agent_name, tool=tool.name):
+                return await func(**kwargs)
+
+        tool.func = traced_func
+        return tool
+
+    async def describe(self, tool_information:str) -> str:
+        """Capability description of the agent, only calls the LLM when the tool schema is not cached"""
+        if self.description_cache is None:
+            return await agenerate_agent_description(information=tool_information)
+        cached = self.description_cache.get(self.client.tools_hash)
+        if cached is not None:
+            logger.debug(f"Description cache hit for {self.agent_name}")
+            # same tools under a new config, remember it for the lazy start of this config
+            await self.description_cache.set(self.client.tools_hash, self.agent_name, cached, self.mcp_config)
+            return cached
+        description = await agenerate_agent_description(information=tool_information)
+        if description != tool_information:
+            await self.description_cache.set(self.client.tools_hash, self.agent_name, description, self.mcp_config)
+        return description
+
     async def __aenter__(self):
         return self
     
@@ -55,7 +127,11 @@ context: {context}""")
 class MCPClient:
     def __init__(self):
         self.session: Optional[ClientSession] = None
-        self.exit_stack = AsyncExitStack()
+        self.tools: List[Tool] = []
+        self.tools_hash = ""
+        self._runner: Optional[asyncio.Task] = None
+        self._ready: Optional[asyncio.Future] = None
+        self._closing = asyncio.Event()
 
     def get_tools_information(self, tools:List[Tool]):
         tools_information = []
@@ -68,24 +144,51 @@ class MCPClient:
             })
         return str(tools_information)
 
+    def get_tools_hash(self, tools:List[Tool]):
+        """Stable hash of the list_tools schema, changes whenever a tool is added, removed or its schema changes"""
+        schema = [tool.model_dump(mode="json", exclude_none=True) for tool in sorted(tools, key=lambda t: t.name)]
+        return hashlib.sha256(json.dumps(schema, sort_keys=True).encode()).hexdigest()
+
     async def connect(self, mcp_config:dict):
+        # The stdio transport must be entered and exited by the same task, so a dedicated
+        # runner task owns it and disconnect() can be called from anywhere
+        self._ready = asyncio.get_running_loop().create_future()
+        self._runner = asyncio.create_task(self._run(mcp_config))
+        return await self._ready
+
+    async def _run(self, mcp_config:dict):
         server_param = StdioServerParameters(
             command=mcp_config['command'],
             args=mcp_config['args'],
             env=None if 'env' not in mcp_config.keys() else mcp_config['env']
         )
-
-        stdio_transport = await self.exit_stack.enter_async_context(stdio_client(server_param))
-        self.stdio, self.write = stdio_transport
-        self.session = await self.exit_stack.enter_async_context(ClientSession(self.stdio, self.write))
         try:
-            await self.session.initialize()
-            response = await self.session.list_tools()
-            tools_information = self.get_tools_information(response.tools)
-            return tools_information
+            async with AsyncExitStack() as exit_stack:
+                stdio_transport = await exit_stack.enter_async_context(stdio_client(server_param))
+                self.stdio, self.write = stdio_transport
+                self.session = await exit_stack.enter_async_context(ClientSession(self.stdio, self.write))
+                await self.session.initialize()
+                response = await self.session.list_tools()
+                self.tools = response.tools
+                self.tools_hash = self.get_tools_hash(response.tools)
+                self._ready.set_result(self.get_tools_information(response.tools))
+                await self._closing.wait()
         except Exception as e:
-            logger.error(f"Error during setup MCP: {e}")
-            raise e
+            if not self._ready.done():
+                logger.error(f"Error during setup MCP: {e}")
+                self._ready.set_exception(e)
+            else:
+                logger.error(f"Error during disconnect: {e}")
+        finally:
+            self.session = None
+            if not self._ready.done():
+                self._ready.cancel()
+
+    def require_session(self) -> ClientSession:
+        """The live session, raises the same error as a closed transport once the runner has exited"""
+        if self.session is None:
+            raise anyio.ClosedResourceError("MCP session is closed")
+        return self.session
 
     async def convert_to_dspy(self):
         dspy_tools = []
@@ -99,11 +202,19 @@ class MCPClient:
 
     async def disconnect(self):
         """Properly cleanup all async contexts"""
+        if self._runner is None:
+            return
+        if self._ready is not None and not self._ready.done():
+            self._runner.cancel()
+        self._closing.set()
         try:
-            await self.exit_stack.aclose()
+            await self._runner
+        except asyncio.CancelledError:
+            pass
         except Exception as e:
             logger.error(f"Error during disconnect: {e}")
         finally:
+            self._runner = None
             self.session = None
 
     async def __aenter__(self):
@@ -111,3 +222,200 @@ class MCPClient:
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         await self.disconnect()
+
+def is_dead_session_error(error:Exception) -> bool:
+    """Whether the error means the server process or its stdio transport is gone"""
+    if isinstance(error, McpError):
+        return error.error.code == CONNECTION_CLOSED
+    return isinstance(error, (anyio.ClosedResourceError, anyio.BrokenResourceError, anyio.EndOfStream, BrokenPipeError, ConnectionError))
+
+class MCPClientPool:
+    """Pool of MCP server processes for one agent, every tool call checks out the least busy session.
+    The pool grows up to max_size while every session is busy, shrinks back to min_size once sessions
+    stay idle past idle_timeout, and replaces sessions whose server died"""
+    def __init__(self, min_size:int = 1, max_size:int = 1, idle_timeout:float = 300):
+        self.min_size = max(1, min_size)
+        self.max_size = max(self.min_size, max_size)
+        self.idle_timeout = idle_timeout
+        self.clients: List[MCPClient] = []
+        self.tools_hash = ""
+        self._mcp_config: Optional[dict] = None
+        self._busy: Dict[MCPClient, int] = {}
+        self._last_used: Dict[MCPClient, float] = {}
+        self._spawning = 0
+        self._background: set[asyncio.Task] = set()
+        self._closed = False
+        self.checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @classmethod
+    def from_config(cls, agent_name:str) -> "MCPClientPool":
+        """[mcp_pool] min_size, max_size and idle_timeout, min_size.<agent_name> / max_size.<agent_name> override one agent"""
+        return cls(
+            min_size=config.getint("mcp_pool", f"min_size.{agent_name}", fallback=config.getint("mcp_pool", "min_size", fallback=1)),
+            max_size=config.getint("mcp_pool", f"max_size.{agent_name}", fallback=config.getint("mcp_pool", "max_size", fallback=1)),
+            idle_timeout=config.getfloat("mcp_pool", "idle_timeout", fallback=300)
+        )
+
+    def stats(self) -> dict:
+        busy = sum(1 for client in self.clients if self._busy[client] > 0)
+        return {
+            "size": len(self.clients),
+            "busy": busy,
+            "inflight": sum(self._busy.values()),
+            "utilization": round(busy / len(self.clients), 3) if self.clients else 0,
+            "checkouts": self.checkouts,
+            "avg_wait": round(self.total_wait / self.checkouts, 4) if self.checkouts else 0,
+            "max_wait": round(self.max_wait, 4)
+        }
+
+    def _ensure_open(self):
+        if self._closed:
+            raise anyio.ClosedResourceError("MCP pool is closed")
+
+    async def connect(self, mcp_config:dict):
+        self._ensure_open()
+        self._mcp_config = mcp_config
+        client = MCPClient()
+        try:
+            tool_information = await client.connect(mcp_config)
+            # closed while the server was starting, nothing would ever stop it
+            self._ensure_open()
+        except BaseException:
+            await client.disconnect()
+            raise
+        self.tools_hash = client.tools_hash
+        self._add(client)
+        for _ in range(self.min_size - 1):
+            self._spawn_in_background()
+        if self.max_size > self.min_size:
+            self._track(asyncio.create_task(self._reap()))
+        return tool_information
+
+    async def _reap(self):
+        """Shrink on a timer too, checkouts alone never shrink a pool that went idle"""
+        while True:
+            await asyncio.sleep(max(1, self.idle_timeout / 2))
+            self._shrink()
+
+    def _add(self, client:MCPClient):
+        self.clients.append(client)
+        self._busy[client] = 0
+        self._last_used[client] = time.monotonic()
+
+    def _remove(self, client:MCPClient):
+        if client not in self._busy:
+            return
+        self.clients.remove(client)
+        del self._busy[client]
+        del self._last_used[client]
+        self._track(asyncio.create_task(client.disconnect()))
+
+    def _track(self, task:asyncio.Task):
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _spawn(self) -> MCPClient:
+        self._spawning += 1
+        try:
+            return await self._connect_client()
+        finally:
+            self._spawning -= 1
+
+    def _spawn_in_background(self):
+        if self._closed:
+            return
+        self._spawning += 1
+        async def spawn():
+            try:
+                await self._connect_client()
+            except Exception as e:
+                logger.error(f"Error spawning pooled MCP session: {e}")
+            finally:
+                self._spawning -= 1
+        self._track(asyncio.create_task(spawn()))
+
+    async def _connect_client(self) -> MCPClient:
+        self._ensure_open()
+        client = MCPClient()
+        try:
+            await client.connect(self._mcp_config)
+            self._ensure_open()
+        except BaseException:
+            await client.disconnect()
+            raise
+        self._add(client)
+        return client
+
+    def _shrink(self):
+        now = time.monotonic()
+        for client in list(self.clients):
+            if len(self.clients) <= self.min_size:
+                break
+            if self._busy[client] == 0 and now - self._last_used[client] > self.idle_timeout:
+                logger.info(f"Closing idle pooled MCP session, pool size {len(self.clients) - 1}")
+                self._remove(client)
+
+    @asynccontextmanager
+    async def checkout(self):
+        self._ensure_open()
+        started = time.perf_counter()
+        self._shrink()
+        if not self.clients:
+            client = await self._spawn()
+        else:
+            client = min(self.clients, key=lambda c: self._busy[c])
+            if self._busy[client] > 0 and len(self.clients) + self._spawning < self.max_size:
+                self._spawn_in_background()
+        wait = time.perf_counter() - started
+        self.checkouts += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+        self._busy[client] += 1
+        try:
+            yield client
+        finally:
+            if client in self._busy:
+                self._busy[client] -= 1
+                self._last_used[client] = time.monotonic()
+
+    async def call_tool(self, name:str, arguments:Optional[dict] = None, **kwargs):
+        """Same interface as ClientSession.call_tool, so dspy tools can be bound to the pool"""
+        for attempt in range(2):
+            async with self.checkout() as client:
+                try:
+                    return await client.require_session().call_tool(name, arguments=arguments, **kwargs)
+                except Exception as e:
+                    if not is_dead_session_error(e) or attempt > 0 or self._closed:
+                        raise
+                    logger.error(f"Pooled MCP session died during {name}, replacing it: {e}")
+                    self._remove(client)
+                    if len(self.clients) + self._spawning < self.min_size:
+                        self._spawn_in_background()
+
+    async def list_tools(self):
+        async with self.checkout() as client:
+            return await client.require_session().list_tools()
+
+    async def convert_to_dspy(self):
+        if not self.clients:
+            raise ValueError("Session is not connected")
+        return [dspy.Tool.from_mcp_tool(self, tool) for tool in self.clients[0].tools]
+
+    async def disconnect(self):
+        # calls still running on the pool must not spawn servers into it once it is closed
+        self._closed = True
+        for task in list(self._background):
+            task.cancel()
+        clients, self.clients = self.clients, []
+        self._busy.clear()
+        self._last_used.clear()
+        await asyncio.gather(*[client.disconnect() for client in clients])
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.disconnect()
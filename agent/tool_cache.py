@@ -0,0 +1,103 @@
+import json
+import asyncio
+from fnmatch import fnmatch
+from typing import Any, Awaitable, Callable, Dict
+
+import dspy
+
+from conf import config
+from utils.cache import TTLCache
+
+_MISSING = object()
+
+def normalize_arguments(value: Any) -> Any:
+    """Collapse whitespace and drop empty arguments so equivalent calls share a cache key"""
+    if isinstance(value, str):
+        return " ".join(value.split())
+    if isinstance(value, dict):
+        return {k: normalize_arguments(v) for k, v in sorted(value.items()) if v is not None}
+    if isinstance(value, (list, tuple)):
+        return [normalize_arguments(v) for v in value]
+    return value
+
+class ToolResultCache:
+    """TTL result cache for MCP tool calls, concurrent identical calls are coalesced into one server request"""
+    def __init__(self, default_ttl: float = 300, ttls: Dict[str, float] = None, no_cache: list[str] = None, max_entries: int = 2048):
+        self.default_ttl = default_ttl
+        self.ttls = ttls or {}
+        self.no_cache = no_cache if no_cache is not None else ["playwright.*"]
+        self._results = TTLCache(maxsize=max_entries, ttl=default_ttl)
+        self._inflight: Dict[tuple, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    @classmethod
+    def from_config(cls) -> "ToolResultCache":
+        """[tool_cache] default_ttl, max_entries, no_cache patterns and ttl.<agent>.<tool> overrides"""
+        ttls = {}
+        if config.has_section("tool_cache"):
+            for key, value in config.items("tool_cache"):
+                if key.startswith("ttl."):
+                    ttls[key.split(".", 1)[1]] = float(value)
+        no_cache = config.get("tool_cache", "no_cache", fallback="playwright.*")
+        return cls(
+            default_ttl=config.getfloat("tool_cache", "default_ttl", fallback=300),
+            ttls=ttls,
+            no_cache=[pattern.strip() for pattern in no_cache.split(",") if pattern.strip()],
+            max_entries=config.getint("tool_cache", "max_entries", fallback=2048)
+        )
+
+    def ttl_for(self, name: str) -> float:
+        """TTL of a tool named <agent>.<tool>, 0 means the tool is never cached"""
+        if any(fnmatch(name, pattern) for pattern in self.no_cache):
+            return 0
+        for pattern, ttl in self.ttls.items():
+            if fnmatch(name, pattern):
+                return ttl
+        return self.default_ttl
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "entries": len(self._results),
+            "inflight": len(self._inflight)
+        }
+
+    def wrap(self, agent_name: str, tool: dspy.Tool) -> dspy.Tool:
+        name = f"{agent_name}.{tool.name}"
+        ttl = self.ttl_for(name)
+        if ttl <= 0:
+            return tool
+        func = tool.func
+
+        async def cached_func(**kwargs):
+            return await self.call(name, ttl, func, kwargs)
+
+        tool.func = cached_func
+        return tool
+
+    async def call(self, name: str, ttl: float, func: Callable[..., Awaitable[Any]], kwargs: dict) -> Any:
+        key = (name, json.dumps(normalize_arguments(kwargs), sort_keys=True, default=str))
+        result = self._results.get(key, _MISSING)
+        if result is not _MISSING:
+            self.hits += 1
+            return result
+
+        task = self._inflight.get(key)
+        if task is None:
+            self.misses += 1
+            task = asyncio.ensure_future(func(**kwargs))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._on_done(key, ttl, done))
+        else:
+            self.coalesced += 1
+        # shield so a cancelled caller does not cancel the request other callers are waiting on
+        return await asyncio.shield(task)
+
+    def _on_done(self, key: tuple, ttl: float, task: asyncio.Future):
+        self._inflight.pop(key, None)
+        if not task.cancelled() and task.exception() is None:
+            self._results.set(key, task.result(), ttl=ttl)
@@ -0,0 +1,190 @@
+"""Offline benchmark of the query pipeline, no OpenRouter, Brave, Redis or Weaviate needed.
+
+Stub MCP servers run as real stdio subprocesses, every LM call goes to a scripted LM with a fixed
+delay, Redis and Weaviate are replaced by in-memory stand-ins with configurable round-trip latency.
+
+python -m bench.run --concurrency 1 4 16 --requests 32 --servers 3 --lm-delay 0.05 --tool-latency 0.1
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+
+from conf import config
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(q * len(values)))], 4)
+
+def summarize(latencies: list[float]) -> dict:
+    return {
+        "mean": round(sum(latencies) / len(latencies), 4) if latencies else 0.0,
+        "p50": percentile(latencies, 0.5),
+        "p95": percentile(latencies, 0.95),
+        "p99": percentile(latencies, 0.99)
+    }
+
+def configure(args: argparse.Namespace):
+    """Point every config section the app reads at offline values, must run before the app modules are imported"""
+    sections = {
+        "tool_llm": {"model": "bench/scripted", "api_key": ""},
+        "conclusion_llm": {"model": "bench/scripted", "api_key": ""},
+        "internal_llm": {"model": "bench/scripted", "api_key": ""},
+        "memory": {"model": "bench/scripted", "api_key": ""},
+        # connect_to_custom is patched, these only have to parse
+        "weaviate": {"http_url": "localhost", "http_port": "8080", "http_ssl": "", "grpc_url": "localhost", "grpc_port": "50051",
+                     "grpc_ssl": "", "api_key": "bench"},
+        "answer_cache": {"enabled": "false"},
+        "mcp": {"lazy": "false"},
+        "agent_cache": {"path": os.path.join(tempfile.mkdtemp(prefix="bench-"), "agent_descriptions.json")},
+        # features that reach real services or change what is measured stay off whatever config.ini says
+        "jobs": {"enabled": "false", "run_in_web": "false"},
+        "gateway": {"enabled": "false"},
+        "recall": {"enabled": "false"},
+        "router": {"enabled": "false"},
+        "programs": {"enabled": "false"},
+        "websocket": {"relay": "false"},
+        "admin": {"sync": "false"},
+        "telemetry": {"otlp_endpoint": ""}
+    }
+    if args.no_tool_cache:
+        sections["tool_cache"] = {"no_cache": "*"}
+    # extra models and modes would be real API models, the bench only knows the scripted one
+    for section in config.sections():
+        if section.startswith(("lm.", "mode.")):
+            config.remove_section(section)
+    for section, values in sections.items():
+        if not config.has_section(section):
+            config.add_section(section)
+        for key, value in values.items():
+            config.set(section, key, value)
+
+def stub_servers(args: argparse.Namespace) -> dict:
+    return {
+        f"stub-{i}": {
+            "command": sys.executable,
+            "args": ["-m", "bench.stub_mcp_server", "--name", f"stub-{i}", "--latency", str(args.tool_latency),
+                     "--payload-size", str(args.payload_size), "--tools", str(args.tools)],
+            "env": {**os.environ, "PYTHONPATH": ROOT}
+        }
+        for i in range(args.servers)
+    }
+
+async def bench_startup(manager) -> dict:
+    """Cold start generates every description, warm start reads them all from the description cache"""
+    started = time.perf_counter()
+    await manager.load_agent()
+    cold = time.perf_counter() - started
+    started = time.perf_counter()
+    await manager.load_agent()
+    warm = time.perf_counter() - started
+    return {"cold_seconds": round(cold, 3), "warm_seconds": round(warm, 3), "agents": manager.is_agent_ready()}
+
+async def bench_query(app, concurrency: int, requests: int) -> dict:
+    import httpx
+
+    latencies, errors = [], 0
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        async def one(index: int):
+            nonlocal errors
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.post("/query", json={"question": f"benchmark question {index}", "bypass_cache": True})
+                latencies.append(time.perf_counter() - started)
+                if response.status_code != 200:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*[one(index) for index in range(requests)])
+        elapsed = time.perf_counter() - started
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": errors,
+        "throughput_rps": round(requests / elapsed, 3),
+        "latency": summarize(latencies)
+    }
+
+async def bench_memory(memory, writes: int) -> dict:
+    """Cost of the post-response write path: summary LLM call, Redis update and conversation queueing"""
+    latencies = []
+    for index in range(writes):
+        started = time.perf_counter()
+        await memory.adding_new_memory(user_message=f"question {index}", assistant_response=f"answer {index}", thread_id=f"bench-{index % 4}")
+        latencies.append(time.perf_counter() - started)
+    started = time.perf_counter()
+    await memory.conversation.writer.flush()
+    return {
+        "writes": writes,
+        "latency": summarize(latencies),
+        "flush_seconds": round(time.perf_counter() - started, 4),
+        "redis_round_trips": memory.memcache.redis_client.round_trips,
+        "weaviate_requests": memory.conversation.conversation_schema.requests
+    }
+
+async def run(args: argparse.Namespace) -> dict:
+    configure(args)
+    from bench.stubs import ScriptedLM, InMemoryRedis, InMemoryWeaviate
+    import weaviate
+    # main builds its Memory at import time, hand it the local Weaviate stand-in
+    weaviate.connect_to_custom = lambda **kwargs: InMemoryWeaviate(latency=args.weaviate_latency)
+    import main
+    from agent import internal_gen
+
+    servers = stub_servers(args)
+    lm = ScriptedLM(delay=args.lm_delay, agent_names=tuple(servers))
+    manager = main.agent_manager
+    manager._current_config = servers
+    manager.lm = manager.conclusion_lm = lm
+    manager.models.models = {name: lm for name in manager.models.models}
+    manager.change_mode("free")
+    internal_gen.internal_generator.set_lm(lm)
+    internal_gen.memory_info_extract.set_lm(lm)
+    main.memory.cot.set_lm(lm)
+    main.memory.memcache.redis_client = InMemoryRedis(latency=args.redis_latency)
+    main.memory.start()
+
+    results = {"settings": vars(args)}
+    try:
+        results["startup"] = await bench_startup(manager)
+        results["query"] = [await bench_query(main.app, concurrency, args.requests) for concurrency in args.concurrency]
+        results["memory"] = await bench_memory(main.memory, args.memory_writes)
+        results["lm_calls"] = lm.calls
+    finally:
+        await manager.close_agent()
+        await main.memory.close()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=32, help="/query requests per concurrency level")
+    parser.add_argument("--servers", type=int, default=3, help="stub MCP servers, one agent each")
+    parser.add_argument("--tools", type=int, default=2, help="tools per stub server")
+    parser.add_argument("--tool-latency", type=float, default=0.1)
+    parser.add_argument("--payload-size", type=int, default=2000)
+    parser.add_argument("--lm-delay", type=float, default=0.05)
+    parser.add_argument("--redis-latency", type=float, default=0.0005)
+    parser.add_argument("--weaviate-latency", type=float, default=0.005)
+    parser.add_argument("--memory-writes", type=int, default=50)
+    parser.add_argument("--no-tool-cache", action="store_true", help="send every tool call to the stub servers")
+    parser.add_argument("--output", help="also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
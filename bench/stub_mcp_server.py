@@ -0,0 +1,40 @@
+"""Local stdio MCP server standing in for brave-search, context7, ... in benchmarks.
+
+python -m bench.stub_mcp_server --latency 0.2 --payload-size 4000 --tools 3
+"""
+import argparse
+import asyncio
+import hashlib
+
+from mcp.server.fastmcp import FastMCP
+
+def payload(seed: str, size: int) -> str:
+    """Deterministic text of the requested size, so cached and uncached runs return the same bytes"""
+    block = hashlib.sha256(seed.encode()).hexdigest()
+    return (block * (size // len(block) + 1))[:size]
+
+def build_server(name: str, latency: float, payload_size: int, tools: int) -> FastMCP:
+    server = FastMCP(name)
+
+    for index in range(tools):
+        def make_tool(index: int):
+            async def search(query: str) -> str:
+                await asyncio.sleep(latency)
+                return payload(f"{index}:{query}", payload_size)
+            search.__name__ = f"search_{index}"
+            search.__doc__ = f"Search the stub index {index} for the query and return the matching documents"
+            return search
+        server.tool()(make_tool(index))
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--name", default="stub")
+    parser.add_argument("--latency", type=float, default=0.1, help="seconds every tool call sleeps")
+    parser.add_argument("--payload-size", type=int, default=2000, help="characters returned by every tool call")
+    parser.add_argument("--tools", type=int, default=2, help="number of tools the server lists")
+    args = parser.parse_args()
+    build_server(args.name, args.latency, args.payload_size, args.tools).run(transport="stdio")
+
+if __name__ == "__main__":
+    main()
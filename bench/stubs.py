@@ -0,0 +1,263 @@
+import re
+import json
+import time
+import asyncio
+from types import SimpleNamespace
+from typing import Optional
+
+import dspy
+
+FIELD = re.compile(r"\[\[ ## (\w+) ## \]\]")
+
+class ScriptedLM(dspy.BaseLM):
+    """Deterministic LM for benchmarks, answers every output field the chat adapter asks for after a fixed delay.
+    Plans name every stub agent once and each ReAct loop calls one tool before finishing"""
+    def __init__(self, delay: float = 0.05, agent_names: tuple = (), tool_name: str = "search_0"):
+        super().__init__(model="bench/scripted")
+        self.delay = delay
+        self.agent_names = list(agent_names)
+        self.tool_name = tool_name
+        self.calls = 0
+
+    def _fields(self, text: str) -> list[str]:
+        instruction = text[text.rfind("Respond with the corresponding output fields"):]
+        return [field for field in dict.fromkeys(FIELD.findall(instruction)) if field != "completed"]
+
+    def _value(self, field: str, text: str) -> str:
+        finished = "observation_0" in text
+        if field == "execution_plan":
+            return json.dumps([
+                {"plan_id": i + 1, "agent_name": name, "agent_input": "benchmark", "agent_context": "", "agent_target": "documents", "depends_on": []}
+                for i, name in enumerate(self.agent_names)
+            ])
+        if field == "next_tool_name":
+            return "finish" if finished else self.tool_name
+        if field == "next_tool_args":
+            return "{}" if finished else json.dumps({"query": "benchmark"})
+        if field == "route":
+            return "full_plan"
+        if field == "confidence":
+            return "0.9"
+        if field == "format_output":
+            return "markdown"
+        return f"Scripted {field}."
+
+    def _complete(self, prompt: Optional[str], messages: Optional[list]) -> list[str]:
+        messages = messages or [{"role": "user", "content": prompt}]
+        text = messages[-1]["content"]
+        sections = [f"[[ ## {field} ## ]]\n{self._value(field, text)}" for field in self._fields(text)]
+        self.calls += 1
+        return ["\n\n".join(sections + ["[[ ## completed ## ]]"])]
+
+    def __call__(self, prompt=None, messages=None, **kwargs):
+        time.sleep(self.delay)
+        return self._complete(prompt, messages)
+
+    async def acall(self, prompt=None, messages=None, **kwargs):
+        await asyncio.sleep(self.delay)
+        return self._complete(prompt, messages)
+
+class InMemoryRedis:
+    """Just enough of redis.asyncio.Redis for MemCache, every round-trip costs `latency` seconds"""
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.hashes: dict[str, dict] = {}
+        self.lists: dict[str, list] = {}
+        self.zsets: dict[str, dict] = {}
+        self.strings: dict[str, str] = {}
+        self.round_trips = 0
+
+    async def _round_trip(self):
+        self.round_trips += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def _hgetall(self, key: str) -> dict:
+        return dict(self.hashes.get(key, {}))
+
+    def _hset(self, key: str, mapping: dict) -> int:
+        self.hashes.setdefault(key, {}).update({k: str(v) for k, v in mapping.items()})
+        return len(mapping)
+
+    def _rpush(self, key: str, *values: str) -> int:
+        self.lists.setdefault(key, []).extend(values)
+        return len(self.lists[key])
+
+    def _ltrim(self, key: str, start: int, end: int) -> bool:
+        items = self.lists.get(key, [])
+        self.lists[key] = items[start:len(items) if end == -1 else end + 1]
+        return True
+
+    def _lrange(self, key: str, start: int, end: int) -> list:
+        items = self.lists.get(key, [])
+        return items[start:len(items) if end == -1 else end + 1]
+
+    def _hincrby(self, key: str, field: str, amount: int = 1) -> int:
+        values = self.hashes.setdefault(key, {})
+        values[field] = str(int(values.get(field, 0)) + amount)
+        return int(values[field])
+
+    def _exists(self, key: str) -> int:
+        return int(key in self.strings or key in self.hashes or key in self.lists)
+
+    def _set(self, key: str, value: str, ex: Optional[int] = None, nx: bool = False) -> bool:
+        if nx and key in self.strings:
+            return False
+        self.strings[key] = str(value)
+        return True
+
+    def _hget(self, key: str, field: str) -> Optional[str]:
+        return self.hashes.get(key, {}).get(field)
+
+    def _hsetnx(self, key: str, field: str, value: str) -> bool:
+        values = self.hashes.setdefault(key, {})
+        if field in values:
+            return False
+        values[field] = str(value)
+        return True
+
+    def _zadd(self, key: str, mapping: dict) -> int:
+        zset = self.zsets.setdefault(key, {})
+        added = len(set(mapping) - set(zset))
+        zset.update({member: float(score) for member, score in mapping.items()})
+        return added
+
+    def _zscore(self, key: str, member: str) -> Optional[float]:
+        return self.zsets.get(key, {}).get(member)
+
+    def _zrevrange(self, key: str, start: int, end: int) -> list:
+        members = sorted(self.zsets.get(key, {}).items(), key=lambda item: item[1], reverse=True)
+        return [member for member, _ in members[start:len(members) if end == -1 else end + 1]]
+
+    def _expire(self, key: str, seconds: int) -> bool:
+        # entries never expire during a benchmark run
+        return key in self.hashes or key in self.lists
+
+    async def hgetall(self, key: str) -> dict:
+        await self._round_trip()
+        return self._hgetall(key)
+
+    async def hset(self, key: str, mapping: dict) -> int:
+        await self._round_trip()
+        return self._hset(key, mapping)
+
+    async def lrange(self, key: str, start: int, end: int) -> list:
+        await self._round_trip()
+        return self._lrange(key, start, end)
+
+    async def zrevrange(self, key: str, start: int, end: int) -> list:
+        await self._round_trip()
+        return self._zrevrange(key, start, end)
+
+    async def zcard(self, key: str) -> int:
+        await self._round_trip()
+        return len(self.zsets.get(key, {}))
+
+    async def set(self, key: str, value: str, ex: Optional[int] = None, nx: bool = False) -> bool:
+        await self._round_trip()
+        return self._set(key, value, ex=ex, nx=nx)
+
+    async def publish(self, channel: str, message: str) -> int:
+        await self._round_trip()
+        return 0
+
+    def pubsub(self) -> "InMemoryPubSub":
+        return InMemoryPubSub()
+
+    async def delete(self, key: str) -> int:
+        await self._round_trip()
+        return int(self.strings.pop(key, None) is not None)
+
+    def pipeline(self, transaction: bool = True) -> "InMemoryPipeline":
+        return InMemoryPipeline(self)
+
+    async def aclose(self):
+        pass
+
+class InMemoryPubSub:
+    """A single process never receives invalidations from others"""
+    async def subscribe(self, *channels: str):
+        pass
+
+    async def get_message(self, ignore_subscribe_messages: bool = False, timeout: float = 0.0):
+        await asyncio.sleep(timeout)
+        return None
+
+    async def aclose(self):
+        pass
+
+class InMemoryPipeline:
+    """Commands are queued until execute, except between watch and multi where they run immediately like redis-py.
+    Nothing runs concurrently inside a benchmark round-trip, so a watched key never changes"""
+    def __init__(self, redis: InMemoryRedis):
+        self.redis = redis
+        self.commands: list = []
+        self.watching = False
+
+    async def watch(self, *keys: str):
+        await self.redis._round_trip()
+        self.watching = True
+
+    async def unwatch(self):
+        self.watching = False
+
+    def multi(self):
+        self.watching = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.commands = []
+
+    def __getattr__(self, name: str):
+        method = getattr(self.redis, f"_{name}", None)
+        if method is None:
+            raise AttributeError(name)
+        if self.watching:
+            async def immediate(*args, **kwargs):
+                await self.redis._round_trip()
+                return method(*args, **kwargs)
+            return immediate
+        def queue(*args, **kwargs):
+            self.commands.append((method, args, kwargs))
+            return self
+        return queue
+
+    async def execute(self) -> list:
+        await self.redis._round_trip()
+        commands, self.commands = self.commands, []
+        return [method(*args, **kwargs) for method, args, kwargs in commands]
+
+class InMemoryCollection:
+    """Stand-in for a Weaviate collection, inserts cost `latency` seconds per request"""
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.objects: list[dict] = []
+        self.requests = 0
+        self.data = self
+
+    def insert(self, properties: dict):
+        self.insert_many([properties])
+
+    def insert_many(self, objects: list):
+        self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        self.objects.extend(getattr(obj, "properties", obj) for obj in objects)
+        return SimpleNamespace(errors={}, has_errors=False)
+
+    def iterator(self, return_properties: Optional[list] = None):
+        return iter([SimpleNamespace(properties=properties) for properties in self.objects])
+
+class InMemoryWeaviate:
+    """Stand-in for the Weaviate client, exposes the single Conversation collection"""
+    def __init__(self, latency: float = 0.0):
+        self.collection = InMemoryCollection(latency)
+        self.collections = self
+
+    def get(self, name: str) -> InMemoryCollection:
+        return self.collection
+
+    def close(self):
+        pass
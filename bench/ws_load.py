@@ -0,0 +1,180 @@
+"""Websocket load test: thousands of idle sockets on one worker, then a fan-out to all of them with a few clients
+that never read, to show the fast ones are not held back and what the send queue policy does to the slow ones.
+
+The server runs the real ConnectionManager in a uvicorn subprocess, so its memory is measured apart from the clients.
+
+python -m bench.ws_load --sockets 5000 --slow 10 --messages 200 --payload-size 16384 --policy disconnect
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import resource
+import subprocess
+
+from bench.run import ROOT, summarize
+
+def rss_mb(pid: int) -> float:
+    with open(f"/proc/{pid}/status", "r") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return round(int(line.split()[1]) / 1024, 1)
+    return 0.0
+
+def raise_fd_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return hard
+
+def build_app(args: argparse.Namespace):
+    from fastapi import FastAPI, WebSocket
+    from utils.chatsocket import ConnectionManager
+
+    manager = ConnectionManager(max_queue=args.max_queue, policy=args.policy, send_timeout=args.send_timeout)
+    app = FastAPI()
+
+    @app.websocket("/ws")
+    async def websocket_endpoint(websocket: WebSocket):
+        async def on_message(message: str):
+            await manager.subscribe(websocket, message)
+
+        await manager.connect(websocket)
+        await manager.handler(websocket, on_message=on_message)
+
+    @app.post("/publish")
+    async def publish(channel: str, count: int, size: int):
+        started = time.perf_counter()
+        for seq in range(count):
+            await manager.publish(channel, json.dumps({"seq": seq, "sent": time.time(), "pad": "x" * size}))
+            # let the senders run between messages like a token stream would
+            await asyncio.sleep(0)
+        return {"enqueue_seconds": round(time.perf_counter() - started, 4)}
+
+    @app.get("/stats")
+    async def stats():
+        return {**manager.stats(), "subscribers": len(manager.channels.get(args.channel, ())), "rss_mb": rss_mb(os.getpid())}
+
+    return app
+
+def serve(args: argparse.Namespace):
+    import uvicorn
+    raise_fd_limit()
+    uvicorn.run(build_app(args), host="127.0.0.1", port=args.port, log_level="warning", backlog=4096)
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+async def run(args: argparse.Namespace) -> dict:
+    import httpx
+    import websockets
+
+    fd_limit = raise_fd_limit()
+    if fd_limit < args.sockets + 100:
+        raise SystemExit(f"open file limit {fd_limit} is too low for {args.sockets} sockets")
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "bench.ws_load", "--serve", "--port", str(port), "--max-queue", str(args.max_queue),
+         "--policy", args.policy, "--send-timeout", str(args.send_timeout), "--channel", args.channel],
+        env={**os.environ, "PYTHONPATH": ROOT}
+    )
+    url = f"ws://127.0.0.1:{port}/ws"
+    clients, received, latencies = [], {}, []
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=None) as http:
+            for _ in range(100):
+                try:
+                    baseline = (await http.get("/stats")).json()
+                    break
+                except httpx.TransportError:
+                    await asyncio.sleep(0.1)
+            else:
+                raise SystemExit("websocket server did not start")
+
+            semaphore = asyncio.Semaphore(200)
+            async def open_client(index: int):
+                async with semaphore:
+                    # the slow clients buffer a single frame and then stop reading, TCP does the rest
+                    client = await websockets.connect(url, ping_interval=None, max_queue=1 if index < args.slow else 64, max_size=None)
+                    await client.send(args.channel)
+                    clients.append((index, client))
+
+            started = time.perf_counter()
+            await asyncio.gather(*[open_client(index) for index in range(args.sockets)])
+            connect_seconds = time.perf_counter() - started
+            while (await http.get("/stats")).json()["subscribers"] < args.sockets:
+                await asyncio.sleep(0.1)
+            await asyncio.sleep(args.idle)
+            idle = (await http.get("/stats")).json()
+
+            async def read(index: int, client):
+                count = 0
+                try:
+                    while count < args.messages:
+                        message = json.loads(await client.recv())
+                        latencies.append(time.time() - message["sent"])
+                        count += 1
+                except Exception:
+                    pass
+                received[index] = count
+
+            readers = [asyncio.create_task(read(index, client)) for index, client in clients if index >= args.slow]
+            started = time.perf_counter()
+            published = (await http.post("/publish", params={"channel": args.channel, "count": args.messages, "size": args.payload_size})).json()
+            await asyncio.wait(readers, timeout=args.timeout)
+            fanout_seconds = time.perf_counter() - started
+            final = (await http.get("/stats")).json()
+    finally:
+        await asyncio.gather(*[client.close() for _, client in clients], return_exceptions=True)
+        server.terminate()
+        server.wait()
+
+    fast = args.sockets - args.slow
+    return {
+        "settings": vars(args),
+        "connect_seconds": round(connect_seconds, 3),
+        "server_rss_mb": {"baseline": baseline["rss_mb"], "idle": idle["rss_mb"]},
+        "kb_per_idle_socket": round((idle["rss_mb"] - baseline["rss_mb"]) * 1024 / args.sockets, 2),
+        "fanout": {
+            **published,
+            "seconds": round(fanout_seconds, 3),
+            "fast_clients_complete": sum(1 for index, count in received.items() if count == args.messages),
+            "fast_clients": fast,
+            "latency": summarize(latencies)
+        },
+        "server": {key: final[key] for key in ("connections", "sent", "dropped", "slow_disconnects", "rss_mb")}
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sockets", type=int, default=5000)
+    parser.add_argument("--slow", type=int, default=10, help="clients that never read")
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--payload-size", type=int, default=16384)
+    parser.add_argument("--channel", default="thread:bench")
+    parser.add_argument("--idle", type=float, default=2, help="seconds the sockets stay idle before the memory reading")
+    parser.add_argument("--timeout", type=float, default=60, help="seconds to wait for the fast clients")
+    parser.add_argument("--max-queue", type=int, default=64)
+    parser.add_argument("--policy", default="disconnect", choices=["disconnect", "drop_oldest", "drop_newest"])
+    parser.add_argument("--send-timeout", type=float, default=10)
+    parser.add_argument("--output", help="also write the results as JSON to this file")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args)
+        return
+
+    results = asyncio.run(run(args))
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
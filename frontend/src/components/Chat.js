@@ -367,7 +367,7 @@ const Chat = () => {
                           <path d="M140,128a12,12,0,1,1-12-12A12,12,0,0,1,140,128ZM84,116a12,12,0,1,0,12,12A12,12,0,0,0,84,116Zm88,0a12,12,0,1,0,12,12A12,12,0,0,0,172,116Zm60,12A104,104,0,0,1,79.12,219.82L45.07,231.17a16,16,0,0,1-20.24-20.24l11.35-34.05A104,104,0,1,1,232,128Zm-16,0A88,88,0,1,0,51.81,172.06a8,8,0,0,1,.66,6.54L40,216,77.4,203.53a7.85,7.85,0,0,1,2.53-.42,8,8,0,0,1,4,1.08A88,88,0,0,0,216,128Z"></path>
                         </svg>
                       </div>
-                      <p className="text-[#0d151c] text-sm font-medium leading-normal truncate max-w-[120px]">{chat.thread_id}</p>
+                      <p className="text-[#0d151c] text-sm font-medium leading-normal truncate max-w-[120px]">{chat.title || chat.thread_id}</p>
                     </div>
                   ))
                 )}
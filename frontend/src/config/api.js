@@ -50,7 +50,8 @@ export const apiService = {
     if (!threadId) throw new Error('Thread ID is required');
     const response = await fetch(`${API_CONFIG.BASE_URL}/fetch_conversation/${threadId}`);
     if (!response.ok) throw new Error('Failed to fetch conversation');
-    return response.json();
+    const page = await response.json();
+    return page.items;
   }
 };
 
@@ -1,8 +1,12 @@
 import json
-from fastapi import FastAPI, Depends, HTTPException, BackgroundTasks, WebSocket
+import uuid
+import asyncio
+from fastapi import FastAPI, Depends, HTTPException, BackgroundTasks, WebSocket, Header
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from typing import Dict, Any, Optional
 from contextlib import asynccontextmanager
 from agent.agent_tool_manager import AgentToolManager
+from agent.agent_sync import AgentSync
 from agent.internal_gen import extract_memory_info
 from utils import logger
 from datetime import datetime, timezone
@@ -11,6 +15,9 @@ from memory import Memory
 from fastapi.middleware.cors import CORSMiddleware
 import dspy
 from utils.chatsocket import ChatSocket, ConnectionManager
+from utils.telemetry import span, setup_tracing, render_metrics, JOBS
+from worker import JobQueue, Worker
+from conf import config
 
 mcp_config = {
     "context7": {
@@ -39,17 +46,42 @@ mcp_config = {
     },
 }
 
-connection_manager = ConnectionManager()
 agent_manager = AgentToolManager(mcp_config)
 memory = Memory()
+# with [websocket] relay thread channels reach the sockets of every worker through Redis pub/sub
+connection_manager = ConnectionManager.from_config(memory.memcache.redis_client)
+background_jobs: set[asyncio.Task] = set()
+# with [jobs] enabled the memory update goes to a Redis stream drained by `python -m worker`, so it survives restarts
+# admin changes to the agent set reach every web worker, not only the one that served the request
+agent_sync = AgentSync.from_config(agent_manager, memory.memcache.redis_client)
+job_queue = JobQueue.from_config(memory.memcache.redis_client) if config.getboolean("jobs", "enabled", fallback=False) else None
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup - nothing needed since agent is lazy-loaded
+    setup_tracing()
+    memory.start()
+    await connection_manager.start()
+    stop_worker = asyncio.Event()
+    worker_task = None
+    if job_queue is not None and config.getboolean("jobs", "run_in_web", fallback=False):
+        worker = Worker(job_queue, handlers={"memory.add": memory.adding_new_memory}, parallelism=config.getint("jobs", "parallelism", fallback=4))
+        worker_task = asyncio.create_task(worker.run(stop_worker))
     await agent_manager.load_agent()
+    agent_manager.start_probe()
+    if agent_sync is not None:
+        agent_sync.start()
     yield
     # Shutdown
+    if agent_sync is not None:
+        await agent_sync.close()
+    await agent_manager.stop_probe()
+    stop_worker.set()
+    if worker_task is not None:
+        await worker_task
+    await connection_manager.close()
     await agent_manager.close_agent()
+    await memory.close()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -61,18 +93,52 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+async def prepare_context(thread_id: Optional[str], question: str) -> tuple[str, str]:
+    """Resolve the thread id and the conversation context: thread memory plus related past turns"""
+    context = await memory.get_context(thread_id=thread_id, question=question)
+    if thread_id is None:
+        # the random part keeps thread ids unguessable, knowing one is enough to watch the thread over the websocket
+        thread_id = f"{datetime.now(timezone.utc).strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex}"
+    return thread_id, json.dumps(context) if context else ""
+
+async def add_memory_in_process(**turn):
+    """In-process fallback without the job queue, nothing retries it so errors are only logged"""
+    try:
+        await memory.adding_new_memory(**turn)
+    except Exception as e:
+        logger.error(f"Error storing the memory of thread {turn['thread_id']}: {e}")
+
+async def remember(user_message: str, assistant_response: str, thread_id: str, background_tasks: Optional[BackgroundTasks] = None):
+    """Schedule the memory update of a finished turn, on the job queue when enabled, otherwise in this process"""
+    memory.index_turn(user_message=user_message, assistant_response=assistant_response, thread_id=thread_id)
+    # turn_id and timestamp stay the same across retries, so a retried job does not store the turn twice
+    turn = {"user_message": user_message, "assistant_response": assistant_response, "thread_id": thread_id,
+            "turn_id": uuid.uuid4().hex, "timestamp": datetime.now(timezone.utc).isoformat()}
+    if job_queue is not None:
+        await job_queue.enqueue("memory.add", turn)
+    elif background_tasks is not None:
+        background_tasks.add_task(add_memory_in_process, **turn)
+    else:
+        task = asyncio.create_task(add_memory_in_process(**turn))
+        background_jobs.add(task)
+        task.add_done_callback(background_jobs.discard)
+
+async def stream_query(question: str, thread_id: Optional[str], bypass_cache: bool = False, mode: Optional[str] = None, coalesce: bool = True):
+    """Run the pipeline in streaming mode, every event carries the thread id"""
+    thread_id, mem_summary = await prepare_context(thread_id, question)
+    async for event in agent_manager.astream(question=question, context=mem_summary, bypass_cache=bypass_cache, mode=mode, coalesce=coalesce):
+        event["thread_id"] = thread_id
+        yield event
+
 @app.post("/query/{thread_id}")
 @app.post("/query")
 async def query_agent(input:dict, background_tasks: BackgroundTasks, thread_id: Optional[str] = None):
     try:
-      mem_summary = ""
-      if thread_id is not None:
-          mem_summary = json.dumps(memory.memcache.get_summary(thread_id=thread_id))
-      else:
-          thread_id = datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S")
+      thread_id, mem_summary = await prepare_context(thread_id, input['question'])
       
-      result = await agent_manager.acall(question=input['question'], context=mem_summary)
-      background_tasks.add_task(memory.adding_new_memory, user_message=input['question'], assistant_response=result, thread_id=thread_id)
+      with span("query"):
+          result = await agent_manager.acall(question=input['question'], context=mem_summary, bypass_cache=input.get('bypass_cache', False), mode=input.get('mode'), coalesce=input.get('coalesce', True))
+      await remember(user_message=input['question'], assistant_response=result, thread_id=thread_id, background_tasks=background_tasks)
       return {
           "result": result,
           "thread_id": thread_id
@@ -85,17 +151,88 @@ Error in query_agent:{dspy.inspect_history(1)}
 """)
       raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/query_stream/{thread_id}")
+@app.post("/query_stream")
+async def query_agent_stream(input:dict, background_tasks: BackgroundTasks, thread_id: Optional[str] = None):
+    """Server-sent events version of /query: plan, agent_result per agent, token per conclusion chunk, then final"""
+    async def event_stream():
+        try:
+            with span("query", streaming=True):
+                async for event in stream_query(question=input['question'], thread_id=thread_id, bypass_cache=input.get('bypass_cache', False), mode=input.get('mode'), coalesce=input.get('coalesce', True)):
+                    if event["type"] == "final":
+                        await remember(user_message=input['question'], assistant_response=event["result"], thread_id=event["thread_id"], background_tasks=background_tasks)
+                    yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        except Exception as e:
+            logger.error(f"Error in query_agent_stream:{e}")
+            yield f"event: error\ndata: {json.dumps({'type': 'error', 'detail': str(e)})}\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
 @app.get("/fetch_thread_ids")
 async def get_thread_ids(limit: int = 10, offset: int = 0):
-    return memory.conversation.get_distinct_thread_ids(limit=limit, offset=offset)
+    """Most recently updated threads first, each with its title, message count and last response preview"""
+    return await memory.list_threads(limit=limit, offset=offset)
 
 @app.get("/fetch_conversation/{thread_id}")
-async def get_conversation(thread_id: str, limit: int = 50, offset: int = 0):
-    return memory.conversation.load_conversation_by_thread_id(thread_id=thread_id, limit=limit, offset=offset)
+async def get_conversation(thread_id: str, limit: int = 50, cursor: Optional[str] = None):
+    """Newest page first, pass next_cursor back as cursor to load the turns before it"""
+    return await memory.load_conversation(thread_id=thread_id, limit=limit, cursor=cursor)
+
+def require_admin(x_admin_token: Optional[str] = Header(default=None)):
+    """Admin endpoints start arbitrary commands, they stay disabled until [admin] token is set"""
+    token = config.get("admin", "token", fallback="")
+    if not token:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled")
+    if x_admin_token != token:
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+@app.get("/admin/agents", dependencies=[Depends(require_admin)])
+async def list_agents():
+    return agent_manager.agent_status()
+
+@app.put("/admin/agents/{name}", dependencies=[Depends(require_admin)])
+async def put_agent(name: str, server: dict):
+    """Add or replace one MCP server, body is its config: {"command": ..., "args": [...], "env": {...}}"""
+    if "command" not in server or not isinstance(server.get("args", []), list):
+        raise HTTPException(status_code=422, detail="Server config needs a command and a list of args")
+    server = {"args": [], **server}
+    if not await agent_manager.add_agent(name, server):
+        raise HTTPException(status_code=502, detail=agent_manager.agent_status().get(name, {}).get("last_error", "Failed to start"))
+    if agent_sync is not None:
+        await agent_sync.publish("add", name, server)
+    return agent_manager.agent_status()[name]
+
+@app.delete("/admin/agents/{name}", dependencies=[Depends(require_admin)])
+async def delete_agent(name: str):
+    if not await agent_manager.remove_agent(name):
+        raise HTTPException(status_code=404, detail=f"Unknown agent {name}")
+    if agent_sync is not None:
+        await agent_sync.publish("remove", name)
+    return {"removed": name}
+
+@app.post("/admin/agents/{name}/restart", dependencies=[Depends(require_admin)])
+async def restart_agent(name: str):
+    try:
+        restarted = await agent_manager.restart_agent(name)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Unknown agent {name}")
+    if not restarted:
+        raise HTTPException(status_code=502, detail=agent_manager.agent_status()[name]["last_error"])
+    if agent_sync is not None:
+        await agent_sync.publish("restart", name)
+    return agent_manager.agent_status()[name]
+
+@app.get("/metrics")
+async def metrics():
+    if job_queue is not None:
+        for state, value in (await job_queue.stats()).items():
+            JOBS.set(value, state=state)
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "agent_ready": agent_manager.is_agent_ready()}
+    jobs = await job_queue.stats() if job_queue is not None else None
+    return {"status": "healthy", "agent_ready": agent_manager.is_agent_ready(), "agents": agent_manager.agent_status(), "conversation_queue_depth": memory.conversation.queue_depth, "recall": memory.recall.stats() if memory.recall else None, "jobs": jobs, "tool_cache": agent_manager.tool_cache.stats(), "compaction": agent_manager.compactor.stats() if agent_manager.compactor else None, "mcp_pools": agent_manager.pool_stats(), "models": agent_manager.models.stats(), "programs": agent_manager.programs.stats() if agent_manager.programs else None, "websockets": connection_manager.stats(), "coalescing": agent_manager.coalescer.stats() if agent_manager.coalescer else None}
 
 # @app.websocket("/ws/chat")
 # async def websocket_endpoint(websocket: WebSocket):
@@ -104,8 +241,66 @@ async def health_check():
 
 @app.websocket("/ws/{client_id}")
 async def websocket_endpoint(websocket: WebSocket, client_id: int):
+    # the thread this socket last asked in, the ones it watches on purpose and the queries running per thread
+    current: Optional[str] = None
+    watched: set[str] = set()
+    running: Dict[str, int] = {}
+
+    async def leave(channel: Optional[str]):
+        """Stop the events of a thread the socket neither watches, asks in now nor still waits on"""
+        if channel is not None and channel != current and channel not in watched and not running.get(channel):
+            await connection_manager.unsubscribe(websocket, channel)
+
+    async def run_query(input: dict):
+        nonlocal current
+        channel = None
+        try:
+            async for event in stream_query(question=input['question'], thread_id=input.get('thread_id'), bypass_cache=input.get('bypass_cache', False), mode=input.get('mode'), coalesce=input.get('coalesce', True)):
+                if channel is None:
+                    channel = f"thread:{event['thread_id']}"
+                    running[channel] = running.get(channel, 0) + 1
+                    previous, current = current, channel
+                    await connection_manager.subscribe(websocket, channel)
+                    await leave(previous)
+                await connection_manager.publish(channel, json.dumps(event))
+                if event["type"] == "final":
+                    await remember(user_message=input['question'], assistant_response=event["result"], thread_id=event["thread_id"])
+        except Exception as e:
+            logger.error(f"Error in websocket query:{e}")
+            await connection_manager.send_personal_message(json.dumps({"type": "error", "detail": str(e)}), websocket)
+        finally:
+            if channel is not None:
+                running[channel] -= 1
+                await leave(channel)
+
+    async def on_message(message: str):
+        """Each message is a JSON query {"question": ..., "thread_id": ...}, answered with the streaming events on the
+        thread channel, so every socket watching the thread sees them. Queries run in the background, the socket can
+        subscribe, unsubscribe or ask again meanwhile. Asking in another thread stops the events of the previous one
+        once its query is done. {"subscribe": thread_id} and {"unsubscribe": thread_id} watch a thread without asking anything"""
+        nonlocal current
+        try:
+            input = json.loads(message)
+            if "subscribe" in input:
+                channel = f"thread:{input['subscribe']}"
+                watched.add(channel)
+                await connection_manager.subscribe(websocket, channel)
+                return
+            if "unsubscribe" in input:
+                channel = f"thread:{input['unsubscribe']}"
+                watched.discard(channel)
+                if channel == current:
+                    current = None
+                await connection_manager.unsubscribe(websocket, channel)
+                return
+            if not connection_manager.spawn(websocket, run_query(input)):
+                await connection_manager.send_personal_message(json.dumps({"type": "error", "detail": "Too many queries running on this connection"}), websocket)
+        except Exception as e:
+            logger.error(f"Error in websocket message:{e}")
+            await connection_manager.send_personal_message(json.dumps({"type": "error", "detail": str(e)}), websocket)
+
     await connection_manager.connect(websocket)
-    await connection_manager.handler(websocket)
+    await connection_manager.handler(websocket, on_message=on_message)
 
 if __name__ == "__main__":
     import uvicorn
@@ -1,46 +1,130 @@
 import dspy
+import uuid
+import base64
+import asyncio
+from weaviate.util import generate_uuid5
 from memory.conversation import ConversationManager, Conversation
 from memory.memcache import MemCache
+from memory.recall import RecallIndex
 from typing import Optional
 from conf import config
+from utils import logger
 from datetime import datetime, timezone
 
 class MemorySignature(dspy.Signature):
     """Extract memory information from the conversation with purpose of context for continue conversation"""
-    user_message: str = dspy.InputField(description="The input/question from user")
-    assistant_response: str = dspy.InputField(description="The assistant response to the user message")
-    memory: str = dspy.InputField(description="The memory of the conversation above this question and answer")
+    new_turns: list[dict] = dspy.InputField(description="The turns since the memory was last updated, each with the user_message and the assistant_response")
+    memory: str = dspy.InputField(description="The memory of the conversation above these turns")
     summary: str = dspy.OutputField(description="The information finally extracted combined with the memory that consistenct with the whole conversation")
 
+def encode_cursor(timestamp: str) -> str:
+    # to the millisecond like Weaviate, or the next page would find the same turn again at its stored precision
+    return base64.urlsafe_b64encode(to_millisecond(parse_timestamp(timestamp)).isoformat().encode()).decode()
+
+def decode_cursor(cursor: str) -> Optional[datetime]:
+    """Timestamp the cursor points before, None when the cursor is not one of ours"""
+    try:
+        before = datetime.fromisoformat(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except (ValueError, UnicodeDecodeError):
+        return None
+    return before if before.tzinfo else before.replace(tzinfo=timezone.utc)
+
+def parse_timestamp(timestamp: str) -> datetime:
+    parsed = datetime.fromisoformat(timestamp)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+def to_millisecond(timestamp: datetime) -> datetime:
+    return timestamp.replace(microsecond=timestamp.microsecond // 1000 * 1000)
+
+def merge_turns(stored: list[dict], tail: list[dict]) -> list[dict]:
+    """Weaviate turns plus the recent ones it does not have yet, oldest first. The same turn is matched by its
+    timestamp to the millisecond, Weaviate does not keep more"""
+    turns = {}
+    for turn in stored + tail:
+        turns.setdefault(to_millisecond(parse_timestamp(turn["timestamp"])), turn)
+    return [turns[key] for key in sorted(turns)]
+
 class Memory:
-    def __init__(self):
-        self.memcache = MemCache()
-        self.conversation = ConversationManager()
-        lm = dspy.LM(
+    def __init__(self, memcache: Optional[MemCache] = None, conversation: Optional[ConversationManager] = None, lm: Optional[dspy.LM] = None):
+        self.memcache = memcache or MemCache()
+        self.conversation = conversation or ConversationManager()
+        lm = lm or dspy.LM(
             model=config.get("memory", "model"),
             api_key=config.get("memory", "api_key")
         )
         self.cot = dspy.ChainOfThought(MemorySignature)
         self.cot.set_lm(lm)
+        self.summarize_every = config.getint("memory", "summarize_every", fallback=4)
+        self.token_budget = config.getint("memory", "token_budget", fallback=2000)
+        self.max_recent_turns = max(self.summarize_every, config.getint("memory", "max_recent_turns", fallback=20))
+        self.backfill_index = config.getboolean("memory", "backfill_thread_index", fallback=True)
+        self._backfill: Optional[asyncio.Task] = None
+        self.recall = RecallIndex.from_config(self.conversation)
+        self._indexing: set[asyncio.Task] = set()
 
-    def get_summary(self, thread_id: str) -> Optional[dict]:
-        return self.memcache.get_summary(thread_id)
-    
-    def adding_new_memory(self, user_message: str, assistant_response: str, thread_id: str):
-        current_mem = self.memcache.get_summary(thread_id=thread_id)
+    async def get_summary(self, thread_id: str) -> Optional[dict]:
+        return await self.memcache.get_summary(thread_id)
+
+    async def get_context(self, thread_id: Optional[str], question: Optional[str] = None) -> Optional[dict]:
+        """Thread context plus, when recall is on, the past turns of other threads relevant to the question"""
+        thread_context = self._thread_context(thread_id) if thread_id is not None else asyncio.sleep(0)
+        if question is None or self.recall is None:
+            return await thread_context
+        thread_context, related = await asyncio.gather(thread_context, self.recall.search(question, thread_id))
+        if related:
+            thread_context = {**(thread_context or {}), "related_history": related}
+        return thread_context
+
+    async def _thread_context(self, thread_id: str) -> Optional[dict]:
+        """Summary of the thread plus the raw turns that are not folded into the summary yet"""
+        current_mem = await self.memcache.get_summary(thread_id=thread_id)
         if current_mem is None:
-            current_mem = {
-                "memory": "",
-                "message_count": 0
-            }
-        mem_summary = current_mem.get("memory", "") if current_mem else ""
-        summary = self.cot(user_message=user_message, assistant_response=assistant_response, memory=mem_summary)
-        current_time = datetime.now(timezone.utc)
-        self.memcache.set_summary(thread_id=thread_id, summary=summary.summary, last_updated=int(current_time.timestamp()), last_conversation={
+            return None
+        pending = int(current_mem.get("message_count", 0)) - int(current_mem.get("summarized_count", 0))
+        turns = await self.memcache.get_turns(thread_id) if pending > 0 else []
+        return {
+            "summary": current_mem.get("summary", ""),
+            "recent_turns": turns[-pending:] if pending > 0 else [],
+            "message_count": current_mem.get("message_count", "0")
+        }
+
+    def _estimate_tokens(self, turns: list[dict]) -> int:
+        return sum(len(turn["user_message"]) + len(turn["assistant_response"]) for turn in turns) // 4
+
+    async def adding_new_memory(self, user_message: str, assistant_response: str, thread_id: str, turn_id: Optional[str] = None, timestamp: Optional[str] = None):
+        """Store the turn raw and only fold the pending turns into the summary every summarize_every turns, or sooner
+        when they exceed the token budget. Runs as a retried job, so every write is idempotent for the same turn_id
+        and storage errors propagate instead of being logged away"""
+        turn_id = turn_id or uuid.uuid4().hex
+        current_time = datetime.fromisoformat(timestamp) if timestamp else datetime.now(timezone.utc)
+        last_conversation = {
             "user_message": user_message,
-            "assistant_response": assistant_response
-        }, message_count=int(current_mem.get("message_count", 0)) + 1)
-        self.conversation.add_new_conversation(Conversation(
+            "assistant_response": assistant_response,
+            "timestamp": current_time.isoformat()
+        }
+        current_mem, turns = await self.memcache.record_turn(thread_id=thread_id, turn_id=turn_id, turn=last_conversation,
+                                                             last_updated=int(current_time.timestamp()), max_turns=self.max_recent_turns)
+        message_count = int(current_mem.get("message_count", 0))
+        summarized_count = int(current_mem.get("summarized_count", 0))
+        unsummarized = message_count - summarized_count
+        pending = turns[-unsummarized:] if unsummarized > 0 else []
+        if pending and (unsummarized >= self.summarize_every or self._estimate_tokens(pending) > self.token_budget):
+            try:
+                summary = (await self.cot.acall(new_turns=pending, memory=current_mem.get("summary", ""))).summary
+            except Exception as e:
+                summary = None
+                logger.error(f"Error summarizing memory of thread {thread_id}, keeping the turns pending: {e}")
+            if summary is not None and not await self.memcache.commit_summary(thread_id, summary, message_count, summarized_count):
+                logger.info(f"Summary of thread {thread_id} was updated concurrently, the turns stay pending")
+
+        await self.memcache.index_threads([{
+            "thread_id": thread_id,
+            "last_updated": int(current_time.timestamp()),
+            "title": user_message,
+            "preview": assistant_response
+        }])
+        # acknowledged only once Weaviate has it, a worker dying before that retries the job
+        stored = self.conversation.add_new_conversation(Conversation(
             thread_id=thread_id,
             timestamp=current_time,
             user_message=user_message,
@@ -48,4 +132,87 @@ class Memory:
             category="",
             tags=[],
             rate=None
-        ))
\ No newline at end of file
+        ), uuid=generate_uuid5(turn_id))
+        self.conversation.writer.flush_soon()
+        await stored
+
+    def index_turn(self, user_message: str, assistant_response: str, thread_id: str):
+        """Add a finished turn to this process' recall index in the background"""
+        if self.recall is None:
+            return
+        task = asyncio.create_task(self.recall.add(thread_id=thread_id, user_message=user_message, assistant_response=assistant_response,
+                                                   timestamp=datetime.now(timezone.utc).isoformat()))
+        self._indexing.add(task)
+        task.add_done_callback(self._indexing.discard)
+
+    async def load_conversation(self, thread_id: str, limit: int = 50, cursor: Optional[str] = None) -> dict:
+        """One page of the thread in time order, next_cursor pages towards older turns. Pages covered by the recent
+        turns kept in Redis never reach Weaviate, otherwise the Weaviate page is merged with them so the newest turns
+        still waiting in the write buffer are not missing. A cursor that cannot be decoded restarts from the newest page"""
+        before = decode_cursor(cursor) if cursor else None
+        tail, complete = await self._load_tail(thread_id, before)
+        if complete or len(tail) >= limit:
+            turns, has_more = tail[-limit:], len(tail) > limit or not complete
+        else:
+            try:
+                stored, has_more = await asyncio.to_thread(self.conversation.load_conversation_by_thread_id, thread_id, limit, before)
+            except Exception as e:
+                logger.error(f"Error loading conversation of thread {thread_id}: {e}")
+                stored, has_more = [], bool(tail)
+            turns = merge_turns(stored, tail)
+            has_more = has_more or len(turns) > limit
+            turns = turns[-limit:]
+        return {
+            "items": turns,
+            "next_cursor": encode_cursor(turns[0]["timestamp"]) if has_more and turns else None,
+            "cursor_reset": bool(cursor) and before is None
+        }
+
+    async def _load_tail(self, thread_id: str, before: Optional[datetime]) -> tuple[list[dict], bool]:
+        """Recent turns older than the cursor, and whether they are all the thread has before it"""
+        tail, message_count = await self.memcache.get_tail(thread_id)
+        # turns stored before they carried a timestamp cannot be placed against a cursor
+        tail = [turn for turn in tail if "timestamp" in turn]
+        # message_count never expires, an old thread whose tail expired and restarted is not complete
+        complete = 0 < message_count <= len(tail)
+        return [{
+            "timestamp": turn["timestamp"],
+            "user_message": turn["user_message"],
+            "assistant_response": turn["assistant_response"],
+            "category": "",
+            "tags": [],
+            "rate": None
+        } for turn in tail if before is None or parse_timestamp(turn["timestamp"]) < before], complete
+
+    async def list_threads(self, limit: int = 10, offset: int = 0) -> list[dict]:
+        return await self.memcache.list_threads(limit=limit, offset=offset)
+
+    async def backfill_thread_index(self):
+        """One-time fill of the thread index from Weaviate with the threads written before the index existed"""
+        try:
+            if not await self.memcache.claim_backfill():
+                return
+        except Exception as e:
+            logger.error(f"Error claiming the thread index backfill: {e}")
+            return
+        try:
+            threads = await asyncio.to_thread(self.conversation.collect_threads)
+            for i in range(0, len(threads), 500):
+                await self.memcache.index_threads(threads[i:i + 500], only_missing=True)
+            logger.info(f"Backfilled the thread index with {len(threads)} threads")
+        except Exception as e:
+            logger.error(f"Error backfilling the thread index, will retry on next start: {e}")
+            await self.memcache.release_backfill()
+
+    def start(self):
+        self.memcache.start()
+        self.conversation.start()
+        if self.backfill_index and self._backfill is None:
+            self._backfill = asyncio.create_task(self.backfill_thread_index())
+
+    async def close(self):
+        if self._backfill is not None:
+            await asyncio.gather(self._backfill, return_exceptions=True)
+            self._backfill = None
+        await self.conversation.close()
+        await self.memcache.close()
@@ -42,15 +42,17 @@
   }
 '''
 
+import asyncio
 from pydantic import BaseModel, Field
 from datetime import datetime, timezone
-from typing import Optional
+from typing import Optional, Any
 
 from conf import config
+from utils import logger
 
 import weaviate
-from weaviate.classes.aggregate import GroupByAggregate
-from weaviate.classes.query import Filter
+from weaviate.classes.query import Filter, Sort, MetadataQuery
+from weaviate.classes.data import DataObject
 from weaviate.classes.init import Auth, AdditionalConfig, Timeout
 
 
@@ -66,9 +68,84 @@ class Conversation(BaseModel):
 class ConversationModel(BaseModel):
     conversation: list[Conversation] = Field(description="List of conversations")
 
+class ConversationWriter:
+    """Write-behind buffer that flushes conversations through Weaviate's batch API by size or time. put returns a
+    future resolved once the object is stored, or failed once it ran out of retries"""
+    def __init__(self, collection: Any, batch_size: int = 100, flush_interval: float = 1.0, max_retries: int = 3):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self._buffer: list[tuple[dict, Optional[str], int, asyncio.Future]] = []
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._stopping = False
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._buffer)
+
+    def put(self, properties: dict, uuid: Optional[str] = None) -> asyncio.Future:
+        """Objects with the same uuid overwrite each other, so writing a turn again does not duplicate it"""
+        future = asyncio.get_running_loop().create_future()
+        self._buffer.append((properties, uuid, 0, future))
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+        return future
+
+    def flush_soon(self):
+        """Start the next flush now instead of after flush_interval, objects queued meanwhile still share the batch"""
+        self._wakeup.set()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        """Write everything currently buffered, failed objects are requeued until max_retries"""
+        async with self._flush_lock:
+            pending, self._buffer = self._buffer, []
+            for i in range(0, len(pending), self.batch_size):
+                batch = pending[i:i + self.batch_size]
+                try:
+                    response = await asyncio.to_thread(self.collection.data.insert_many, [DataObject(properties=properties, uuid=uuid) for properties, uuid, _, _ in batch])
+                    failed = {index: error.message for index, error in response.errors.items()}
+                except Exception as e:
+                    failed = {index: str(e) for index in range(len(batch))}
+                for index, (properties, uuid, attempts, future) in enumerate(batch):
+                    if index not in failed:
+                        if not future.done():
+                            future.set_result(None)
+                    elif attempts + 1 < self.max_retries:
+                        self._buffer.append((properties, uuid, attempts + 1, future))
+                    else:
+                        logger.error(f"Dropping conversation of thread {properties.get('threadId')} after {attempts + 1} attempts: {failed[index]}")
+                        if not future.done():
+                            future.set_exception(RuntimeError(f"Conversation not stored: {failed[index]}"))
+
+    async def close(self):
+        """Let the running flush finish its batches instead of cancelling it, then write whatever is left"""
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        while self._buffer:
+            await self.flush()
+
 class ConversationManager:
-    def __init__(self):
-        self.client = weaviate.connect_to_custom(
+    def __init__(self, client: Optional[Any] = None):
+        self.client = client or weaviate.connect_to_custom(
           http_host=config.get("weaviate","http_url"),
           http_port=int(config.get("weaviate","http_port")),
           http_secure=bool(config.get("weaviate","http_ssl")),
@@ -79,9 +156,27 @@ class ConversationManager:
           additional_config=AdditionalConfig(timeout=Timeout(init=5))
         )
         self.conversation_schema = self.client.collections.get("Conversation")
+        self.writer = ConversationWriter(
+            self.conversation_schema,
+            batch_size=config.getint("weaviate", "batch_size", fallback=100),
+            flush_interval=config.getfloat("weaviate", "flush_interval", fallback=1.0),
+            max_retries=config.getint("weaviate", "max_retries", fallback=3)
+        )
 
-    def add_new_conversation(self, conversation: Conversation):
-        self.conversation_schema.data.insert({
+    @property
+    def queue_depth(self) -> int:
+        return self.writer.queue_depth
+
+    def start(self):
+        self.writer.start()
+
+    async def close(self):
+        await self.writer.close()
+        self.client.close()
+
+    def add_new_conversation(self, conversation: Conversation, uuid: Optional[str] = None) -> asyncio.Future:
+        """Queue the conversation, the writer persists it with the next batch. Await the result to know it is stored"""
+        return self.writer.put({
           "threadId": conversation.thread_id,
           "timestamp": conversation.timestamp.isoformat(),
           "userMessage": conversation.user_message,
@@ -89,38 +184,53 @@ class ConversationManager:
           "category": conversation.category,
           "tags": conversation.tags,
           "rate": conversation.rate
-        })
+        }, uuid=uuid)
     
-    def near_text_search(self, query: str, limit: int = 5):
+    def near_text_search(self, query: str, limit: int = 5, exclude_thread_id: Optional[str] = None):
         return self.conversation_schema.query.near_text(
             query=query,
-            limit=limit
+            limit=limit,
+            filters=Filter.by_property("threadId").not_equal(exclude_thread_id) if exclude_thread_id else None,
+            return_metadata=MetadataQuery(distance=True)
         ).objects
     
-    def get_distinct_thread_ids(self, limit: int = 10, offset: int = 0):
-        response = self.conversation_schema.aggregate.over_all(
-            group_by=GroupByAggregate(prop="threadId")
-        )
+    def collect_threads(self) -> list[dict]:
+        """Scan the whole collection once and summarise every thread, used to backfill the thread index"""
+        threads = {}
+        for obj in self.conversation_schema.iterator(return_properties=["threadId", "timestamp", "userMessage", "assistantResponse"]):
+            properties = obj.properties
+            timestamp = properties.get("timestamp")
+            timestamp = (datetime.fromisoformat(timestamp) if isinstance(timestamp, str) else timestamp).timestamp()
+            thread = threads.setdefault(properties["threadId"], {
+                "thread_id": properties["threadId"], "message_count": 0,
+                "first": timestamp, "title": properties.get("userMessage") or "",
+                "last_updated": timestamp, "preview": properties.get("assistantResponse") or ""
+            })
+            thread["message_count"] += 1
+            if timestamp < thread["first"]:
+                thread["first"], thread["title"] = timestamp, properties.get("userMessage") or ""
+            if timestamp >= thread["last_updated"]:
+                thread["last_updated"], thread["preview"] = timestamp, properties.get("assistantResponse") or ""
+        return [{**thread, "last_updated": int(thread["last_updated"])} for thread in threads.values()]
 
-        return [{"thread_id": group.grouped_by.value} for group in response.groups]
-    
-    def load_conversation_by_thread_id(self, thread_id: str, limit: int = 50, offset: int = 0):
+    def load_conversation_by_thread_id(self, thread_id: str, limit: int = 50, before: Optional[datetime] = None) -> tuple[list[dict], bool]:
+        """Newest turns of the thread older than `before`, returned oldest first, plus whether older turns remain"""
+        filters = Filter.by_property("threadId").equal(thread_id)
+        if before is not None:
+            filters = filters & Filter.by_property("timestamp").less_than(before)
         response = self.conversation_schema.query.fetch_objects(
-            filters=Filter.by_property("threadId").equal(thread_id),
-            limit=limit,
-            offset=offset
+            filters=filters,
+            sort=Sort.by_property("timestamp", ascending=False),
+            limit=limit + 1
         )
-
-        if response and response.objects:
-            convs = response.objects
-            return [{"timestamp": obj.properties.get("timestamp") if isinstance(obj.properties.get("timestamp"), str) else obj.properties.get("timestamp").isoformat(),
-              "user_message": obj.properties.get("userMessage"),
-              "assistant_response": obj.properties.get("assistantResponse"),
-              "category": obj.properties.get("category"),
-              "tags": obj.properties.get("tags", []),
-              "rate": obj.properties.get("rate")}
-             for obj in convs]
-        return []
+        convs = response.objects if response and response.objects else []
+        return [{"timestamp": obj.properties.get("timestamp") if isinstance(obj.properties.get("timestamp"), str) else obj.properties.get("timestamp").isoformat(),
+          "user_message": obj.properties.get("userMessage"),
+          "assistant_response": obj.properties.get("assistantResponse"),
+          "category": obj.properties.get("category"),
+          "tags": obj.properties.get("tags", []),
+          "rate": obj.properties.get("rate")}
+         for obj in reversed(convs[:limit])], len(convs) > limit
 
     # def set_summary(self, conversation_id: str, summary: str, message_count: int = 0) -> bool:
     #         """Store conversation summary in Redis"""
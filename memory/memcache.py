@@ -1,33 +1,246 @@
-import redis
+import redis.asyncio as redis
+from redis.exceptions import WatchError
 from typing import Optional
 import json
+import asyncio
+from datetime import datetime, timezone
+
+from conf import config
+from utils import logger
+from utils.cache import TTLCache
+
+THREAD_INDEX = "threads:index"
+THREAD_BACKFILL = "threads:index:backfilled"
+TITLE_LENGTH = 80
+PREVIEW_LENGTH = 160
+INVALIDATE_CHANNEL = "memcache:invalidate"
+TURN_MARKER_TTL = 7 * 24 * 3600 # long enough to outlive every retry of a memory job
 
 class MemCache:
-    def __init__(self):
-        self.redis_client = redis.Redis(host="localhost", port=9379, decode_responses=True)
+    def __init__(self, redis_client: Optional[redis.Redis] = None):
+        # waits for a free connection instead of raising once max_connections are checked out
+        self.pool = redis.BlockingConnectionPool(
+            host=config.get("redis", "host", fallback="localhost"),
+            port=config.getint("redis", "port", fallback=9379),
+            db=config.getint("redis", "db", fallback=0),
+            password=config.get("redis", "password", fallback=None),
+            max_connections=config.getint("redis", "max_connections", fallback=50),
+            timeout=config.getfloat("redis", "pool_timeout", fallback=5),
+            decode_responses=True
+        )
+        self.redis_client = redis_client or redis.Redis(connection_pool=self.pool)
+        self.summary_ttl = config.getint("redis", "summary_ttl", fallback=0) # 0 keeps summaries forever
+        self.local = TTLCache(
+            maxsize=config.getint("redis", "local_cache_size", fallback=1024),
+            ttl=config.getfloat("redis", "local_cache_ttl", fallback=30)
+        )
+        self._listener: Optional[asyncio.Task] = None
+
+    def _to_summary(self, data: dict) -> Optional[dict]:
+        if not data:
+            return None
+        return {
+            'summary': data.get('summary', ''),
+            'last_updated': data.get('last_updated', ''),
+            'message_count': data.get('message_count', '0'),
+            'summarized_count': data.get('summarized_count', '0'),
+            'last_conversation': data.get('last_conversation', '')
+        }
 
-    def get_summary(self, thread_id: str) -> Optional[dict]:
+    async def get_summary(self, thread_id: str) -> Optional[dict]:
+        if thread_id in self.local:
+            return self.local.get(thread_id)
         try:
-            data = self.redis_client.hgetall(f"{thread_id}")
-            if not data:
-                return None
-            return {
-                'summary': data.get('summary', ''),
-                'last_updated': data.get('last_updated', ''),
-                'message_count': data.get('message_count', '0'),
-                'last_conversation': data.get('last_conversation', '')
-            }
+            summary = self._to_summary(await self.redis_client.hgetall(f"{thread_id}"))
+            # a thread that does not exist yet is not cached, its first turn may land any moment
+            if summary is not None:
+                self.local.set(thread_id, summary)
+            return summary
         except Exception as e:
-            print(f"Error retrieving summary: {e}")
+            logger.error(f"Error retrieving summary: {e}")
             return None
-    
-    def set_summary(self, thread_id: str, summary: str, last_updated: int, last_conversation: dict, message_count: int):
+
+    async def get_summaries(self, thread_ids: list[str]) -> dict[str, Optional[dict]]:
+        """Fetch many summaries in a single round-trip, hot threads are served from the local cache"""
+        summaries = {thread_id: self.local.get(thread_id) for thread_id in thread_ids if thread_id in self.local}
+        missing = [thread_id for thread_id in thread_ids if thread_id not in summaries]
+        if not missing:
+            return summaries
+        try:
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                for thread_id in missing:
+                    pipe.hgetall(f"{thread_id}")
+                results = await pipe.execute()
+            for thread_id, data in zip(missing, results):
+                summaries[thread_id] = self._to_summary(data)
+                if summaries[thread_id] is not None:
+                    self.local.set(thread_id, summaries[thread_id])
+        except Exception as e:
+            logger.error(f"Error retrieving summaries: {e}")
+            for thread_id in missing:
+                summaries.setdefault(thread_id, None)
+        return summaries
+
+    async def record_turn(self, thread_id: str, turn_id: str, turn: dict, last_updated: int, max_turns: int) -> tuple[dict, list[dict]]:
+        """Append the turn and bump message_count in one transaction, once per turn_id so a retried job does not count
+        it twice. Returns the thread hash and the recent turns right after it, errors propagate
+        to the caller. The thread hash expires with summary_ttl, so the count of every turn the thread ever had is
+        kept in its meta hash too, which does not"""
+        turns_key, marker, meta = f"{thread_id}:turns", f"{thread_id}:turn:{turn_id}", f"threads:meta:{thread_id}"
+        async with self.redis_client.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    await pipe.watch(marker)
+                    recorded = await pipe.exists(marker)
+                    pipe.multi()
+                    if not recorded:
+                        pipe.set(marker, 1, ex=TURN_MARKER_TTL)
+                        pipe.hincrby(f"{thread_id}", "message_count", 1)
+                        pipe.hincrby(meta, "message_count", 1)
+                        pipe.hset(f"{thread_id}", mapping={"last_updated": last_updated, "last_conversation": json.dumps(turn)})
+                        pipe.rpush(turns_key, json.dumps(turn))
+                        pipe.ltrim(turns_key, -max_turns, -1)
+                        if self.summary_ttl > 0:
+                            pipe.expire(f"{thread_id}", self.summary_ttl)
+                            pipe.expire(turns_key, self.summary_ttl)
+                    pipe.hgetall(f"{thread_id}")
+                    pipe.lrange(turns_key, 0, -1)
+                    results = await pipe.execute()
+                    break
+                except WatchError:
+                    continue
+        await self.invalidate(thread_id)
+        return self._to_summary(results[-2]) or {}, [json.loads(item) for item in results[-1]]
+
+    async def commit_summary(self, thread_id: str, summary: str, summarized_count: int, expected_summarized_count: int) -> bool:
+        """Store a new summary only if nobody folded turns in since it was computed, False when it lost that race"""
+        async with self.redis_client.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    await pipe.watch(f"{thread_id}")
+                    if int(await pipe.hget(f"{thread_id}", "summarized_count") or 0) != expected_summarized_count:
+                        await pipe.unwatch()
+                        return False
+                    pipe.multi()
+                    pipe.hset(f"{thread_id}", mapping={"summary": summary, "summarized_count": summarized_count})
+                    await pipe.execute()
+                    break
+                except WatchError:
+                    # a new turn bumped message_count, the summary is still valid for the turns it covers
+                    continue
+        await self.invalidate(thread_id)
+        return True
+
+    async def invalidate(self, thread_id: str):
+        """Drop the thread from the local cache of every process"""
+        self.local.pop(thread_id)
+        try:
+            await self.redis_client.publish(INVALIDATE_CHANNEL, thread_id)
+        except Exception as e:
+            logger.error(f"Error publishing cache invalidation: {e}")
+
+    async def _listen_invalidations(self):
+        while True:
+            pubsub = self.redis_client.pubsub()
+            try:
+                await pubsub.subscribe(INVALIDATE_CHANNEL)
+                # whatever changed while we were not subscribed is unknown
+                self.local.clear()
+                while True:
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                    if message is not None:
+                        self.local.pop(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Cache invalidation listener error: {e}")
+                self.local.clear()
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
+
+    def start(self):
+        if self._listener is None and self.local.maxsize > 0 and self.local.ttl > 0:
+            self._listener = asyncio.create_task(self._listen_invalidations())
+
+    async def get_turns(self, thread_id: str) -> list[dict]:
         try:
-            self.redis_client.hset(f"{thread_id}", mapping={
-                'summary': summary,
-                'last_updated': last_updated,
-                'message_count': message_count,
-                'last_conversation': json.dumps(last_conversation)
-            })
+            return [json.loads(item) for item in await self.redis_client.lrange(f"{thread_id}:turns", 0, -1)]
         except Exception as e:
-            print(f"Error setting summary: {e}")
\ No newline at end of file
+            logger.error(f"Error retrieving turns: {e}")
+            return []
+
+    async def get_tail(self, thread_id: str) -> tuple[list[dict], int]:
+        """Recent turns of the thread with the number of turns it ever had, read fresh in a single round-trip"""
+        try:
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                pipe.lrange(f"{thread_id}:turns", 0, -1)
+                pipe.hget(f"threads:meta:{thread_id}", "message_count")
+                turns, message_count = await pipe.execute()
+            return [json.loads(item) for item in turns], int(message_count or 0)
+        except Exception as e:
+            logger.error(f"Error retrieving the recent turns: {e}")
+            return [], 0
+
+    async def index_threads(self, threads: list[dict], only_missing: bool = False):
+        """Upsert threads into the listing index, a sorted set scored by last_updated plus a small meta hash per thread.
+        The title is the first question of the thread and never overwritten, only_missing skips threads already indexed.
+        message_count is only written when given, record_turn keeps it up to date for new turns.
+        Errors propagate, a memory job that fails here is retried"""
+        if not threads:
+            return
+        if only_missing:
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                for thread in threads:
+                    pipe.zscore(THREAD_INDEX, thread["thread_id"])
+                scores = await pipe.execute()
+            threads = [thread for thread, score in zip(threads, scores) if score is None]
+        async with self.redis_client.pipeline(transaction=True) as pipe:
+            for thread in threads:
+                key = f"threads:meta:{thread['thread_id']}"
+                pipe.zadd(THREAD_INDEX, {thread["thread_id"]: thread["last_updated"]})
+                pipe.hsetnx(key, "title", thread["title"][:TITLE_LENGTH])
+                fields = {"last_updated": thread["last_updated"], "preview": thread["preview"][:PREVIEW_LENGTH]}
+                if "message_count" in thread:
+                    fields["message_count"] = thread["message_count"]
+                pipe.hset(key, mapping=fields)
+            await pipe.execute()
+
+    async def list_threads(self, limit: int = 10, offset: int = 0) -> list[dict]:
+        """Most recently updated threads first, one range query on the index and one pipelined fetch of the page"""
+        try:
+            thread_ids = await self.redis_client.zrevrange(THREAD_INDEX, offset, offset + limit - 1)
+            if not thread_ids:
+                return []
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                for thread_id in thread_ids:
+                    pipe.hgetall(f"threads:meta:{thread_id}")
+                metas = await pipe.execute()
+        except Exception as e:
+            logger.error(f"Error listing threads: {e}")
+            return []
+        return [{
+            "thread_id": thread_id,
+            "title": meta.get("title", ""),
+            "message_count": int(meta.get("message_count", 0)),
+            "last_updated": int(float(meta.get("last_updated", 0))),
+            "preview": meta.get("preview", "")
+        } for thread_id, meta in zip(thread_ids, metas)]
+
+    async def count_threads(self) -> int:
+        return await self.redis_client.zcard(THREAD_INDEX)
+
+    async def claim_backfill(self) -> bool:
+        """True for the single process allowed to run the one-time thread index backfill"""
+        return bool(await self.redis_client.set(THREAD_BACKFILL, int(datetime.now(timezone.utc).timestamp()), nx=True))
+
+    async def release_backfill(self):
+        await self.redis_client.delete(THREAD_BACKFILL)
+
+    async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+            self._listener = None
+        await self.redis_client.aclose()
+        await self.pool.aclose()
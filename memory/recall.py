@@ -0,0 +1,140 @@
+import time
+import asyncio
+from typing import Optional
+
+import dspy
+import numpy as np
+
+from conf import config
+from utils import logger
+from utils.cache import TTLCache
+
+class RecallIndex:
+    """Long-term memory across threads. Turns answered by this process are embedded into a local NumPy index,
+    lookups that find fewer than top_k good matches there fall back to Weaviate near_text, all within latency_budget"""
+    def __init__(self, embedder: dspy.Embedder, conversation=None, top_k: int = 3, min_score: float = 0.35,
+                 latency_budget: float = 0.3, max_entries: int = 5000, snippet_chars: int = 600):
+        self.embedder = embedder
+        self.conversation = conversation
+        self.top_k = top_k
+        self.min_score = min_score
+        self.latency_budget = latency_budget
+        self.max_entries = max_entries
+        self.snippet_chars = snippet_chars
+        self._entries: list[dict] = []
+        self._matrix: Optional[np.ndarray] = None
+        self._embeddings = TTLCache(maxsize=512, ttl=300)
+        self._remote = TTLCache(maxsize=256, ttl=60)
+        self.local_hits = 0
+        self.remote_lookups = 0
+        self.timeouts = 0
+
+    @classmethod
+    def from_config(cls, conversation=None) -> Optional["RecallIndex"]:
+        if not config.getboolean("recall", "enabled", fallback=False):
+            return None
+        return cls(
+            embedder=dspy.Embedder(config.get("recall", "embedding_model", fallback="openai/text-embedding-3-small")),
+            conversation=conversation if config.getboolean("recall", "weaviate_fallback", fallback=True) else None,
+            top_k=config.getint("recall", "top_k", fallback=3),
+            min_score=config.getfloat("recall", "min_score", fallback=0.35),
+            latency_budget=config.getfloat("recall", "latency_budget", fallback=0.3),
+            max_entries=config.getint("recall", "max_entries", fallback=5000),
+            snippet_chars=config.getint("recall", "snippet_chars", fallback=600)
+        )
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "local_hits": self.local_hits, "remote_lookups": self.remote_lookups, "timeouts": self.timeouts}
+
+    async def _embed(self, text: str) -> np.ndarray:
+        vector = self._embeddings.get(text)
+        if vector is None:
+            vector = np.asarray((await asyncio.to_thread(self.embedder, [text]))[0], dtype=np.float32)
+            vector /= np.linalg.norm(vector) or 1.0
+            self._embeddings.set(text, vector)
+        return vector
+
+    def _snippet(self, thread_id: str, timestamp: str, user_message: str, assistant_response: str, score: float) -> dict:
+        return {
+            "thread_id": thread_id,
+            "timestamp": timestamp,
+            "question": user_message[:self.snippet_chars],
+            "answer": assistant_response[:self.snippet_chars],
+            "score": round(score, 3)
+        }
+
+    async def add(self, thread_id: str, user_message: str, assistant_response: str, timestamp: str):
+        try:
+            vector = await self._embed(f"{user_message}\n{assistant_response[:2000]}")
+        except Exception as e:
+            logger.error(f"Error embedding turn for recall: {e}")
+            return
+        self._entries.append({
+            "vector": vector,
+            "thread_id": thread_id,
+            "timestamp": timestamp,
+            "user_message": user_message,
+            "assistant_response": assistant_response
+        })
+        if len(self._entries) > self.max_entries:
+            # oldest turns go first, Weaviate still has them
+            self._entries = self._entries[-self.max_entries:]
+        self._matrix = None
+
+    def _search_local(self, vector: np.ndarray, thread_id: Optional[str]) -> list[dict]:
+        if not self._entries:
+            return []
+        if self._matrix is None:
+            self._matrix = np.stack([entry["vector"] for entry in self._entries])
+        scores = self._matrix @ vector
+        hits = []
+        for index in np.argsort(-scores):
+            if scores[index] < self.min_score or len(hits) == self.top_k:
+                break
+            entry = self._entries[index]
+            if entry["thread_id"] != thread_id:
+                hits.append(self._snippet(entry["thread_id"], entry["timestamp"], entry["user_message"], entry["assistant_response"], float(scores[index])))
+        return hits
+
+    def _search_remote(self, question: str, thread_id: Optional[str]) -> list[dict]:
+        key = (question, thread_id)
+        hits = self._remote.get(key)
+        if hits is None:
+            hits = []
+            for obj in self.conversation.near_text_search(question, limit=self.top_k, exclude_thread_id=thread_id):
+                score = 1 - (obj.metadata.distance or 0)
+                if score < self.min_score:
+                    continue
+                properties = obj.properties
+                timestamp = properties.get("timestamp")
+                hits.append(self._snippet(properties.get("threadId"), timestamp if isinstance(timestamp, str) else timestamp.isoformat(),
+                                          properties.get("userMessage") or "", properties.get("assistantResponse") or "", score))
+            self._remote.set(key, hits)
+        return hits
+
+    async def search(self, question: str, thread_id: Optional[str] = None) -> list[dict]:
+        """Most relevant past turns of other threads, whatever is found before the latency budget runs out"""
+        deadline = time.perf_counter() + self.latency_budget
+        hits = []
+        try:
+            vector = await asyncio.wait_for(self._embed(question), timeout=self.latency_budget)
+            hits = self._search_local(vector, thread_id)
+            if hits:
+                self.local_hits += 1
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+        except Exception as e:
+            logger.error(f"Error searching the recall index: {e}")
+
+        remaining = deadline - time.perf_counter()
+        if len(hits) < self.top_k and self.conversation is not None and remaining > 0:
+            self.remote_lookups += 1
+            try:
+                seen = {(hit["thread_id"], hit["timestamp"]) for hit in hits}
+                remote = await asyncio.wait_for(asyncio.to_thread(self._search_remote, question, thread_id), timeout=remaining)
+                hits += [hit for hit in remote if (hit["thread_id"], hit["timestamp"]) not in seen]
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+            except Exception as e:
+                logger.error(f"Error searching past conversations: {e}")
+        return sorted(hits, key=lambda hit: hit["score"], reverse=True)[:self.top_k]
@@ -1,5 +1,17 @@
+import json
+import time
+import uuid
+import asyncio
+from typing import Any, Callable, Awaitable, Coroutine, Dict, Optional
+
 from fastapi import WebSocket
-from typing import Callable, Awaitable
+import redis.asyncio as redis
+
+from conf import config
+from utils import logger
+from utils.telemetry import WS_CONNECTIONS, WS_DROPPED
+
+BROADCAST = "broadcast" # every connection of every worker
 
 class ChatSocket:
     def __init__(self):
@@ -17,36 +29,278 @@ class ChatSocket:
                 await websocket.send_text(f"Echo: {data}")
         except Exception as e:
             # Handle disconnects or errors
-            await websocket.close() 
+            await websocket.close()
 
 async def on_message(message: str):
     print(f"Received message: {message}")
 
+class Connection:
+    """One client socket and the bounded queue of messages waiting to be sent to it"""
+    def __init__(self, websocket: WebSocket, max_queue: int):
+        self.websocket = websocket
+        self.queue: asyncio.Queue[str] = asyncio.Queue(maxsize=max_queue)
+        self.channels: set[str] = set()
+        self.tasks: set[asyncio.Task] = set()
+        self.sender: Optional[asyncio.Task] = None
+        self.dropped = 0
+        self.closed = False
+
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: list[WebSocket] = []
+    """Websocket connections of this worker. Every connection has its own send queue drained by its own task, so a
+    fan-out only enqueues and a slow client delays nobody but itself. When its queue is full the policy decides:
+    drop_oldest or drop_newest message, or disconnect the client. With [websocket] relay messages published to a
+    channel also reach the subscribers connected to the other workers, through Redis pub/sub. Long work started by a
+    message runs in up to max_tasks tasks per connection, so the socket keeps reading while it runs"""
+    def __init__(self, max_queue: int = 1024, policy: str = "disconnect", send_timeout: float = 10, redis_client: Optional[redis.Redis] = None, prefix: str = "ws",
+                 max_tasks: int = 4):
+        if policy not in ("drop_oldest", "drop_newest", "disconnect"):
+            raise ValueError(f"Unknown websocket policy {policy}")
+        self.max_queue = max_queue
+        self.policy = policy
+        self.send_timeout = send_timeout
+        self.redis_client = redis_client
+        self.prefix = prefix
+        self.max_tasks = max_tasks
+        self.origin = uuid.uuid4().hex
+        self.connections: Dict[WebSocket, Connection] = {}
+        self.channels: Dict[str, set[Connection]] = {}
+        self._pubsub = None
+        self._subscribed: set[str] = set()
+        self._subscription_lock = asyncio.Lock()
+        self._relay: Optional[asyncio.Task] = None
+        self._closing: set[asyncio.Task] = set()
+        self.sent = 0
+        self.dropped = 0
+        self.slow_disconnects = 0
+        self.relayed = 0
+
+    @classmethod
+    def from_config(cls, redis_client: Optional[redis.Redis] = None) -> "ConnectionManager":
+        return cls(
+            max_queue=config.getint("websocket", "max_queue", fallback=1024),
+            policy=config.get("websocket", "policy", fallback="disconnect"),
+            send_timeout=config.getfloat("websocket", "send_timeout", fallback=10),
+            redis_client=redis_client if config.getboolean("websocket", "relay", fallback=False) else None,
+            prefix=config.get("websocket", "prefix", fallback="ws"),
+            max_tasks=config.getint("websocket", "max_tasks", fallback=4)
+        )
+
+    @property
+    def active_connections(self) -> list[WebSocket]:
+        return list(self.connections)
 
-    async def connect(self, websocket: WebSocket):
+    async def connect(self, websocket: WebSocket) -> Connection:
         await websocket.accept()
-        self.active_connections.append(websocket)
+        connection = Connection(websocket, self.max_queue)
+        connection.sender = asyncio.create_task(self._send_loop(connection))
+        self.connections[websocket] = connection
+        WS_CONNECTIONS.inc()
+        return connection
+
+    def _remove(self, connection: Connection):
+        if connection.closed:
+            return
+        connection.closed = True
+        self.connections.pop(connection.websocket, None)
+        for channel in connection.channels:
+            subscribers = self.channels.get(channel)
+            if subscribers is not None:
+                subscribers.discard(connection)
+                if not subscribers:
+                    # the relay loop unsubscribes from Redis on its next sync
+                    del self.channels[channel]
+        for task in connection.tasks:
+            if task is not asyncio.current_task():
+                task.cancel()
+        WS_CONNECTIONS.dec()
 
     def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+        connection = self.connections.get(websocket)
+        if connection is None:
+            return
+        self._remove(connection)
+        if connection.sender is not None and connection.sender is not asyncio.current_task():
+            connection.sender.cancel()
+
+    async def _close(self, websocket: WebSocket, code: int):
+        try:
+            await websocket.close(code=code)
+        except Exception:
+            pass # already gone
+
+    def _kick(self, connection: Connection, code: int = 1013):
+        """Drop a client that fell behind, its receive loop ends once the socket is closed"""
+        self.slow_disconnects += 1
+        self.disconnect(connection.websocket)
+        task = asyncio.create_task(self._close(connection.websocket, code))
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    async def _send_loop(self, connection: Connection):
+        while True:
+            message = await connection.queue.get()
+            try:
+                await asyncio.wait_for(connection.websocket.send_text(message), timeout=self.send_timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Closing a websocket that did not take a message within {self.send_timeout}s")
+                WS_DROPPED.inc(policy="timeout")
+                self._kick(connection)
+                return
+            except Exception:
+                # the client went away, the receive loop cleans up
+                self.disconnect(connection.websocket)
+                return
+            self.sent += 1
+
+    def _enqueue(self, connection: Connection, message: str) -> bool:
+        if connection.closed:
+            return False
+        try:
+            connection.queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            pass
+        self.dropped += 1
+        connection.dropped += 1
+        WS_DROPPED.inc(policy=self.policy)
+        if self.policy == "disconnect":
+            self._kick(connection)
+            return False
+        if self.policy == "drop_oldest":
+            connection.queue.get_nowait()
+            connection.queue.put_nowait(message)
+            return True
+        return False
+
+    def _deliver(self, channel: str, message: str) -> int:
+        """Enqueue for every local subscriber, never waits on a client"""
+        targets = list(self.connections.values()) if channel == BROADCAST else list(self.channels.get(channel, ()))
+        return sum(self._enqueue(connection, message) for connection in targets)
+
+    def spawn(self, websocket: WebSocket, coroutine: Coroutine[Any, Any, None]) -> bool:
+        """Run the coroutine in a task of the connection, cancelled when it disconnects. False, and the coroutine is
+        not run, once the connection is gone or already runs max_tasks of them"""
+        connection = self.connections.get(websocket)
+        if connection is None or len(connection.tasks) >= self.max_tasks:
+            coroutine.close()
+            return False
+        task = asyncio.create_task(coroutine)
+        connection.tasks.add(task)
+        task.add_done_callback(connection.tasks.discard)
+        return True
+
+    async def send_personal_message(self, message: str, websocket: WebSocket) -> bool:
+        connection = self.connections.get(websocket)
+        return connection is not None and self._enqueue(connection, message)
+
+    async def publish(self, channel: str, message: str) -> int:
+        """Send to the subscribers of a channel on this worker and relay to the other workers, returns the local deliveries"""
+        delivered = self._deliver(channel, message)
+        if self.redis_client is not None:
+            try:
+                await self.redis_client.publish(f"{self.prefix}:{channel}", json.dumps({"origin": self.origin, "message": message}))
+            except Exception as e:
+                logger.error(f"Error relaying websocket message on {channel}: {e}")
+        return delivered
+
+    async def broadcast(self, message: str) -> int:
+        return await self.publish(BROADCAST, message)
+
+    async def subscribe(self, websocket: WebSocket, channel: str):
+        connection = self.connections.get(websocket)
+        if connection is None or channel in connection.channels:
+            return
+        connection.channels.add(channel)
+        self.channels.setdefault(channel, set()).add(connection)
+        if channel not in self._subscribed:
+            await self._sync_subscriptions()
+
+    async def unsubscribe(self, websocket: WebSocket, channel: str):
+        connection = self.connections.get(websocket)
+        if connection is None or channel not in connection.channels:
+            return
+        connection.channels.discard(channel)
+        subscribers = self.channels.get(channel)
+        if subscribers is not None:
+            subscribers.discard(connection)
+            if not subscribers:
+                del self.channels[channel]
+
+    async def _sync_subscriptions(self):
+        """Subscribe this worker to the Redis channels that have local subscribers, and only to those"""
+        if self._pubsub is None:
+            return
+        async with self._subscription_lock:
+            wanted = set(self.channels) | {BROADCAST}
+            added, removed = wanted - self._subscribed, self._subscribed - wanted
+            if added:
+                await self._pubsub.subscribe(*[f"{self.prefix}:{channel}" for channel in added])
+            if removed:
+                await self._pubsub.unsubscribe(*[f"{self.prefix}:{channel}" for channel in removed])
+            self._subscribed = wanted
+
+    async def _relay_loop(self):
+        last_sync = time.monotonic()
+        while True:
+            try:
+                message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if message is not None:
+                    payload = json.loads(message["data"])
+                    if payload["origin"] != self.origin:
+                        self.relayed += 1
+                        self._deliver(message["channel"][len(self.prefix) + 1:], payload["message"])
+                if time.monotonic() - last_sync > 1:
+                    last_sync = time.monotonic()
+                    await self._sync_subscriptions()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Websocket relay error: {e}")
+                await asyncio.sleep(1)
+
+    async def start(self):
+        """Start relaying messages from the other workers, a no-op unless [websocket] relay is on"""
+        if self.redis_client is None or self._relay is not None:
+            return
+        self._pubsub = self.redis_client.pubsub()
+        await self._sync_subscriptions()
+        self._relay = asyncio.create_task(self._relay_loop())
+
+    async def close(self):
+        if self._relay is not None:
+            self._relay.cancel()
+            await asyncio.gather(self._relay, return_exceptions=True)
+            self._relay = None
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+            self._pubsub = None
+            self._subscribed = set()
+        for connection in list(self.connections.values()):
+            self.disconnect(connection.websocket)
+            await self._close(connection.websocket, 1001)
+        await asyncio.gather(*self._closing, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "connections": len(self.connections),
+            "channels": len(self.channels),
+            "queued": sum(connection.queue.qsize() for connection in self.connections.values()),
+            "tasks": sum(len(connection.tasks) for connection in self.connections.values()),
+            "policy": self.policy,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "slow_disconnects": self.slow_disconnects,
+            "relayed": self.relayed,
+            "relay": self._relay is not None
+        }
 
     async def handler(self, websocket: WebSocket, on_message: Callable[[str], Awaitable[None]] = on_message):
-        await websocket.accept()
+        # connect() has already accepted the socket
         try:
             while True:
                 data = await websocket.receive_text()
                 await on_message(data)
         except Exception as e:
-            await websocket.close()
+            await self._close(websocket, 1000)
         finally:
             self.disconnect(websocket)
-
-    async def send_personal_message(self, message: str, websocket: WebSocket):
-        await websocket.send_text(message)
-
-    async def broadcast(self, message: str):
-        for connection in self.active_connections:
-            await connection.send_text(message)
\ No newline at end of file
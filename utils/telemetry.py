@@ -0,0 +1,212 @@
+import time
+import bisect
+import threading
+from typing import Any, Dict, Optional
+
+import dspy
+from dspy.utils.callback import BaseCallback
+
+from conf import config
+from utils import logger
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+def _labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+    escape = lambda value: str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+    pairs = ",".join(f'{name}="{escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY[name] = self
+
+    def _key(self, labels: Dict[str, Any]) -> tuple:
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        for key, value in self._values.items():
+            lines.append(f"{self.name}{_labels(self.labelnames, key)} {value}")
+        return lines
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.setdefault(key, [[0] * (len(self.buckets) + 1), 0.0])
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key][1] = total + value
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        for key, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else str(bound)
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames + ('le',), key + (le,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+REGISTRY: Dict[str, _Metric] = {}
+
+STAGE_SECONDS = Histogram("jean_stage_seconds", "Latency of each query pipeline stage", ("stage",))
+STAGE_INFLIGHT = Gauge("jean_stage_inflight", "Pipeline stages currently running", ("stage",))
+STAGE_ERRORS = Counter("jean_stage_errors_total", "Pipeline stages that raised an error", ("stage",))
+TOKENS = Counter("jean_tokens_total", "LLM tokens used per stage and model", ("stage", "model", "kind"))
+TOOL_SECONDS = Histogram("jean_tool_call_seconds", "Latency of MCP tool calls", ("tool",))
+TOOL_ERRORS = Counter("jean_tool_call_errors_total", "MCP tool calls that raised an error", ("tool",))
+JOBS = Gauge("jean_jobs", "Background jobs per state, lag_seconds is the age of the oldest queued job", ("state",))
+OBSERVATION_TOKENS_SAVED = Counter("jean_observation_tokens_saved_total", "Tokens removed from ReAct trajectories by observation compaction", ("agent",))
+MCP_EVICTIONS = Counter("jean_mcp_evictions_total", "Idle MCP servers stopped by lazy activation", ("agent",))
+LM_SECONDS = Histogram("jean_lm_call_seconds", "Latency of single LM calls", ("model",))
+QUERIES_COALESCED = Counter("jean_queries_coalesced_total", "Requests answered by an identical query that was already running", ("kind",))
+WS_CONNECTIONS = Gauge("jean_websocket_connections", "Open websocket connections of this worker")
+WS_DROPPED = Counter("jean_websocket_dropped_total", "Websocket messages dropped or connections closed because a client fell behind", ("policy",))
+
+def render_metrics() -> str:
+    lines = []
+    for metric in list(REGISTRY.values()):
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+_tracer = None
+
+def setup_tracing():
+    """Export spans over OTLP when [telemetry] otlp_endpoint is set and opentelemetry is installed"""
+    global _tracer
+    dspy.settings.configure(track_usage=True, callbacks=[*(getattr(dspy.settings, "callbacks", None) or []), TelemetryCallback()])
+    endpoint = config.get("telemetry", "otlp_endpoint", fallback="")
+    if not endpoint:
+        return
+    try:
+        from opentelemetry import trace
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+    except ImportError:
+        logger.warning("otlp_endpoint is set but opentelemetry is not installed, traces are not exported")
+        return
+    provider = TracerProvider(resource=Resource.create({"service.name": config.get("telemetry", "service_name", fallback="jean")}))
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter(endpoint=endpoint)))
+    trace.set_tracer_provider(provider)
+    _tracer = trace.get_tracer("jean")
+
+class span:
+    """Time a pipeline stage: latency histogram, in-flight gauge, error counter and an optional OTLP span.
+    Usable as `with span("coordinator", model=name) as s:` in sync and async code"""
+    def __init__(self, stage: str, **attributes):
+        self.stage = stage
+        self.attributes = attributes
+        self._otel = None
+        self._otel_context = None
+
+    def set(self, key: str, value: Any):
+        self.attributes[key] = value
+        if self._otel is not None:
+            self._otel.set_attribute(key, value)
+
+    def record_usage(self, prediction: Any):
+        """Token counts of a dspy prediction, only available when usage tracking is on"""
+        get_lm_usage = getattr(prediction, "get_lm_usage", None)
+        usage = get_lm_usage() if get_lm_usage else None
+        for model, counts in (usage or {}).items():
+            for kind in ("prompt_tokens", "completion_tokens"):
+                if counts.get(kind):
+                    TOKENS.inc(counts[kind], stage=self.stage, model=model, kind=kind)
+                    self.set(f"{model}.{kind}", counts[kind])
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        STAGE_INFLIGHT.inc(stage=self.stage)
+        if _tracer is not None:
+            self._otel_context = _tracer.start_as_current_span(self.stage, attributes={k: str(v) for k, v in self.attributes.items()})
+            self._otel = self._otel_context.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        elapsed = time.perf_counter() - self._started
+        STAGE_INFLIGHT.dec(stage=self.stage)
+        STAGE_SECONDS.observe(elapsed, stage=self.stage)
+        if exc_type is not None:
+            STAGE_ERRORS.inc(stage=self.stage)
+        logger.debug(f"span {self.stage} {elapsed:.3f}s {self.attributes}")
+        if self._otel_context is not None:
+            self._otel_context.__exit__(exc_type, exc_val, exc_tb)
+        return False
+
+class TelemetryCallback(BaseCallback):
+    """dspy callback timing every LM call, MCP tool call and ReAct iteration"""
+    def __init__(self):
+        self._started: Dict[str, tuple[float, str, Optional[span]]] = {}
+
+    def on_module_start(self, call_id: str, instance: Any, inputs: Dict[str, Any]):
+        signature = getattr(instance, "signature", None)
+        if signature is not None and "next_thought" in signature.output_fields:
+            self._started[call_id] = (time.perf_counter(), "", span("react_iteration").__enter__())
+
+    def on_module_end(self, call_id: str, outputs: Optional[Any], exception: Optional[Exception] = None):
+        _, _, iteration = self._started.pop(call_id, (0, "", None))
+        if iteration is not None:
+            iteration.__exit__(type(exception) if exception else None, exception, None)
+
+    def on_lm_start(self, call_id: str, instance: Any, inputs: Dict[str, Any]):
+        self._started[call_id] = (time.perf_counter(), getattr(instance, "model", ""), None)
+
+    def on_lm_end(self, call_id: str, outputs: Optional[Dict[str, Any]], exception: Optional[Exception] = None):
+        started = self._started.pop(call_id, None)
+        if started is not None:
+            LM_SECONDS.observe(time.perf_counter() - started[0], model=started[1])
+
+    def on_tool_start(self, call_id: str, instance: Any, inputs: Dict[str, Any]):
+        self._started[call_id] = (time.perf_counter(), getattr(instance, "name", ""), None)
+
+    def on_tool_end(self, call_id: str, outputs: Optional[Dict[str, Any]], exception: Optional[Exception] = None):
+        started = self._started.pop(call_id, None)
+        if started is None:
+            return
+        TOOL_SECONDS.observe(time.perf_counter() - started[0], tool=started[1])
+        if exception is not None:
+            TOOL_ERRORS.inc(tool=started[1])
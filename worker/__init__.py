@@ -0,0 +1,177 @@
+import os
+import json
+import time
+import socket
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import redis.asyncio as redis
+from redis.exceptions import ResponseError
+
+from conf import config
+from utils import logger
+
+class JobQueue:
+    """Durable job queue on a Redis stream. A consumer group lets several worker processes share the jobs,
+    failed jobs are retried with exponential backoff through a delayed sorted set and dead-lettered
+    once they fail max_attempts times"""
+    def __init__(self, redis_client: redis.Redis, stream: str = "jobs", group: str = "workers", max_attempts: int = 5,
+                 backoff_base: float = 2, backoff_max: float = 300, visibility_timeout: float = 300, maxlen: int = 100000):
+        self.redis = redis_client
+        self.stream = stream
+        self.group = group
+        self.delayed = f"{stream}:delayed"
+        self.dead = f"{stream}:dead"
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.visibility_timeout = visibility_timeout
+        self.maxlen = maxlen
+
+    @classmethod
+    def from_config(cls, redis_client: redis.Redis) -> "JobQueue":
+        return cls(
+            redis_client,
+            stream=config.get("jobs", "stream", fallback="jobs"),
+            group=config.get("jobs", "group", fallback="workers"),
+            max_attempts=config.getint("jobs", "max_attempts", fallback=5),
+            backoff_base=config.getfloat("jobs", "backoff_base", fallback=2),
+            backoff_max=config.getfloat("jobs", "backoff_max", fallback=300),
+            visibility_timeout=config.getfloat("jobs", "visibility_timeout", fallback=300),
+            maxlen=config.getint("jobs", "maxlen", fallback=100000)
+        )
+
+    async def enqueue(self, name: str, payload: dict, attempts: int = 0) -> str:
+        return await self.redis.xadd(self.stream, {"name": name, "payload": json.dumps(payload), "attempts": attempts}, maxlen=self.maxlen, approximate=True)
+
+    async def ensure_group(self):
+        try:
+            await self.redis.xgroup_create(self.stream, self.group, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def ack(self, job_id: str):
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.xack(self.stream, self.group, job_id)
+            pipe.xdel(self.stream, job_id)
+            await pipe.execute()
+
+    def backoff(self, attempts: int) -> float:
+        return min(self.backoff_max, self.backoff_base ** attempts)
+
+    async def retry_or_bury(self, job_id: str, fields: dict, error: Exception):
+        """Schedule the job again after a backoff, or move it to the dead-letter stream"""
+        attempts = int(fields.get("attempts", 0)) + 1
+        async with self.redis.pipeline(transaction=True) as pipe:
+            if attempts >= self.max_attempts:
+                logger.error(f"Job {fields.get('name')} {job_id} dead-lettered after {attempts} attempts: {error}")
+                pipe.xadd(self.dead, {**fields, "attempts": attempts, "error": str(error)}, maxlen=self.maxlen, approximate=True)
+            else:
+                logger.warning(f"Job {fields.get('name')} {job_id} failed, attempt {attempts} of {self.max_attempts}: {error}")
+                pipe.zadd(self.delayed, {json.dumps({**fields, "attempts": attempts}): time.time() + self.backoff(attempts)})
+            pipe.xack(self.stream, self.group, job_id)
+            pipe.xdel(self.stream, job_id)
+            await pipe.execute()
+
+    async def promote_delayed(self, limit: int = 100):
+        """Move retries whose backoff has elapsed back onto the stream"""
+        due = await self.redis.zrangebyscore(self.delayed, 0, time.time(), start=0, num=limit)
+        for member in due:
+            # only the worker that removes the member re-enqueues it
+            if await self.redis.zrem(self.delayed, member):
+                fields = json.loads(member)
+                await self.redis.xadd(self.stream, fields, maxlen=self.maxlen, approximate=True)
+
+    async def stats(self) -> dict:
+        """Queue depth by state, lag_seconds is the age of the oldest job still in the stream"""
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.xlen(self.stream)
+            pipe.zcard(self.delayed)
+            pipe.xlen(self.dead)
+            pipe.xrange(self.stream, count=1)
+            length, delayed, dead, oldest = await pipe.execute()
+        try:
+            pending = (await self.redis.xpending(self.stream, self.group))["pending"]
+        except ResponseError:
+            pending = 0
+        lag = time.time() - int(oldest[0][0].split("-")[0]) / 1000 if oldest else 0.0
+        return {
+            "waiting": length - pending,
+            "running": pending,
+            "delayed": delayed,
+            "dead": dead,
+            "lag_seconds": round(lag, 3)
+        }
+
+class Worker:
+    """Consume a JobQueue with at most `parallelism` jobs running at once, handlers are async callables
+    receiving the job payload as keyword arguments"""
+    def __init__(self, queue: JobQueue, handlers: Dict[str, Callable[..., Awaitable[Any]]], parallelism: int = 4, consumer: Optional[str] = None):
+        self.queue = queue
+        self.handlers = handlers
+        self.parallelism = parallelism
+        self.consumer = consumer or f"{socket.gethostname()}-{os.getpid()}"
+        self._tasks: set[asyncio.Task] = set()
+        self._running: Dict[str, asyncio.Task] = {}
+        self._last_refresh = time.monotonic()
+
+    def _spawn(self, job_id: str, fields: dict):
+        if job_id in self._running:
+            return
+        task = asyncio.create_task(self._process(job_id, fields))
+        self._tasks.add(task)
+        self._running[job_id] = task
+        task.add_done_callback(self._tasks.discard)
+        task.add_done_callback(lambda done: self._running.pop(job_id, None))
+
+    async def _process(self, job_id: str, fields: dict):
+        handler = self.handlers.get(fields.get("name"))
+        try:
+            if handler is None:
+                raise ValueError(f"No handler for job {fields.get('name')}")
+            await handler(**json.loads(fields["payload"]))
+        except Exception as e:
+            await self.queue.retry_or_bury(job_id, fields, e)
+            return
+        await self.queue.ack(job_id)
+
+    async def _maintenance(self):
+        await self.queue.promote_delayed()
+        # a job running longer than the visibility timeout is not abandoned, reset its idle time so no worker,
+        # this one included, claims and runs it a second time
+        if self._running and time.monotonic() - self._last_refresh > self.queue.visibility_timeout / 3:
+            self._last_refresh = time.monotonic()
+            await self.queue.redis.xclaim(self.queue.stream, self.queue.group, self.consumer, min_idle_time=0,
+                                          message_ids=list(self._running), justid=True)
+        # jobs delivered to a worker that died are claimed again once they stay unacked past the visibility timeout
+        claimed = await self.queue.redis.xautoclaim(self.queue.stream, self.queue.group, self.consumer,
+                                                    min_idle_time=int(self.queue.visibility_timeout * 1000), count=self.parallelism)
+        for job_id, fields in claimed[1]:
+            if fields:
+                self._spawn(job_id, fields)
+
+    async def run(self, stop: asyncio.Event):
+        await self.queue.ensure_group()
+        logger.info(f"Worker {self.consumer} consuming {self.queue.stream} with parallelism {self.parallelism}")
+        last_maintenance = 0.0
+        while not stop.is_set():
+            try:
+                if time.monotonic() - last_maintenance > 1:
+                    last_maintenance = time.monotonic()
+                    await self._maintenance()
+                free = self.parallelism - len(self._tasks)
+                if free <= 0:
+                    await asyncio.wait(self._tasks, timeout=1, return_when=asyncio.FIRST_COMPLETED)
+                    continue
+                response = await self.queue.redis.xreadgroup(self.queue.group, self.consumer, {self.queue.stream: ">"}, count=free, block=1000)
+                for _, entries in response or []:
+                    for job_id, fields in entries:
+                        self._spawn(job_id, fields)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Worker {self.consumer} error: {e}")
+                await asyncio.sleep(1)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
@@ -0,0 +1,25 @@
+"""Run background job workers in their own process: python -m worker"""
+import signal
+import asyncio
+
+from conf import config
+from memory import Memory
+from worker import JobQueue, Worker
+
+async def main():
+    memory = Memory()
+    memory.start()
+    queue = JobQueue.from_config(memory.memcache.redis_client)
+    worker = Worker(queue, handlers={"memory.add": memory.adding_new_memory}, parallelism=config.getint("jobs", "parallelism", fallback=4))
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        await worker.run(stop)
+    finally:
+        await memory.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())